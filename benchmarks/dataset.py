@@ -0,0 +1,240 @@
+"""
+Synthetic dataset generator
+
+Writes a realistic catalog and user base straight into an empty database given by --database:
+olympiads with Russian titles, subjects, grade ranges and one to four stages around today,
+users (username user<N>, mail user<N>@example.com, password PASSWORD) with favorites,
+participates and notifications lists skewed towards popular olympiads, and pending notifications.
+Rows are inserted with executemany batches, one transaction per batch, so millions of rows
+take minutes, not hours. The same --seed gives the same dataset (dates are relative to today).
+The database is never taken from config.toml, and a database which already has users or olympiads is refused,
+so the application database can not be filled with synthetic rows by mistake
+
+Usage (from the directory with config.toml):
+    python -m benchmarks.dataset --database sqlite+aiosqlite:///big.db --olympiads 200000 --users 1000000 \
+        --favorites 5 --notifications 10000000
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List
+
+from loguru import logger
+from sqlalchemy import insert, select
+
+from src.setup import settings
+
+PASSWORD = 'benchmark'
+
+SUBJECTS = ('Математика', 'Информатика', 'Физика', 'Химия', 'Биология', 'География', 'История',
+            'Обществознание', 'Право', 'Экономика', 'Русский язык', 'Литература', 'Английский язык',
+            'Немецкий язык', 'Французский язык', 'Астрономия', 'Экология', 'Искусство', 'Технология',
+            'Робототехника')
+TITLE_PREFIXES = ('Всероссийская олимпиада школьников по предмету', 'Олимпиада «Высшая проба» по предмету',
+                  'Московская олимпиада школьников по предмету', 'Олимпиада «Покори Воробьёвы горы!» по предмету',
+                  'Межрегиональная олимпиада школьников по предмету', 'Олимпиада «Физтех» по предмету',
+                  'Открытая олимпиада школьников по предмету', 'Турнир юных знатоков по предмету',
+                  'Олимпиада СПбГУ по предмету', 'Олимпиада «Ломоносов» по предмету')
+STAGE_NAMES = ('Отборочный этап', 'Региональный этап', 'Очный тур', 'Заключительный этап')
+DESCRIPTIONS = ('Олимпиада проводится в два этапа: дистанционный отборочный и очный заключительный.',
+                'Победители и призёры получают льготы при поступлении в вузы.',
+                'Задания составлены преподавателями ведущих университетов.',
+                None)
+
+# Olympiad popularity follows Zipf's law: a few olympiads are in most of user lists
+ZIPF_EXPONENT = 1.1
+
+
+class DatabaseNotEmptyError(RuntimeError):
+    """
+    Raised when dataset is about to be written into a database which already has users or olympiads
+    """
+
+
+def generate_olympiad(rng: random.Random, number: int, today: date) -> Dict:
+    """
+    Generates one olympiad in crud.upsert_olympiads format
+
+    Args:
+        rng: random generator
+        number: olympiad number, becomes site_data
+        today: date stages are placed around
+
+    Returns: olympiad dict
+
+    """
+    subjects = rng.sample(SUBJECTS, rng.choice((1, 1, 1, 2, 3)))
+    first_grade = rng.randint(5, 11)
+    start = today + timedelta(days=rng.randint(-120, 240))
+    stages = []
+
+    for name in STAGE_NAMES[-rng.randint(1, len(STAGE_NAMES)):]:
+        length = rng.choice((0, 0, 1, 2, 6))
+        stages.append({'name': name,
+                       'start_date': start,
+                       'end_date': start + timedelta(days=length) if length else None})
+        start += timedelta(days=rng.randint(14, 60))
+
+    return {'title': f'{rng.choice(TITLE_PREFIXES)} «{subjects[0]}» №{number}',
+            'level': rng.choice((1, 2, 3, None)),
+            'description': rng.choice(DESCRIPTIONS),
+            'subjects': subjects,
+            'classes': list(range(first_grade, rng.randint(first_grade, 11) + 1)),
+            'site_data': f'synthetic-{number}',
+            'stages': stages}
+
+
+def batches(iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+async def insert_olympiads(rng: random.Random, olympiads: int, today: date, batch_size: int) -> None:
+    from src.aggregator.database import crud
+    from src.setup import unit_of_work
+
+    generated = (generate_olympiad(rng, number, today) for number in range(1, olympiads + 1))
+    for batch in batches(generated, batch_size):
+        async with unit_of_work() as session:
+            await crud.upsert_olympiads(session, batch)
+
+
+async def insert_users(rng: random.Random, users: int, olympiads: int, favorites: int, batch_size: int) -> None:
+    from src.aggregator.database import User, UserOlympiad
+    from src.setup import get_password_context, unit_of_work
+
+    # ids are assigned in insert order, so on an empty database user<N> gets id N.
+    # One hash for everybody, hashing a million passwords would take days
+    hashed_password = get_password_context().hash(PASSWORD)
+    cum_weights = list(itertools.accumulate(1 / rank ** ZIPF_EXPONENT for rank in range(1, olympiads + 1)))
+    created_at = datetime.now()
+
+    for batch in batches(range(1, users + 1), batch_size):
+        links = []
+        for user_id in batch:
+            for kind, size in (('favorites', favorites), ('participates', favorites // 2),
+                               ('notifications', favorites // 3)):
+                chosen = set(rng.choices(range(1, olympiads + 1), cum_weights=cum_weights, k=rng.randint(0, size * 2)))
+                links += [{'user_id': user_id, 'olympiad_id': olympiad_id, 'kind': kind, 'created_at': created_at}
+                          for olympiad_id in chosen]
+
+        async with unit_of_work() as session:
+            await session.execute(insert(User.__table__),
+                                  [{'username': f'user{user_id}', 'mail': f'user{user_id}@example.com',
+                                    'hashed_password': hashed_password, 'n': rng.choice((1, 3, 7, 14))}
+                                   for user_id in batch])
+            if links:
+                await session.execute(insert(UserOlympiad.__table__), links)
+
+
+async def insert_notifications(rng: random.Random, notifications: int, users: int, olympiads: int, today: date,
+                               batch_size: int) -> None:
+    from src.aggregator.database import Notification
+    from src.setup import unit_of_work
+
+    midnight = datetime.combine(today, datetime.min.time())
+
+    for batch in batches(range(notifications), batch_size):
+        rows = [{'user_id': rng.randint(1, users),
+                 'olympiad_id': rng.randint(1, olympiads),
+                 'text': 'Напоминание об олимпиаде',
+                 'date': midnight + timedelta(days=rng.randint(-1, 60))}
+                for _ in batch]
+        async with unit_of_work() as session:
+            await session.execute(insert(Notification.__table__), rows)
+
+
+async def generate(olympiads: int, users: int, favorites: int, notifications: int, seed: int = 0,
+                   today: date | None = None, batch_size: int = 10000) -> Dict[str, float]:
+    """
+    Fills empty database with synthetic dataset
+
+    Args:
+        olympiads: number of olympiads
+        users: number of users
+        favorites: average size of user favorites list (participates and notifications lists are smaller)
+        notifications: number of pending notifications, need users and olympiads
+        seed: random seed
+        today: date stages and notifications are placed around, today by default
+        batch_size: rows inserted per statement and transaction
+
+    Returns: seconds spent on every table group
+
+    Raises:
+        DatabaseNotEmptyError: if database already has users or olympiads
+
+    """
+    from src.aggregator.database import Olympiad, User
+    from src.setup import get_session_maker
+
+    session_maker = await get_session_maker()
+    async with session_maker() as session:
+        # user<N> must get id N, and the application database must not get synthetic rows
+        for model in (User, Olympiad):
+            if await session.scalar(select(model.id).limit(1)) is not None:
+                raise DatabaseNotEmptyError(f'Table {model.__tablename__} of {settings.database.connection_string} '
+                                            f'is not empty, dataset is written only into an empty database')
+
+    rng = random.Random(seed)
+    today = today or date.today()
+    timings = {}
+
+    start = time.perf_counter()
+    # olympiads are much wider than other rows, smaller batches keep statements reasonable
+    await insert_olympiads(rng, olympiads, today, max(batch_size // 10, 1))
+    timings['olympiads'] = time.perf_counter() - start
+
+    if users and olympiads:
+        start = time.perf_counter()
+        await insert_users(rng, users, olympiads, favorites, batch_size)
+        timings['users'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await insert_notifications(rng, notifications, users, olympiads, today, batch_size)
+        timings['notifications'] = time.perf_counter() - start
+
+    return timings
+
+
+async def run(args: argparse.Namespace) -> Dict[str, float]:
+    from src.setup import dispose_session_maker
+
+    try:
+        return await generate(args.olympiads, args.users, args.favorites, args.notifications, args.seed,
+                              batch_size=args.batch_size)
+    finally:
+        await dispose_session_maker()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--olympiads', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--favorites', type=int, default=5, help='average favorites per user')
+    parser.add_argument('--notifications', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--database', required=True, help='connection string of an empty database')
+    args = parser.parse_args()
+
+    logger.remove()
+
+    settings.database.connection_string = args.database
+    settings.database.replicas = []  # replicas of config.toml are not copies of the target database
+    settings.database.auto_migrate = True
+
+    try:
+        timings = asyncio.run(run(args))
+    except DatabaseNotEmptyError as error:
+        parser.exit(1, f'{error}\n')
+
+    for name, seconds in timings.items():
+        print(f'{name}: {seconds:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
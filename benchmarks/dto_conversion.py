@@ -0,0 +1,99 @@
+"""
+Benchmark for olympiad list reads
+
+Loads every olympiad of a scratch SQLite database as OlympiadSchema DTOs in two ways and prints
+the time of each:
+    orm   - select(Olympiad) entities (stages loaded with selectin) + model_validate of every DTO,
+            how list endpoints worked before
+    core  - crud.get_all_olympiads: plain column tuples + precompiled converters with model_construct
+
+Usage (from the directory with config.toml):
+    python -m benchmarks.dto_conversion --olympiads 10000 --repeat 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from datetime import date
+
+from loguru import logger
+from sqlalchemy import select
+
+from src.setup import settings
+
+
+async def seed(olympiads: int) -> None:
+    from src.aggregator.database import crud
+    from src.setup import unit_of_work
+
+    async with unit_of_work() as session:
+        for i in range(olympiads):
+            await crud.add_olympiad(session=session,
+                                    title=f'Олимпиада {i}',
+                                    dates={'Отборочный этап': [date(2099, 1, 10)],
+                                           'Заключительный этап': [date(2099, 3, 1), date(2099, 3, 5)]},
+                                    subjects=['Математика', 'Информатика'],
+                                    classes=[9, 10, 11],
+                                    site_data=str(i))
+
+
+async def load_orm(session) -> list:
+    from src.aggregator.DTOs import OlympiadSchema
+    from src.aggregator.database import Olympiad
+
+    olympiads = (await session.scalars(select(Olympiad).order_by(Olympiad.id))).all()
+    return [OlympiadSchema.model_validate(olympiad, from_attributes=True) for olympiad in olympiads]
+
+
+async def load_core(session) -> list:
+    from src.aggregator.database import crud
+
+    return await crud.get_all_olympiads(session)
+
+
+async def run(olympiads: int, repeat: int) -> dict:
+    from src.setup import get_session_maker, dispose_session_maker
+
+    session_maker = await get_session_maker()
+    await seed(olympiads)
+
+    timings = {}
+    for name, load in (('orm', load_orm), ('core', load_core)):
+        timings[name] = []
+        for _ in range(repeat + 1):
+            # new session every time, so the ORM path never reuses identity map of the previous run
+            async with session_maker() as session:
+                start = time.perf_counter()
+                loaded = await load(session)
+                timings[name].append(time.perf_counter() - start)
+
+            assert len(loaded) == olympiads
+        timings[name] = timings[name][1:]  # first run warms up caches
+
+    await dispose_session_maker()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--olympiads', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    logger.remove()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.database.connection_string = f'sqlite+aiosqlite:///{os.path.join(tmp, "bench.db")}'
+        settings.database.auto_migrate = True
+        settings.database.replicas = []  # replicas of config.toml are not copies of the scratch database
+        timings = asyncio.run(run(args.olympiads, args.repeat))
+
+    for name, runs in timings.items():
+        print(f'{name}: median {statistics.median(runs) * 1000:.1f} ms, best {min(runs) * 1000:.1f} ms '
+              f'({args.olympiads} olympiads, {args.repeat} runs)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Import time budget of process entry points
+
+Imports every entry point in a fresh interpreter with python -X importtime and checks its list of
+modules which must stay lazy (imported only by functions which need them, see src/setup.py), this is
+the hard gate. Import time is checked relative to REFERENCE imported in a fresh interpreter right before
+every import of the entry point: the budget is the median ratio of --repeat such pairs, so a slower or
+busy machine slows both down. Budgets leave about 25% over ratios measured on an unchanged tree.
+Prints the heaviest top-level packages and exits with code 1 if any entry point is over budget or
+imports a forbidden module.
+    src.setup                                      - every process
+    src.aggregator.service_layer.backgruond_tasks  - scheduler process
+    src.aggregator.service_layer.catalog_transfer  - command line tools
+    src.aggregator.api.router                      - API worker (whole app)
+
+Usage (from the repository root or with it on PYTHONPATH):
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --repeat 11 --scale 1.2
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# third-party packages every entry point needs, their import time is the unit of budgets
+REFERENCE = 'sqlalchemy.ext.asyncio,pydantic'
+
+# entry point: (budget as import time of REFERENCE times, modules it must not import)
+ENTRY_POINTS: Dict[str, Tuple[float, Tuple[str, ...]]] = {
+    'src.setup': (2.5, ('fastapi', 'starlette', 'rocketry', 'passlib', 'smtplib')),
+    'src.aggregator.service_layer.backgruond_tasks': (3.9, ('fastapi', 'starlette', 'passlib')),
+    'src.aggregator.service_layer.catalog_transfer': (2.5, ('fastapi', 'starlette', 'rocketry', 'passlib')),
+    'src.aggregator.api.router': (5.5, ('rocketry', 'passlib')),
+}
+
+
+def import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Imports module in a fresh interpreter
+
+    Args:
+        module: module name
+
+    Returns: (self, cumulative) microseconds by name of every imported module
+
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'Can not import {module}:\n{result.stderr}')
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_time), int(cumulative))
+
+    return times
+
+
+def total_time(times: Dict[str, Tuple[int, int]]) -> float:
+    """
+    Returns: time of all imports, milliseconds
+
+    """
+    return sum(self_time for self_time, _ in times.values()) / 1000
+
+
+def heaviest_packages(times: Dict[str, Tuple[int, int]], count: int) -> List[Tuple[str, float]]:
+    packages = defaultdict(int)
+    for name, (self_time, _) in times.items():
+        packages[name.split('.')[0]] += self_time
+
+    return [(package, total / 1000) for package, total in sorted(packages.items(), key=lambda item: -item[1])][:count]
+
+
+def check(module: str, budget: float, forbidden: Tuple[str, ...], repeat: int) -> List[str]:
+    """
+    Args:
+        module: entry point
+        budget: allowed import time relative to REFERENCE
+        forbidden: top-level packages entry point must not import
+        repeat: number of fresh imports of REFERENCE and entry point, the median ratio is checked
+
+    Returns: descriptions of problems, empty if there are none
+
+    """
+    runs, ratios = [], []
+    for _ in range(repeat):
+        reference = total_time(import_times(REFERENCE))
+        runs.append(import_times(module))
+        ratios.append(total_time(runs[-1]) / reference)
+
+    best = min(runs, key=total_time)
+    ratio = statistics.median(ratios)
+    problems = []
+
+    print(f'{module}: {ratio:.2f} x reference (budget {budget:.2f}), best {total_time(best):.0f} ms')
+    print('    ' + ', '.join(f'{package} {milliseconds:.0f} ms' for package, milliseconds in heaviest_packages(best, 8)))
+
+    if ratio > budget:
+        problems.append(f'{module} imports in {ratio:.2f} x reference time, budget is {budget:.2f}')
+    imported = {name.split('.')[0] for name in best}
+    for package in forbidden:
+        if package in imported:
+            problems.append(f'{module} imports {package}, it must be imported lazily')
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of budgets')
+    args = parser.parse_args()
+
+    problems = []
+    for module, (budget, forbidden) in ENTRY_POINTS.items():
+        problems += check(module, budget * args.scale, forbidden, args.repeat)
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+End-to-end API load benchmark
+
+Drives the real FastAPI app in-process (ASGI transport, no network) through scenarios and writes
+throughput and latency percentiles of every scenario as JSON, so results of two commits can be diffed:
+    browse           - anonymous GET / (whole catalog)
+    filtered_browse  - anonymous GET / with grade and subject filters
+    search           - anonymous GET /?search=...
+    detail           - anonymous GET /olympiad/{id}
+    login_storm      - POST /auth of random users (bcrypt bound, so it gets --login-requests requests)
+    favorites_churn  - logged in users adding and removing favorites
+
+Without --database a scratch SQLite database is filled by benchmarks.dataset first. With --database
+an existing dataset made by benchmarks.dataset is used as it is (favorites_churn changes it).
+
+Usage (from the directory with config.toml):
+    python -m benchmarks.load --output before.json
+    python -m benchmarks.load --olympiads 20000 --users 10000 --scenarios browse detail --output after.json
+    python -m benchmarks.load --database sqlite+aiosqlite:///big.db --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import httpx
+from loguru import logger
+from sqlalchemy import func, select
+
+from benchmarks.dataset import PASSWORD, SUBJECTS, generate
+from src.setup import settings
+
+# One request of a scenario: (client, random generator, dataset sizes, id of logged in user) -> response
+Request = Callable[[httpx.AsyncClient, random.Random, Dict[str, int], int | None], Awaitable[httpx.Response]]
+
+
+async def browse(client, rng, dataset, user_id):
+    return await client.get('/')
+
+
+async def filtered_browse(client, rng, dataset, user_id):
+    return await client.get('/', params={'grades': rng.randint(5, 11), 'subjects': rng.sample(SUBJECTS, 2)})
+
+
+async def search(client, rng, dataset, user_id):
+    return await client.get('/', params={'search': rng.choice(SUBJECTS)})
+
+
+async def detail(client, rng, dataset, user_id):
+    return await client.get(f'/olympiad/{rng.randint(1, dataset["olympiads"])}')
+
+
+async def login_storm(client, rng, dataset, user_id):
+    return await client.post('/auth', data={'username': f'user{rng.randint(1, dataset["users"])}',
+                                            'password': PASSWORD})
+
+
+async def favorites_churn(client, rng, dataset, user_id):
+    olympiad_id = rng.randint(1, dataset['olympiads'])
+    if rng.random() < 0.5:
+        return await client.post(f'/user/{user_id}/favorites', json=olympiad_id)
+
+    return await client.delete(f'/user/{user_id}/favorites/{olympiad_id}')
+
+
+# name: (request, whether every worker logs in as its own user first)
+SCENARIOS: Dict[str, Tuple[Request, bool]] = {
+    'browse': (browse, False),
+    'filtered_browse': (filtered_browse, False),
+    'search': (search, False),
+    'detail': (detail, False),
+    'login_storm': (login_storm, False),
+    'favorites_churn': (favorites_churn, True),
+}
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    """
+    Args:
+        latencies: request latencies, seconds
+        errors: number of responses with 4xx/5xx status
+        elapsed: wall time of the scenario, seconds
+
+    Returns: scenario report, latencies in milliseconds
+
+    """
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+
+    return {'requests': len(latencies),
+            'errors': errors,
+            'seconds': round(elapsed, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+            'p50_ms': round(percentiles[49] * 1000, 3),
+            'p95_ms': round(percentiles[94] * 1000, 3),
+            'p99_ms': round(percentiles[98] * 1000, 3),
+            'max_ms': round(max(latencies) * 1000, 3)}
+
+
+async def run_scenario(app, name: str, requests: int, concurrency: int, warmup: int, dataset: Dict[str, int],
+                       seed: int) -> Dict[str, float]:
+    request, authenticated = SCENARIOS[name]
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+
+    clients = [httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench')
+               for _ in range(concurrency if authenticated else 1)]
+    user_ids = [None] * len(clients)
+
+    try:
+        if authenticated:
+            for i, client in enumerate(clients):
+                response = await client.post('/auth', data={'username': f'user{i % dataset["users"] + 1}',
+                                                            'password': PASSWORD})
+                assert response.status_code == 200, response.text
+                user_ids[i] = response.json()['id']
+
+        for _ in range(warmup):
+            await request(clients[0], rng, dataset, user_ids[0])
+
+        queue = iter(range(requests))
+
+        async def worker(number: int):
+            nonlocal errors
+
+            client, user_id = clients[number % len(clients)], user_ids[number % len(clients)]
+            for _ in queue:
+                start = time.perf_counter()
+                response = await request(client, rng, dataset, user_id)
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code >= 400
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(number) for number in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        for client in clients:
+            await client.aclose()
+
+    return summarize(latencies, errors, elapsed)
+
+
+async def count_dataset() -> Dict[str, int]:
+    from src.aggregator.database import Olympiad, User
+    from src.setup import get_session_maker
+
+    session_maker = await get_session_maker()
+    async with session_maker() as session:
+        return {'olympiads': await session.scalar(select(func.count()).select_from(Olympiad)),
+                'users': await session.scalar(select(func.count()).select_from(User))}
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    from src.setup import setup_fastapi, dispose_session_maker
+
+    if not args.database:
+        await generate(args.olympiads, args.users, args.favorites, args.notifications, args.seed)
+
+    app = setup_fastapi()
+    dataset = await count_dataset()
+    report = {}
+
+    try:
+        for name in args.scenarios:
+            requests = args.login_requests if name == 'login_storm' else args.requests
+            report[name] = await run_scenario(app, name, requests, args.concurrency, args.warmup, dataset, args.seed)
+            print(f'{name}: {report[name]["throughput_rps"]} req/s, p50 {report[name]["p50_ms"]} ms, '
+                  f'p95 {report[name]["p95_ms"]} ms, p99 {report[name]["p99_ms"]} ms, '
+                  f'{report[name]["errors"]} errors', file=sys.stderr)
+    finally:
+        await dispose_session_maker()
+
+    return {'meta': {'commit': git_commit(),
+                     'date': datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(),
+                     'database': settings.database.connection_string.split(':', 1)[0],
+                     'dataset': dataset,
+                     'concurrency': args.concurrency},
+            'scenarios': report}
+
+
+def git_commit() -> str | None:
+    # benchmark usually runs from the directory with config.toml, ask the repository of this file
+    repository = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repository,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD'], cwd=repository).returncode != 0
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return commit + ('-dirty' if dirty else '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--login-requests', type=int, default=50, help='requests of login_storm')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=10, help='requests per scenario not measured')
+    parser.add_argument('--olympiads', type=int, default=1000, help='scratch dataset size')
+    parser.add_argument('--users', type=int, default=1000, help='scratch dataset size')
+    parser.add_argument('--favorites', type=int, default=5, help='scratch dataset size')
+    parser.add_argument('--notifications', type=int, default=10000, help='scratch dataset size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', help='connection string of existing dataset, scratch SQLite by default')
+    parser.add_argument('--output', help='JSON report file, stdout by default')
+    args = parser.parse_args()
+
+    logger.remove()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.database.connection_string = args.database or f'sqlite+aiosqlite:///{os.path.join(tmp, "bench.db")}'
+        settings.database.auto_migrate = True
+        settings.database.replicas = []  # replicas of config.toml are not copies of the benchmark database
+        settings.rate_limit.enabled = False  # all requests come from one address, login_storm would get 429
+        report = asyncio.run(run(args))
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""
+Micro-benchmarks of service-layer hot functions with stored baselines
+
+Every benchmark runs one operation (usually over a batch of BATCH olympiads) in calibrated loops and
+takes the best of --repeat runs. A pure Python reference operation is measured right before and after
+every benchmark, and results are kept relative to it, so the speed and the load of the machine mostly
+cancel out. Results are compared with the baselines file (--baselines): a benchmark slower than its
+baseline by more than --threshold is a regression and the exit code is 1.
+Baselines are not stored in the repository: the job which checks them records them first on the same
+machine, e.g. with the base revision checked out. crud.filter_olympiads runs against an in-memory SQLite database.
+
+Usage:
+    python -m benchmarks.micro --save                # record baselines (base revision)
+    python -m benchmarks.micro                       # compare with baselines (checked revision)
+    python -m benchmarks.micro --only humanize_classes parser --threshold 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Dict
+
+from bs4 import BeautifulSoup
+from loguru import logger
+
+from benchmarks.dataset import generate_olympiad
+from src.setup import settings
+
+BATCH = 200
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'micro.json')
+PAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages', 'olympiad.html')
+
+# Benchmarked operation: coroutine function without arguments
+Operation = Callable[[], Awaitable[object]]
+
+
+def make_olympiads(count: int) -> list:
+    from src.aggregator.DTOs import OlympiadSchema, OlympiadStageSchema
+
+    rng, today = random.Random(0), date.today()
+    olympiads = []
+    for number in range(1, count + 1):
+        olympiad = generate_olympiad(rng, number, today)
+        olympiad['stages'] = [OlympiadStageSchema(**stage) for stage in olympiad['stages']]
+        olympiads.append(OlympiadSchema(id=number, **olympiad))
+
+    return olympiads
+
+
+def make_entities(olympiads: list) -> list:
+    from src.aggregator.database import Olympiad, OlympiadStage
+
+    return [Olympiad(id=olympiad.id, title=olympiad.title, level=olympiad.level, description=olympiad.description,
+                     subjects=olympiad.subjects, classes=olympiad.classes,
+                     stages=[OlympiadStage(ordinal=ordinal, **stage.model_dump())
+                             for ordinal, stage in enumerate(olympiad.stages)])
+            for olympiad in olympiads]
+
+
+async def make_database(olympiads: list):
+    from src.aggregator.database import crud
+    from src.aggregator.database.connection import create_database_engine, initialize_database
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    settings.database.connection_string = 'sqlite+aiosqlite:///:memory:'
+    engine = create_database_engine(settings.database)
+    await initialize_database(engine, auto_migrate=True)
+
+    session = async_sessionmaker(engine, expire_on_commit=False)()
+    await crud.upsert_olympiads(session, [{**olympiad.model_dump(exclude={'id'}), 'site_data': str(olympiad.id)}
+                                          for olympiad in olympiads])
+    await session.commit()
+
+    return engine, session
+
+
+async def make_benchmarks(session, olympiads: list) -> Dict[str, Operation]:
+    from src.aggregator.DTOs import OlympiadSchema
+    from src.aggregator.database import crud
+    from src.aggregator.service_layer import utils
+    from src.aggregator.service_layer.catalog import Catalog
+    from src.aggregator.service_layer.parsers.parsers import ParserOlymp
+
+    catalog = Catalog(1, olympiads)
+    entities = make_entities(olympiads)
+    parser = ParserOlymp()
+    with open(PAGE_PATH, encoding='utf-8') as file:
+        page = file.read()
+    timetable = BeautifulSoup(page, 'html.parser').find('div', class_='left')
+    token = await utils.create_access_token({'sub': 'user1'}, timedelta(minutes=30))
+
+    async def each(function):
+        for olympiad in olympiads:
+            await function(olympiad)
+
+    async def to_dto_models():
+        return [entity.to_dto_model(OlympiadSchema) for entity in entities]
+
+    return {
+        'convert_olympiads_to_view_format': lambda: utils.convert_olympiads_to_view_format(olympiads, False, catalog),
+        'convert_olympiads_to_view_format_no_catalog': lambda: utils.convert_olympiads_to_view_format(olympiads,
+                                                                                                      False),
+        'get_nearest_date': lambda: each(utils.get_nearest_date),
+        'humanize_classes': lambda: each(utils.humanize_classes),
+        'optimize_subjects': lambda: each(utils.optimize_subjects),
+        'jsonify_dates': lambda: each(utils.jsonify_dates),
+        'to_dto_model': to_dto_models,
+        'parser_get_timetable': lambda: parser.get_timetable(timetable),
+        'parser_get_info_from_html': lambda: parser.get_info_from_html(page, 1),
+        'create_access_token': lambda: utils.create_access_token({'sub': 'user1'}, timedelta(minutes=30)),
+        'decode_access_token': lambda: utils.decode_access_token(token),
+        'crud_filter_olympiads': lambda: crud.filter_olympiads(['Математика'], [9], session),
+    }
+
+
+def make_reference(olympiads: list) -> Operation:
+    rows = [(olympiad.title, olympiad.classes, olympiad.subjects) for olympiad in olympiads]
+
+    # dicts, strings and sorting like the benchmarked functions, but code which does not change
+    async def reference():
+        groups = {}
+        for title, classes, subjects in rows:
+            groups.setdefault(len(title) % 16, []).append(f'{title}: {",".join(map(str, classes))} {subjects}')
+        return sorted(line for lines in groups.values() for line in lines)
+
+    return reference
+
+
+async def measure(operation: Operation, repeat: int, min_time: float) -> float:
+    """
+    Args:
+        operation: benchmarked operation
+        repeat: number of timed runs, the best one is taken
+        min_time: minimal duration of one run, seconds
+
+    Returns: seconds per operation
+
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            await operation()
+        elapsed = time.perf_counter() - start
+
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.2))
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            await operation()
+        best = min(best, (time.perf_counter() - start) / number)
+
+    return best
+
+
+async def measure_relative(operation: Operation, reference: Operation, repeat: int, min_time: float) -> float:
+    """
+    Returns: seconds per operation divided by seconds per reference operation measured around it
+
+    """
+    before = await measure(reference, repeat, min_time)
+    seconds = await measure(operation, repeat, min_time)
+    after = await measure(reference, repeat, min_time)
+
+    return seconds / min(before, after)
+
+
+async def run(only: list | None, repeat: int, min_time: float, baselines: Dict[str, float],
+              threshold: float) -> Dict[str, float]:
+    olympiads = make_olympiads(BATCH)
+    engine, session = await make_database(olympiads)
+    reference = make_reference(olympiads)
+
+    try:
+        benchmarks = await make_benchmarks(session, olympiads)
+        results = {}
+        for name, operation in benchmarks.items():
+            if only and not any(part in name for part in only):
+                continue
+            results[name] = await measure_relative(operation, reference, repeat, min_time)
+
+            # one noisy run must not fail CI: slow result is confirmed by a second, longer measurement
+            if name in baselines and results[name] > baselines[name] * (1 + threshold):
+                results[name] = min(results[name], await measure_relative(operation, reference, repeat * 2, min_time))
+    finally:
+        await session.close()
+        await engine.dispose()
+
+    return results
+
+
+def load_baselines(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_baselines(path: str, results: Dict[str, float]) -> None:
+    baselines = load_baselines(path)
+    baselines.setdefault('results', {}).update({name: round(ratio, 4) for name, ratio in results.items()})
+    baselines['machine'] = f'{platform.machine()} {platform.processor() or platform.system()}, ' \
+                           f'python {platform.python_version()}'
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(baselines, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def compare(results: Dict[str, float], baselines: Dict[str, float], threshold: float) -> int:
+    """
+    Prints results next to baselines
+
+    Args:
+        results: operation time relative to reference operation by benchmark
+        baselines: stored relative times by benchmark
+        threshold: allowed relative slowdown, 0.5 is 50%
+
+    Returns: number of regressions
+
+    """
+    regressions = 0
+
+    for name, ratio in results.items():
+        line = f'{name:<45} {ratio:>10.3f} x ref'
+        baseline = baselines.get(name)
+        if baseline:
+            change = ratio / baseline - 1
+            line += f'   baseline {baseline:>10.3f} x ref  {change:+7.1%}'
+            if change > threshold:
+                line += '  REGRESSION'
+                regressions += 1
+        print(line)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', help='run benchmarks whose name contains any of these strings')
+    parser.add_argument('--repeat', type=int, default=9)
+    parser.add_argument('--min-time', type=float, default=0.1, help='minimal seconds of one timed run')
+    parser.add_argument('--threshold', type=float, default=0.5, help='allowed slowdown against baseline')
+    parser.add_argument('--baselines', default=BASELINES_PATH, help='baselines file, not stored in the repository')
+    parser.add_argument('--save', action='store_true', help='store results as new baselines')
+    args = parser.parse_args()
+
+    logger.remove()
+    settings.database.replicas = []
+
+    baselines = {} if args.save else load_baselines(args.baselines).get('results', {})
+    if not args.save and not baselines:
+        parser.error(f'no baselines in {args.baselines}, record them first with --save')
+    results = asyncio.run(run(args.only, args.repeat, args.min_time, baselines, args.threshold))
+
+    regressions = compare(results, baselines, args.threshold)
+    if args.save:
+        save_baselines(args.baselines, results)
+        print(f'Baselines saved to {args.baselines}')
+    elif regressions:
+        print(f'{regressions} regressions over {args.threshold:.0%}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
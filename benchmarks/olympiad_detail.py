@@ -0,0 +1,83 @@
+"""
+Benchmark for GET /olympiad/{id}
+
+Drives the real FastAPI app in-process (ASGI transport, no network) against a scratch SQLite
+database and prints the achieved requests per second.
+
+Usage (from the directory with config.toml):
+    python -m benchmarks.olympiad_detail --requests 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import date
+
+import httpx
+from loguru import logger
+
+from src.setup import settings
+
+
+async def seed(olympiads: int) -> None:
+    from src.aggregator.database import crud
+    from src.setup import get_session_maker
+
+    session_maker = await get_session_maker()
+    async with session_maker() as session:
+        for i in range(olympiads):
+            await crud.add_olympiad(session=session,
+                                    title=f'Олимпиада {i}',
+                                    dates={'Отборочный этап': [date(2099, 1, 10)],
+                                           'Заключительный этап': [date(2099, 3, 1), date(2099, 3, 5)]},
+                                    subjects=['Математика', 'Информатика'],
+                                    classes=[9, 10, 11],
+                                    site_data=str(i))
+        await session.commit()
+
+
+async def run(requests: int, concurrency: int, olympiads: int) -> float:
+    from src.setup import setup_fastapi
+
+    app = setup_fastapi()
+    await seed(olympiads)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        queue = iter(range(requests))
+
+        async def worker():
+            for i in queue:
+                response = await client.get(f'/olympiad/{i % olympiads + 1}')
+                assert response.status_code == 200, response.text
+
+        await client.get('/olympiad/1')  # warm up
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--olympiads', type=int, default=100)
+    args = parser.parse_args()
+
+    logger.remove()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.database.connection_string = f'sqlite+aiosqlite:///{os.path.join(tmp, "bench.db")}'
+        settings.database.auto_migrate = True
+        settings.database.replicas = []  # replicas of config.toml are not copies of the scratch database
+        rps = asyncio.run(run(args.requests, args.concurrency, args.olympiads))
+
+    print(f'GET /olympiad/{{id}}: {rps:.1f} req/s ({args.requests} requests, concurrency {args.concurrency})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Write contention benchmark for SQLite
+
+Several processes (like API workers, the scheduler and the log sink) write to one scratch
+database at the same time: half of the operations toggle a random user favorite, the other
+half write a log row, each in its own session. Prints throughput, latency percentiles and the
+number of "database is locked" failures for the configured pragma profile
+(database.sqlite_pragmas) or, with --sqlite-defaults, for plain SQLite defaults.
+
+Usage (from the directory with config.toml):
+    python -m benchmarks.write_contention --processes 4 --concurrency 8 --operations 500
+    python -m benchmarks.write_contention --sqlite-defaults
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, datetime
+
+from loguru import logger
+from sqlalchemy.exc import OperationalError
+
+from src.setup import settings
+
+SQLITE_DEFAULTS = {'journal_mode': 'DELETE',
+                   'synchronous': 'FULL',
+                   'mmap_size': 0,
+                   'cache_size': -2000,
+                   'temp_store': 'DEFAULT'}
+
+
+def configure(connection_string: str, sqlite_defaults: bool) -> None:
+    logger.remove()
+
+    settings.database.connection_string = connection_string
+    settings.database.auto_migrate = True
+    settings.database.replicas = []  # replicas of config.toml are not copies of the scratch database
+    if sqlite_defaults:
+        # busy_timeout is kept, so only journaling and caching are compared
+        settings.database.sqlite_pragmas = settings.database.sqlite_pragmas.model_copy(update=SQLITE_DEFAULTS)
+
+
+async def seed(users: int, olympiads: int) -> None:
+    from src.aggregator.database import crud
+    from src.setup import get_session_maker, dispose_session_maker
+
+    session_maker = await get_session_maker()
+    async with session_maker() as session:
+        for i in range(olympiads):
+            await crud.add_olympiad(session=session,
+                                    title=f'Олимпиада {i}',
+                                    dates={'Заключительный этап': [date(2099, 3, 1)]},
+                                    subjects=['Математика'],
+                                    classes=[9, 10, 11],
+                                    site_data=str(i))
+        for i in range(users):
+            await crud.add_user(session, username=f'user{i}', mail=f'user{i}@example.com', password='x')
+        await session.commit()
+
+    await dispose_session_maker()
+
+
+async def hammer(operations: int, concurrency: int, users: int, olympiads: int, seed_value: int):
+    from src.aggregator.database import crud
+    from src.setup import get_session_maker, unit_of_work
+
+    await get_session_maker()
+    rng = random.Random(seed_value)
+    queue = iter(range(operations))
+    latencies, locked = [], 0
+
+    async def operation():
+        user_id, olympiad_id = rng.randint(1, users), rng.randint(1, olympiads)
+
+        # one commit per operation, like one request
+        async with unit_of_work() as session:
+            if rng.random() < 0.5:
+                user = await crud.get_user_by_id(session, user_id)
+                if olympiad_id in user.favorites:
+                    await crud.delete_user_favorite(session, user_id, olympiad_id)
+                else:
+                    await crud.update_user_favorites(session, user_id, olympiad_id)
+            else:
+                await crud.add_log(session, user_id=user_id, log_type=0, date=datetime.now(), text='benchmark')
+
+    async def worker():
+        nonlocal locked
+
+        for _ in queue:
+            start = time.perf_counter()
+            try:
+                await operation()
+            except OperationalError as error:
+                if 'locked' not in str(error):
+                    raise
+                locked += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.time()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return started, time.time(), latencies, locked
+
+
+def process_main(connection_string, sqlite_defaults, operations, concurrency, users, olympiads, seed_value, results):
+    configure(connection_string, sqlite_defaults)
+    results.put(asyncio.run(hammer(operations, concurrency, users, olympiads, seed_value)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent sessions per process')
+    parser.add_argument('--operations', type=int, default=500, help='operations per process')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--olympiads', type=int, default=50)
+    parser.add_argument('--sqlite-defaults', action='store_true', help='use SQLite default pragmas')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        connection_string = f'sqlite+aiosqlite:///{os.path.join(tmp, "bench.db")}'
+        configure(connection_string, args.sqlite_defaults)
+        asyncio.run(seed(args.users, args.olympiads))
+
+        results = context.Queue()
+        processes = [context.Process(target=process_main,
+                                     args=(connection_string, args.sqlite_defaults, args.operations,
+                                           args.concurrency, args.users, args.olympiads, seed_value, results))
+                     for seed_value in range(args.processes)]
+
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+
+        for process in processes:
+            process.join()
+
+    # process start up is excluded: time window is from the first started worker to the last finished one
+    elapsed = max(finished for _, finished, _, _ in outcomes) - min(started for started, _, _, _ in outcomes)
+    latencies = sorted(latency for _, _, process_latencies, _ in outcomes for latency in process_latencies)
+    locked = sum(process_locked for _, _, _, process_locked in outcomes)
+    percentiles = statistics.quantiles(latencies, n=100)
+
+    profile = 'SQLite defaults' if args.sqlite_defaults else 'database.sqlite_pragmas'
+    print(f'{profile}: {len(latencies) / elapsed:.1f} writes/s, '
+          f'p50 {percentiles[49] * 1000:.1f} ms, p99 {percentiles[98] * 1000:.1f} ms, '
+          f'{locked} "database is locked" errors '
+          f'({args.processes} processes x {args.concurrency} sessions x {args.operations} operations)')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,21 @@
-import multiprocessing
+import asyncio
 
 import uvicorn
 
-from src.setup import setup_fastapi, setup_rocketry, setup_logging
+from src.aggregator import metrics
+from src.aggregator.database.migrations import migrate
+from src.setup import settings
 
 if __name__ == "__main__":
-    app_fastapi = setup_fastapi()  # setup
-
-
-    @app_fastapi.on_event("startup")
-    async def startup_event():
-        setup_logging()
-        rocketry_process = multiprocessing.Process(target=setup_rocketry)
-        rocketry_process.start()
-
-
-    uvicorn.run(app_fastapi, port=8001)
-
+    # Schema is upgraded once here, before workers start; workers only check it is at HEAD
+    asyncio.run(migrate(settings.database.connection_string))
+    # Counters start from zero on every start, snapshots of previous run's processes are removed
+    metrics.reset(settings.metrics.directory)
+
+    # Every worker builds its own app with setup_fastapi (shared-nothing), the scheduler
+    # is started only by the worker that wins the scheduler lock (see setup.lifespan)
+    uvicorn.run("src.setup:setup_fastapi",
+                factory=True,
+                host=settings.fastapi.host,
+                port=settings.fastapi.port,
+                workers=settings.fastapi.workers)
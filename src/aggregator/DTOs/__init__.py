@@ -1,3 +1,5 @@
+from .calendar import *
 from .notification import *
 from .olympiad import *
+from .profile import *
 from .user import *
@@ -0,0 +1,44 @@
+from datetime import date
+from typing import List
+
+from pydantic import BaseModel
+
+
+class CalendarEventSchema(BaseModel):
+    """
+    Pydantic class representing one olympiad stage in the calendar
+
+    Attributes:
+        olympiad_id: olympiad unique id
+        title: title of the olympiad
+        stage: name of the stage
+        start_date: date when stage starts
+        end_date: date when stage ends (optional)
+        classes: string representation of the class levels associated with the olympiad
+        subjects: string representation of subjects associated with the olympiad
+        is_favorite: boolean indicating if the olympiad is a user favorite
+        is_notified: boolean indicating if the user is subscribed for notifications for this olympiad
+        is_participant: boolean indicating if the user is a participant in this olympiad
+    """
+    olympiad_id: int
+    title: str
+    stage: str
+    start_date: date
+    end_date: date | None = None
+    classes: str
+    subjects: str
+    is_favorite: bool = False
+    is_notified: bool = False
+    is_participant: bool = False
+
+
+class CalendarDaySchema(BaseModel):
+    """
+    Pydantic class representing one day of the calendar
+
+    Attributes:
+        date: day
+        events: stages starting on this day
+    """
+    date: date
+    events: List[CalendarEventSchema]
@@ -1,9 +1,26 @@
-from datetime import datetime
+from datetime import datetime, date
 from typing import Union, List, Dict
 
 from pydantic import field_validator, BaseModel
 
 
+class OlympiadStageSchema(BaseModel):
+    """
+    Pydantic class that mirrors the OlympiadStage SQLAlchemy model
+
+    Attributes:
+        name: name of the stage
+        start_date: date when stage starts
+        end_date: date when stage ends (optional, one-day stages have none)
+    """
+    name: str
+    start_date: date
+    end_date: date | None = None
+
+    class Config:
+        from_attributes = True
+
+
 class OlympiadSchema(BaseModel):
     """
     Pydantic class that mirrors the Olympiad SQLAlchemy model
@@ -12,7 +29,7 @@ class OlympiadSchema(BaseModel):
         id: olympiad unique id
         title: title of the olympiad
         level: difficulty level of the olympiad (optional)
-        dates: dictionary containing start and end dates of the olympiad
+        stages: olympiad stages ordered as on the olympiad page
         description: description of the olympiad (optional)
         subjects: list of subjects associated with the olympiad
         classes: list of class levels associated with the olympiad
@@ -23,7 +40,7 @@ class OlympiadSchema(BaseModel):
     id: int
     title: str
     level: Union[int, None] = None
-    dates: Dict[str, List[str]]
+    stages: List[OlympiadStageSchema]
     description: str | None = None
     subjects: List[str]
     classes: List[int]
@@ -0,0 +1,40 @@
+from datetime import datetime
+from typing import Dict
+
+from pydantic import BaseModel
+
+
+class RequestProfileSchema(BaseModel):
+    """
+    Pydantic class representing profiled request
+
+    Attributes:
+        id: profile id
+        started_at: date and time when request started
+        method: HTTP method
+        path: request path
+        status: response status code
+        trigger: why request was profiled: 'header' (X-Profile header) or 'sample' (sample_rate)
+        duration_ms: request wall time
+        db_queries: number of database queries made by the request
+        spans: wall time by part of request, ms: db, render, serialize and other
+    """
+    id: int
+    started_at: datetime
+    method: str
+    path: str
+    status: int
+    trigger: str
+    duration_ms: float
+    db_queries: int
+    spans: Dict[str, float]
+
+
+class RequestProfileFullSchema(RequestProfileSchema):
+    """
+    Pydantic class representing profiled request with its profile
+
+    Attributes:
+        profile: functions with the largest cumulative time, pstats report
+    """
+    profile: str
@@ -1,4 +1,5 @@
-from typing import List
+from functools import cached_property
+from typing import List, FrozenSet
 
 from pydantic import BaseModel, EmailStr
 
@@ -16,6 +17,10 @@ class UserSchema(BaseModel):
         favorites: list of user favorite olympiad ids
         participates: list of user olympiad ids which user participates
         notifications: list of user olympiad ids that the user wants to receive notifications from
+
+    Properties:
+        favorite_ids, participate_ids, notification_ids: the same lists as frozensets
+            for constant-time membership checks, computed once per instance
     """
     id: int
     username: str
@@ -29,6 +34,18 @@ class UserSchema(BaseModel):
     class Config:
         from_attributes = True
 
+    @cached_property
+    def favorite_ids(self) -> FrozenSet[int]:
+        return frozenset(self.favorites)
+
+    @cached_property
+    def participate_ids(self) -> FrozenSet[int]:
+        return frozenset(self.participates)
+
+    @cached_property
+    def notification_ids(self) -> FrozenSet[int]:
+        return frozenset(self.notifications)
+
 
 class UserSchemaAdd(BaseModel):
     """
@@ -1,7 +1,13 @@
-from fastapi import Request
+from typing import Annotated
+
+from fastapi import Request, Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import async_session
 
+from src.aggregator import rate_limit
 from src.aggregator.DTOs import UserSchema
+from src.aggregator.service_layer.services import is_authenticated
+from src.setup import settings
 
 
 async def get_db_session(
@@ -9,6 +15,7 @@ async def get_db_session(
 ) -> async_session:
     """
     Fastapi dependency function for pretty data from middleware injecting
+    Session is acquired lazily: only requests whose endpoint depends on it get one
 
     Args:
         request: incoming request
@@ -17,19 +24,52 @@ async def get_db_session(
 
     """
 
-    return request.state.db_session
+    return await request.state.db_session.get()
 
 
 async def get_auth(
         request: Request,
+        db_session: Annotated[async_session, Depends(get_db_session)],
 ) -> UserSchema | bool:
     """
-    Fastapi dependency function for pretty data from middleware injecting
+    Fastapi dependency function for checking user's authentication
+    Checks request cookie for access token availability
+    If there is a token, decode it and try to find corresponding user.
+    If succeed return UserSchema.
+    In other cases returns False
 
     Args:
         request: incoming request
+        db_session: session for database, from get_db_session
 
-    Returns: async_session from corresponding middleware
+    Returns: UserSchema or False
+    """
+
+    return await is_authenticated(request, db_session)
+
+
+async def limit_login_attempts(
+        request: Request,
+        login_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+) -> None:
+    """
+    Fastapi dependency function for login rate limiting (settings.rate_limit).
+    Raises 429 before the endpoint touches database or bcrypt if client IP or login made too many attempts
+
+    Args:
+        request: incoming request
+        login_data: login form, shared with the endpoint
+
+    Returns: None
     """
+    if not settings.rate_limit.enabled:
+        return
 
-    return request.state.auth
+    ip = request.client.host if request.client else None
+    retry_after = await rate_limit.check_login_attempt(ip, login_data.username)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
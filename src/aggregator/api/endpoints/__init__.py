@@ -1,5 +1,7 @@
+from .admin import router_admin
 from .auth import router_auth
+from .calendar import router_calendar
+from .metrics import router_metrics
 from .olympiad import router_olympiad
 from .root import router_root
 from .user import router_user
-from .user import router_user
@@ -0,0 +1,89 @@
+import hmac
+from typing import Annotated, List
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, status, Response
+
+from src.aggregator import profiling
+from src.aggregator.DTOs import RequestProfileSchema, RequestProfileFullSchema
+from src.setup import settings
+
+
+async def check_admin_token(
+        x_admin_token: Annotated[str | None, Header()] = None,
+) -> None:
+    """
+    Fastapi dependency function for admin endpoints: X-Admin-Token header must be equal to
+    profiling.admin_token. Admin endpoints do not exist (404) if no token is configured
+
+    Args:
+        x_admin_token: X-Admin-Token header
+
+    Returns: None
+    """
+    token = settings.profiling.admin_token
+
+    if not token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+
+
+router_admin = APIRouter(
+    prefix="/admin",
+    tags=["Admin"],
+    dependencies=[Depends(check_admin_token)],
+    include_in_schema=False,
+)
+
+
+@router_admin.get("/profiles")
+async def get_profiles() -> List[RequestProfileSchema]:
+    """
+    List profiled requests kept by this worker, newest first.
+
+    Returns:
+        List[RequestProfileSchema]: Profiled requests with span breakdown, without profiles.
+    """
+    return [RequestProfileSchema(**profile.model_dump(exclude={'profile'})) for profile in profiling.get_profiles()]
+
+
+@router_admin.get("/profiles/{profile_id}")
+async def get_profile(
+        profile_id: Annotated[int, Path()],
+) -> RequestProfileFullSchema:
+    """
+    Retrieve profiled request with its profile report.
+
+    Args:
+        profile_id (int): Id of the profile.
+
+    Returns:
+        RequestProfileFullSchema: Profiled request with the top functions by cumulative time.
+    """
+    found = profiling.get_profile(profile_id)
+    if found is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile is not kept")
+
+    return found[0]
+
+
+@router_admin.get("/profiles/{profile_id}/pstats")
+async def get_profile_pstats(
+        profile_id: Annotated[int, Path()],
+) -> Response:
+    """
+    Download raw profile, e.g. for snakeviz or flameprof flame graphs.
+
+    Args:
+        profile_id (int): Id of the profile.
+
+    Returns:
+        Response: pstats file.
+    """
+    found = profiling.get_profile(profile_id)
+    if found is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile is not kept")
+
+    return Response(found[1],
+                    media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.pstats"'})
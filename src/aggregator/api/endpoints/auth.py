@@ -6,7 +6,7 @@ from loguru import logger
 from sqlalchemy.ext.asyncio import async_session
 
 from src.aggregator.DTOs import UserSchemaAdd, UserSchema, UserSchemaAuth
-from src.aggregator.api.dependencies import get_db_session
+from src.aggregator.api.dependencies import get_db_session, limit_login_attempts
 from src.aggregator.service_layer import services
 
 router_auth = APIRouter(
@@ -38,7 +38,7 @@ async def register_user(
     return user
 
 
-@router_auth.post("")
+@router_auth.post("", dependencies=[Depends(limit_login_attempts)])
 async def login_user(
         login_data: Annotated[OAuth2PasswordRequestForm, Depends()],
         db_session: Annotated[async_session, Depends(get_db_session)],
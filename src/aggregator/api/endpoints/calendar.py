@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+from typing import Annotated, List
+
+from fastapi import APIRouter, Depends, Query
+from loguru import logger
+from sqlalchemy.ext.asyncio import async_session
+
+from src.aggregator.DTOs import UserSchema, CalendarDaySchema
+from src.aggregator.api.dependencies import get_db_session, get_auth
+from src.aggregator.service_layer import services
+
+router_calendar = APIRouter(
+    prefix="/calendar",
+    tags=["Calendar"],
+)
+
+
+@router_calendar.get("")
+async def get_calendar(
+        auth: Annotated[UserSchema | bool, Depends(get_auth)],
+        db_session: Annotated[async_session, Depends(get_db_session)],
+        date_from: Annotated[date | None, Query(alias="from")] = None,
+        date_to: Annotated[date | None, Query(alias="to")] = None,
+        grades: Annotated[List[int] | None, Query()] = None,
+        subjects: Annotated[List[str] | None, Query()] = None,
+) -> List[CalendarDaySchema]:
+    """
+    Retrieve upcoming olympiad stages grouped by day.
+
+    Args:
+        auth (UserSchema | bool): Authentication data for the user.
+        db_session (async_session): Asynchronous database session.
+        date_from (date | None, optional): First day of the range, today by default.
+        date_to (date | None, optional): Last day of the range, two weeks after date_from by default.
+        grades (List[int] | None, optional): List of grades to filter stages by.
+        subjects (List[str] | None, optional): List of subjects to filter stages by.
+
+    Returns:
+        List[CalendarDaySchema]: Days with stages starting on them, in date order.
+    """
+    logger.info('Request for calendar')
+
+    if date_from is None:
+        date_from = date.today()
+    if date_to is None:
+        date_to = date_from + timedelta(days=14)
+
+    days = await services.get_calendar(start=date_from,
+                                       end=date_to,
+                                       grades=grades,
+                                       subjects=subjects,
+                                       auth=auth,
+                                       db_session=db_session)
+
+    return days
@@ -0,0 +1,23 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from src.aggregator import metrics
+from src.setup import settings
+
+router_metrics = APIRouter(
+    prefix="/metrics",
+    tags=["Metrics"],
+)
+
+
+@router_metrics.get("", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics() -> PlainTextResponse:
+    """
+    Metrics of all worker and scheduler processes in Prometheus text format
+
+    Returns:
+        PlainTextResponse: Prometheus exposition text.
+    """
+    text = await metrics.render(settings.metrics.directory, settings.metrics.flush_seconds)
+
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,64 +1,460 @@
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime
 
-from src.aggregator.service_layer.services import is_authenticated
-from src.setup import get_session_maker
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
 
+from src.aggregator import metrics, profiling
+from src.aggregator.database.instrumentation import track_queries, QueryBudgetError, DeadlineExceeded, \
+    request_deadline
+from src.aggregator.api.query_budgets import QUERY_BUDGETS
+from src.setup import get_session_maker, settings
 
-class DatabaseSessionMiddleware(BaseHTTPMiddleware):
+
+class LazySession:
+    """
+    Request-scoped holder of a db session, the unit of work of a request.
+    Session is created only on first get(), so requests which never touch
+    the database (CORS preflights, /docs, static) never acquire one
+
+    Methods:
+        get(self): returns session, creating it on first call
+        commit(self): commits session if it was created and not marked rollback-only
+        close(self): closes session if it was created, rolling back uncommitted changes
+    """
+
+    def __init__(self) -> None:
+        self._session: AsyncSession | None = None
+
+    async def get(self) -> AsyncSession:
+        """
+        Returns request session, creating it on first call
+
+        Returns: AsyncSession
+
+        """
+        if self._session is None:
+            session_maker = await get_session_maker()
+            self._session = session_maker()
+
+        return self._session
+
+    async def commit(self) -> None:
+        """
+        Commits all changes of the request at once.
+        Session is rolled back instead if a service failed during the request
+        (see service_layer.utils.logging_wrapper)
+
+        Returns: None
+
+        """
+        if self._session is None:
+            return
+
+        if self._session.info.get('rollback_only'):
+            await self._session.rollback()
+        else:
+            await self._session.commit()
+
+    async def close(self) -> None:
+        """
+        Closes session if it was ever created
+
+        Returns: None
+
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class DatabaseSessionMiddleware:
+    """
+    Pure ASGI middleware for injecting a lazy db session
+
+    Methods:
+        __call__(self, scope, receive, send): main middleware method
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Puts LazySession into request state. Session itself is opened only
+        when endpoint asks for it with get_db_session dependency.
+        Changes of the request are committed once, right before successful (< 400) response is started,
+        so a failed commit still turns into 500. Error responses and exceptions roll changes back
+
+        Args:
+            scope: ASGI connection scope
+            receive: ASGI receive channel
+            send: ASGI send channel
+
+        Returns: None
+        """
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        lazy_session = LazySession()
+        scope.setdefault('state', {})['db_session'] = lazy_session
+
+        async def send_wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start' and message['status'] < 400:
+                await lazy_session.commit()
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            await lazy_session.close()
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware collecting per-route request metrics: count by status, latency,
+    requests in progress and database queries made by the request (see src/aggregator/metrics.py).
+    Route label is the path template (/olympiad/{olympiad_id}), so label values stay bounded
+
+    Methods:
+        __call__(self, scope, receive, send): main middleware method
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Measures request and records its metrics when it finishes
+
+        Args:
+            scope: ASGI connection scope
+            receive: ASGI receive channel
+            send: ASGI send channel
+
+        Returns: None
+        """
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method, route = scope['method'], self.get_route(scope)
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+
+            if message['type'] == 'http.response.start':
+                status = message['status']
+
+            await send(message)
+
+        metrics.http_requests_in_progress.inc(method, route)
+        start = time.perf_counter()
+        with track_queries() as queries:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                metrics.http_requests_in_progress.dec(method, route)
+                metrics.http_request_duration.observe(method, route, value=time.perf_counter() - start)
+                metrics.http_requests.inc(method, route, str(status))
+                metrics.http_request_db_queries.observe(method, route, value=queries.count)
+                metrics.http_request_db_duration.observe(method, route, value=queries.duration)
+
+    @staticmethod
+    def get_route(scope: Scope) -> str:
+        """
+        Finds path template of the route which will handle request
+
+        Args:
+            scope: ASGI connection scope
+
+        Returns: route path, 'unmatched' if no route matches
+
+        """
+        partial = 'unmatched'
+        for route in scope['app'].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial == 'unmatched':
+                # path matches, method does not (405)
+                partial = route.path
+
+        return partial
+
+
+class ProfilingMiddleware:
     """
-    Middleware class for injecting a db session
+    Pure ASGI middleware running requests chosen by profiling.get_trigger under profiler
+    (see src/aggregator/profiling.py). Installed only when settings.profiling is enabled
 
     Methods:
-        dispatch(self, request: Request, call_next): main middleware class
+        __call__(self, scope, receive, send): main middleware method
     """
 
-    async def dispatch(self, request: Request, call_next):
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
-        Gets session maker and with using of context manager injects it into request
-        After sending response session close automatically (thanks with)
+        Profiles request if it is chosen for profiling
 
         Args:
-            request: incoming request object
-            call_next:
+            scope: ASGI connection scope
+            receive: ASGI receive channel
+            send: ASGI send channel
 
-        Returns: request
+        Returns: None
         """
+        trigger = profiling.get_trigger(scope['headers']) if scope['type'] == 'http' else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
 
-        session_maker = await get_session_maker()
+        status = 500
 
-        async with session_maker() as session:
-            request.state.db_session = session
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
 
-            response = await call_next(request)
-            return response
+            if message['type'] == 'http.response.start':
+                status = message['status']
 
+            await send(message)
 
-class AuthenticationMiddleware(BaseHTTPMiddleware):
+        started_at, start = datetime.now(), time.perf_counter()
+        with track_queries() as queries:
+            profiler = profiling.start()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                duration = time.perf_counter() - start
+                profiling.finish(profiler, trigger,
+                                 method=scope['method'],
+                                 path=scope['path'],
+                                 status=status,
+                                 started_at=started_at,
+                                 duration=duration,
+                                 db_queries=queries.count,
+                                 db_duration=queries.duration)
+
+
+class QueryBudgetMiddleware:
     """
-    Middleware class for checking user's authentication
+    Pure ASGI middleware checking database statements of every request against
+    per-route budgets (api/query_budgets.py) and against repeated statement shapes (N+1 loops).
+    Installed only when settings.query_budget.mode is 'warn' (staging: violations are logged)
+    or 'raise' (tests: QueryBudgetError is raised after the response is sent)
 
     Methods:
-        dispatch(self, request: Request, call_next): main middleware class
+        __call__(self, scope, receive, send): main middleware method
     """
 
-    async def dispatch(self, request: Request, call_next):
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Tracks statements of the request and checks them when request finishes
+
+        Args:
+            scope: ASGI connection scope
+            receive: ASGI receive channel
+            send: ASGI send channel
+
+        Returns: None
+
+        Raises:
+            QueryBudgetError: if budget is exceeded in 'raise' mode
+        """
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as queries:
+            await self.app(scope, receive, send)
+
+        endpoint = f"{scope['method']} {MetricsMiddleware.get_route(scope)}"
+        problems = queries.violations(max_queries=QUERY_BUDGETS.get(endpoint),
+                                      max_repeats=settings.query_budget.max_repeats)
+        if not problems:
+            return
+
+        message = f'Query budget of {endpoint} exceeded: ' + '; '.join(problems)
+        if settings.query_budget.mode == 'raise':
+            raise QueryBudgetError(message)
+
+        logger.warning(message)
+
+
+class DisconnectWatcher:
+    """
+    Reads ASGI receive channel of a request in background, so client disconnect is noticed
+    while the app is busy. Messages are passed to the app through receive()
+
+    Methods:
+        watch(self): reads messages until http.disconnect
+        receive(self): receive channel for the app
+    """
+
+    def __init__(self, receive: Receive) -> None:
+        self._receive = receive
+        self._messages: asyncio.Queue[Message] = asyncio.Queue()
+
+    async def watch(self) -> None:
+        """
+        Returns: None, when client disconnected
+
         """
-        Checks request cookie for access token availability
-        If there is a token, decode it and try to find corresponding user.
-        If succeed return UserSchema.
-        In other cases returns False
+        while True:
+            message = await self._receive()
+            self._messages.put_nowait(message)
 
+            if message['type'] == 'http.disconnect':
+                return
+
+    async def receive(self) -> Message:
+        return await self._messages.get()
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware limiting concurrency of every request class (read, auth, write, see
+    settings.admission). Requests over the limit wait in a bounded queue, requests which do not fit
+    the queue or wait too long get fast 503 with Retry-After instead of piling onto the database.
+    Admitted request runs with a deadline: it is cancelled when the client disconnects or deadline passes,
+    statements started after the deadline are refused (database/instrumentation.py request_deadline).
+    Metrics, admin and docs endpoints are never limited
+
+    Methods:
+        __call__(self, scope, receive, send): main middleware method
+        get_route_class(scope): request class or None for unlimited requests
+    """
+    unlimited_prefixes = ('/metrics', '/admin', '/docs', '/redoc', '/openapi.json')
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._slots = {route_class: asyncio.Semaphore(limit)
+                       for route_class, limit in settings.admission.limits.model_dump().items()}
+        self._waiting = defaultdict(int)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Admits, queues or rejects request
+
+        Args:
+            scope: ASGI connection scope
+            receive: ASGI receive channel
+            send: ASGI send channel
+
+        Returns: None
+        """
+        route_class = self.get_route_class(scope) if scope['type'] == 'http' else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        slots = self._slots[route_class]
+        deadline = time.monotonic() + settings.admission.request_timeout
+
+        if slots.locked():
+            if self._waiting[route_class] >= getattr(settings.admission.queue, route_class):
+                await self.reject(route_class, 'saturated', scope, receive, send)
+                return
+
+            self._waiting[route_class] += 1
+            metrics.http_requests_waiting.inc(route_class)
+            try:
+                await asyncio.wait_for(slots.acquire(), settings.admission.queue_timeout)
+            except asyncio.TimeoutError:
+                await self.reject(route_class, 'queue_timeout', scope, receive, send)
+                return
+            finally:
+                self._waiting[route_class] -= 1
+                metrics.http_requests_waiting.dec(route_class)
+        else:
+            await slots.acquire()
+
+        try:
+            await self.run(route_class, deadline, scope, receive, send)
+        finally:
+            slots.release()
+
+    async def run(self, route_class: str, deadline: float, scope: Scope, receive: Receive, send: Send) -> None:
+        started = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal started
+
+            if message['type'] == 'http.response.start':
+                started = True
+            await send(message)
+
+        watcher = DisconnectWatcher(receive)
+        token = request_deadline.set(deadline)
+        try:
+            # the app task gets a copy of the context with the deadline in it
+            app_task = asyncio.create_task(self.app(scope, watcher.receive, send_wrapper))
+        finally:
+            request_deadline.reset(token)
+        watcher_task = asyncio.create_task(watcher.watch())
+
+        try:
+            await asyncio.wait({app_task, watcher_task}, timeout=max(deadline - time.monotonic(), 0),
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher_task.cancel()
+            if not app_task.done():
+                app_task.cancel()
+            await asyncio.gather(app_task, watcher_task, return_exceptions=True)
+
+        if not app_task.cancelled():
+            try:
+                app_task.result()
+                return
+            except DeadlineExceeded:
+                pass
+
+        if watcher_task.done() and not watcher_task.cancelled():
+            # nobody is waiting for the response any more
+            metrics.http_requests_shed.inc(route_class, 'disconnected')
+            return
+
+        logger.warning(f'Request {scope["method"]} {scope["path"]} cancelled after deadline')
+        if not started:
+            await self.reject(route_class, 'deadline', scope, receive, send)
+
+    @staticmethod
+    async def reject(route_class: str, reason: str, scope: Scope, receive: Receive, send: Send) -> None:
+        metrics.http_requests_shed.inc(route_class, reason)
+
+        response = JSONResponse({'detail': 'Service is overloaded, retry later'}, status_code=503,
+                                headers={'Retry-After': str(settings.admission.retry_after)})
+        await response(scope, receive, send)
+
+    @classmethod
+    def get_route_class(cls, scope: Scope) -> str | None:
+        """
         Args:
-            request: incoming request object
-            call_next:
+            scope: ASGI connection scope
 
-        Returns: response
+        Returns: 'auth', 'write' or 'read', None for requests which are not limited
 
         """
-        is_auth = await is_authenticated(request, request.state.db_session)
+        path, method = scope['path'], scope['method']
 
-        request.state.auth = is_auth
+        if method == 'OPTIONS' or path.startswith(cls.unlimited_prefixes):
+            return None
+        if path.startswith('/auth'):
+            return 'auth'
+        if method not in ('GET', 'HEAD'):
+            return 'write'
 
-        response = await call_next(request)
-        return response
+        return 'read'
@@ -0,0 +1,35 @@
+"""
+Database statement budgets of endpoints, checked by QueryBudgetMiddleware (settings.query_budget)
+and usable in tests with database.instrumentation.assert_query_budget.
+Every budget is enforced by tests/test_query_budgets.py, which requests each endpoint in 'raise' mode
+
+Keys are '<METHOD> <route template>', values are the maximal number of statements of one request.
+Budgets are current counts for an authenticated user missing the user cache, catalog rebuild is not counted
+(it is shared by all requests). Writes include two statements publishing cache invalidation events.
+Routes without a budget are only checked for repeated statements.
+A budget is raised only together with the change which needs more queries, never to silence a warning
+"""
+from typing import Dict
+
+QUERY_BUDGETS: Dict[str, int] = {
+    # ------------------ Auth ------------------
+    'POST /auth/register': 2,
+    'POST /auth': 2,
+
+    # ------------------ Catalog ------------------
+    'GET /': 4,
+    'GET /calendar': 2,
+    'GET /olympiad/{olympiad_id}': 4,
+
+    # ------------------ User ------------------
+    'GET /user/{user_id}': 4,
+    'GET /user/{user_id}/favorites': 4,
+    'GET /user/{user_id}/participates': 4,
+    'GET /user/{user_id}/notifications': 4,
+    'POST /user/{user_id}/favorites': 9,
+    'POST /user/{user_id}/participates': 9,
+    'POST /user/{user_id}/notifications': 13,
+    'DELETE /user/{user_id}/favorites/{olympiad_id}': 9,
+    'DELETE /user/{user_id}/participates/{olympiad_id}': 9,
+    'DELETE /user/{user_id}/notifications/{olympiad_id}': 11,
+}
@@ -1,8 +1,12 @@
-from src.aggregator.api.endpoints import router_olympiad, router_root, router_auth, router_user
+from src.aggregator.api.endpoints import router_olympiad, router_root, router_auth, router_user, router_calendar, \
+    router_metrics, router_admin
 
 all_routers = [
     router_olympiad,
     router_root,
     router_auth,
-    router_user
+    router_user,
+    router_calendar,
+    router_metrics,
+    router_admin,
 ]
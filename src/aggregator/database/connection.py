@@ -1,15 +1,113 @@
-from .models import *
+import json
+from functools import partial
+from typing import Dict
 
+from sqlalchemy import event, make_url, URL
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
-async def initialize_database(engine):
+from src.config import DatabaseSettings
+from .instrumentation import instrument_engine, InstrumentedQueuePool
+from .migrations import upgrade_database, check_database
+
+
+def create_database_engine(database: DatabaseSettings, replica: str | None = None) -> AsyncEngine:
+    """
+    Creates engine for database.connection_string or for one of database.replicas:
+    SQLite (aiosqlite) or PostgreSQL (asyncpg).
+    SQLite connections get pragma profile. Server databases and SQLite files are pooled with database.pool settings,
+    so pragmas are applied and page cache is kept once per pooled connection, not once per session.
+    In-memory SQLite databases keep dialect default pool (one shared connection)
+    Statements and pool are instrumented for metrics (see database/instrumentation.py)
+
+    Args:
+        database: database settings
+        replica: connection string of read replica, primary database if None
+
+    Returns: AsyncEngine
+
+    """
+    connection_string = replica or database.connection_string
+    pragmas = database.sqlite_pragmas.model_dump()
+    if replica is not None:
+        # journal mode is a property of database file, read-only connections can not change it
+        pragmas.pop('journal_mode')
+
+    label = 'primary' if replica is None else 'replica'
+
+    options = {}
+    url = make_url(connection_string)
+    if url.get_backend_name() != 'sqlite' or is_file_database(url):
+        options = {'poolclass': InstrumentedQueuePool,
+                   'pool_logging_name': label,
+                   'pool_size': database.pool.size,
+                   'max_overflow': database.pool.max_overflow,
+                   'pool_timeout': database.pool.timeout,
+                   'pool_recycle': database.pool.recycle,
+                   'pool_pre_ping': database.pool.pre_ping}
+
+    # Russian strings are stored as is, not as \u escapes
+    engine = create_async_engine(connection_string,
+                                 json_serializer=partial(json.dumps, ensure_ascii=False),
+                                 **options)
+    apply_sqlite_pragmas(engine, pragmas)
+    instrument_engine(engine.sync_engine, label)
+
+    return engine
+
+
+def is_file_database(url: URL) -> bool:
+    """
+    Args:
+        url: SQLite database URL
+
+    Returns: False for in-memory databases (:memory:, empty path or mode=memory), True otherwise
+
+    """
+    return url.database not in (None, '', ':memory:') and url.query.get('mode') != 'memory'
+
+
+async def initialize_database(engine, auto_migrate: bool = False):
     """
     Function for initialize database
+    Schema is created and changed only by migrations (see database/migrations),
+    here it is only checked to be at HEAD
 
     Args:
         engine: thing needed database to initialize
+        auto_migrate: apply pending migrations before check (for development and benchmarks)
 
     Returns:
 
+    Raises:
+        SchemaVersionError: if database schema is not at HEAD
+
+    """
+    if auto_migrate:
+        await upgrade_database(engine)
+
+    await check_database(engine)
+
+
+def apply_sqlite_pragmas(engine: AsyncEngine, pragmas: Dict[str, str | int]) -> None:
+    """
+    Registers connect event hook which applies pragmas to every new pooled connection.
+    Does nothing for non-SQLite engines
+
+    Args:
+        engine: engine to apply pragmas to
+        pragmas: pragma values by name (see config.SQLitePragmaSettings)
+
+    Returns: None
+
     """
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    if engine.dialect.name != 'sqlite':
+        return
+
+    statements = [f'PRAGMA {name} = {value}' for name, value in pragmas.items()]
+
+    @event.listens_for(engine.sync_engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
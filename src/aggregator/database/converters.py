@@ -0,0 +1,86 @@
+from functools import lru_cache
+from typing import Type, Sequence, Any
+
+from pydantic import BaseModel
+from sqlalchemy import inspect, select, Select, Row
+
+
+class RowConverter:
+    """
+    Precompiled converter from SQLAlchemy model to DTO, built once per (model, DTO) pair.
+    Knows which DTO fields are model columns, so they can be selected as plain Core tuples,
+    and builds DTOs with model_construct: data from the database is trusted and is not validated again
+
+    Attributes:
+        model: SQLAlchemy model class
+        dto: pydantic DTO class
+        fields: names of DTO fields which are columns of the model, in select order
+        columns: model attributes of these fields
+
+    Methods:
+        select(self): Core select of the columns
+        from_row(self, row, **extra): builds DTO from selected row
+        from_instance(self, instance, **extra): builds DTO from model instance
+    """
+
+    def __init__(self, model: Type, dto: Type[BaseModel]) -> None:
+        self.model = model
+        self.dto = dto
+
+        column_attrs = inspect(model).column_attrs
+        self.fields = [name for name in dto.model_fields if name in column_attrs]
+        self.columns = [getattr(model, name) for name in self.fields]
+
+        # every other DTO field which model instances have (properties, relationships)
+        self._instance_fields = [name for name in dto.model_fields if hasattr(model, name)]
+
+    def select(self) -> Select:
+        """
+        Returns: Core select of the converted columns, rows are plain tuples
+
+        """
+        return select(*self.columns)
+
+    def from_row(self, row: Row | Sequence[Any], **extra) -> BaseModel:
+        """
+        Builds DTO from row of select(), without validation
+
+        Args:
+            row: row with values in fields order
+            **extra: values of DTO fields which are not columns (e.g. related objects)
+
+        Returns: DTO
+
+        """
+        values = dict(zip(self.fields, row), **extra)
+        return self.dto.model_construct(_fields_set=set(values), **values)
+
+    def from_instance(self, instance, **extra) -> BaseModel:
+        """
+        Builds DTO from model instance attributes, without validation
+
+        Args:
+            instance: model instance
+            **extra: values overriding instance attributes (e.g. converted related objects)
+
+        Returns: DTO
+
+        """
+        values = {name: getattr(instance, name) for name in self._instance_fields if name not in extra}
+        values.update(extra)
+        return self.dto.model_construct(_fields_set=set(values), **values)
+
+
+@lru_cache(maxsize=None)
+def get_converter(model: Type, dto: Type[BaseModel]) -> RowConverter:
+    """
+    Returns cached converter for (model, DTO) pair, creating it on first call
+
+    Args:
+        model: SQLAlchemy model class
+        dto: pydantic DTO class
+
+    Returns: RowConverter
+
+    """
+    return RowConverter(model, dto)
@@ -2,8 +2,11 @@
 CRUD folder
 For every data type - separated file
 Every get session and needed args and adds, gets, updates and deletes data from database
+Functions only flush changes, commit is made once by unit of work:
+DatabaseSessionMiddleware for requests and setup.unit_of_work for everything else
 """
 
+from .cache_version import *
 from .log import *
 from .notification import *
 from .olympiad import *
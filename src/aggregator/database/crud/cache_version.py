@@ -0,0 +1,107 @@
+from typing import Collection, Iterable, List, Sequence
+
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import async_session
+
+from src.aggregator.database import CacheVersion, CACHE_VERSION_HEAD, CACHE_VERSION_SEQUENCE
+from src.aggregator.database import invalidation
+
+# versions before the latest one looked at for transactions which have not committed yet (PostgreSQL)
+PENDING_DEPTH = 1000
+
+
+# ------------------ Add ------------------
+async def publish_cache_versions(
+        session: async_session,
+        entity: str,
+        entity_ids: Iterable[int]
+) -> int | None:
+    # PostgreSQL takes the version from a sequence: no lock is held until commit, so transactions may commit
+    # out of version order, pollers re-read a window of recent versions. SQLite updates the head row,
+    # its write transaction holds the database lock anyway. Caches of this process are invalidated at once
+    from .user import _insert  # user functions publish their changes, import at call time
+
+    entity_ids = set(entity_ids)
+    if not entity_ids:
+        return None
+
+    table = CacheVersion.__table__
+    if session.get_bind().dialect.name == 'postgresql':
+        version = await session.scalar(select(CACHE_VERSION_SEQUENCE.next_value()))
+    else:
+        stmt = (update(table)
+                .where(table.c.entity == CACHE_VERSION_HEAD[0], table.c.entity_id == CACHE_VERSION_HEAD[1])
+                .values(version=table.c.version + 1)
+                .returning(table.c.version))
+        version = await session.scalar(stmt)
+
+    stmt = _insert(session, table)
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.entity, table.c.entity_id],
+                                      set_={'version': stmt.excluded.version})
+    await session.execute(stmt, [{'entity': entity, 'entity_id': entity_id, 'version': version}
+                                 for entity_id in entity_ids])
+
+    invalidation.apply(entity, entity_ids)
+
+    return version
+
+
+# ------------------ Get ------------------
+async def get_cache_version(
+        session: async_session
+) -> int:
+    stmt = select(func.max(CacheVersion.version))
+    version = await session.scalar(stmt)
+
+    return version or 0
+
+
+async def get_pending_cache_versions(
+        session: async_session,
+        version: int,
+        depth: int = PENDING_DEPTH
+) -> List[int]:
+    # PostgreSQL only: versions of the last depth up to version without rows. They were given out to transactions
+    # which have not committed yet, rolled back, or were overwritten by later changes of the same entities
+    if session.get_bind().dialect.name != 'postgresql':
+        return []
+
+    start = max(version - depth, 0)
+    stmt = select(CacheVersion.version).where(CacheVersion.version > start,
+                                              CacheVersion.version <= version).distinct()
+    present = set(await session.scalars(stmt))
+
+    return [pending for pending in range(start + 1, version + 1) if pending not in present]
+
+
+async def has_cache_versions_after(
+        session: async_session,
+        entity: str,
+        version: int,
+        versions: Collection[int] = ()
+) -> bool:
+    stmt = select(CacheVersion.entity_id).where(_after(version, versions), CacheVersion.entity == entity).limit(1)
+
+    return await session.scalar(stmt) is not None
+
+
+async def get_cache_versions_after(
+        session: async_session,
+        version: int,
+        versions: Collection[int] = ()
+) -> Sequence[Row]:
+    stmt = select(CacheVersion.entity, CacheVersion.entity_id, CacheVersion.version).where(
+        _after(version, versions)
+    )
+    rows = await session.execute(stmt)
+
+    return rows.all()
+
+
+def _after(version: int, versions: Collection[int]):
+    # versions after version and the given ones below it, both are lookups in the version index
+    if not versions:
+        return CacheVersion.version > version
+
+    return or_(CacheVersion.version > version, CacheVersion.version.in_(list(versions)))
@@ -21,6 +21,6 @@ async def add_log(
     )
 
     session.add(user)
-    await session.commit()
+    await session.flush()
 
     return user
@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Sequence
+from typing import Dict, List, Sequence
 
-from sqlalchemy import select
+from sqlalchemy import select, insert
 from sqlalchemy.ext.asyncio import async_session
 
 from src.aggregator.database import Notification
@@ -23,7 +23,22 @@ async def add_notification(
     )
 
     session.add(notification)
-    await session.commit()
+    await session.flush()
+
+
+async def add_notifications(
+        session: async_session,
+        user_id: int,
+        olympiad_id: int,
+        notifications: List[Dict],
+) -> None:
+    # One executemany INSERT for all notifications instead of flush per notification
+    if not notifications:
+        return
+
+    await session.execute(insert(Notification),
+                          [{'user_id': user_id, 'olympiad_id': olympiad_id, **notification}
+                           for notification in notifications])
 
 
 # ------------------ Get ------------------
@@ -79,7 +94,8 @@ async def delete_notification_by_id(
 ) -> Notification | None:
     notification = await get_notification_by_id(session=session, notification_id=notification_id)
 
-    await session.delete(notification)
+    if notification is not None:
+        await session.delete(notification)
 
     return notification
 
@@ -94,6 +110,6 @@ async def delete_notifications_by_user_and_olympiad_id(
                                                                     olympiad_id=olympiad_id)
 
     for notification in notifications:
-        session.delete(notification)
+        await session.delete(notification)
 
     return True
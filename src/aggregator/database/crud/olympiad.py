@@ -1,10 +1,20 @@
-from typing import List, Sequence, Dict
+from collections import defaultdict
+from datetime import date
+from typing import List, Sequence, Dict, AsyncIterator
 
-from sqlalchemy import select
+from sqlalchemy import select, delete, insert, or_, type_coerce
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import async_session
 from sqlalchemy.orm.attributes import flag_modified
 
-from src.aggregator.database import Olympiad
+from src.aggregator.DTOs import OlympiadSchema, OlympiadStageSchema
+from src.aggregator.database import Olympiad, OlympiadStage
+from src.aggregator.database.converters import get_converter
+from .cache_version import publish_cache_versions
+from .user import _insert
+
+# Olympiad columns written by upsert_olympiads and read by stream_olympiads, site_data is the upsert key
+OLYMPIAD_DATA_COLUMNS = ('title', 'level', 'description', 'subjects', 'classes', 'site_data')
 
 
 # ------------------ Add ------------------
@@ -12,7 +22,7 @@ async def add_olympiad(
         session: async_session,
         title: str,
         level: int | None = None,
-        dates: Dict[str, List[str]] = None,
+        dates: Dict[str, List[date]] = None,
         description: str | None = None,
         subjects: List[str] = None,
         classes: List[int] = None,
@@ -24,7 +34,7 @@ async def add_olympiad(
     if subjects is None:
         subjects = []
     if dates is None:
-        dates = []
+        dates = {}
 
     if site_data is not None:
         olymp = await get_olympiad_by_site_data(session, site_data)
@@ -34,7 +44,13 @@ async def add_olympiad(
     olympiad = Olympiad(
         title=title,
         level=level,
-        dates=dates,
+        stages=[
+            OlympiadStage(ordinal=ordinal,
+                          name=name,
+                          start_date=stage_dates[0],
+                          end_date=stage_dates[1] if len(stage_dates) > 1 else None)
+            for ordinal, (name, stage_dates) in enumerate(dates.items())
+        ],
         description=description,
         subjects=subjects,
         classes=classes,
@@ -42,11 +58,55 @@ async def add_olympiad(
     )
 
     session.add(olympiad)
-    await session.commit()
+    await session.flush()
+    await publish_cache_versions(session, 'olympiad', [olympiad.id])
 
     return olympiad
 
 
+async def upsert_olympiads(
+        session: async_session,
+        olympiads: List[Dict]
+) -> int:
+    # Batch of dicts with OLYMPIAD_DATA_COLUMNS keys and 'stages' list of {name, start_date, end_date}.
+    # One multi-row INSERT ... ON CONFLICT (site_data) DO UPDATE for the batch, then stages of the batch
+    # are replaced. Rows without site_data have no upsert key, they are always inserted
+    if not olympiads:
+        return 0
+
+    keyed = {olympiad['site_data']: olympiad for olympiad in olympiads if olympiad.get('site_data') is not None}
+    unkeyed = [olympiad for olympiad in olympiads if olympiad.get('site_data') is None]
+    stages = {}
+
+    if keyed:
+        # executemany with RETURNING is sent as batched multi-row statements, compiled once and cached
+        stmt = _insert(session, Olympiad.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Olympiad.site_data],
+            set_={column: stmt.excluded[column] for column in OLYMPIAD_DATA_COLUMNS if column != 'site_data'}
+        ).returning(Olympiad.id, Olympiad.site_data)
+        rows = [{column: olympiad.get(column) for column in OLYMPIAD_DATA_COLUMNS} for olympiad in keyed.values()]
+
+        for olympiad_id, site_data in await session.execute(stmt, rows):
+            stages[olympiad_id] = keyed[site_data].get('stages', [])
+
+    for olympiad in unkeyed:
+        stmt = insert(Olympiad).values({column: olympiad.get(column) for column in OLYMPIAD_DATA_COLUMNS})
+        stages[await session.scalar(stmt.returning(Olympiad.id))] = olympiad.get('stages', [])
+
+    await session.execute(delete(OlympiadStage).where(OlympiadStage.olympiad_id.in_(stages)))
+
+    stage_rows = [dict(stage, olympiad_id=olympiad_id, ordinal=ordinal)
+                  for olympiad_id, olympiad_stages in stages.items()
+                  for ordinal, stage in enumerate(olympiad_stages)]
+    if stage_rows:
+        # Core table insert is a single executemany, ORM bulk insert would go row by row
+        await session.execute(insert(OlympiadStage.__table__), stage_rows)
+    await publish_cache_versions(session, 'olympiad', stages)
+
+    return len(stages)
+
+
 # ------------------ Get ------------------
 async def get_olympiad_by_id(
         session: async_session,
@@ -55,12 +115,21 @@ async def get_olympiad_by_id(
     stmt = select(Olympiad).where(Olympiad.id == olympiad_id)
     olympiad = await session.scalar(stmt)
 
-    if olympiad is None:
-        return None
+    return olympiad
 
-    olympiad.convert_json_fields()
 
-    return olympiad
+async def get_olympiads_by_ids(
+        session: async_session,
+        olympiad_ids: List[int]
+) -> List[OlympiadSchema]:
+    # One IN query for all ids. Result keeps order of olympiad_ids, missing ids are skipped
+    if not olympiad_ids:
+        return []
+
+    olympiads = {olympiad.id: olympiad
+                 for olympiad in await select_olympiad_dtos(session, Olympiad.id.in_(set(olympiad_ids)))}
+
+    return [olympiads[olympiad_id] for olympiad_id in olympiad_ids if olympiad_id in olympiads]
 
 
 async def get_olympiad_by_site_data(
@@ -70,55 +139,87 @@ async def get_olympiad_by_site_data(
     stmt = select(Olympiad).where(Olympiad.site_data == site_data)
     olympiad = await session.scalar(stmt)
 
-    if olympiad is None:
-        return None
+    return olympiad
 
-    olympiad.convert_json_fields()
 
-    return olympiad
+async def get_upcoming_stages(
+        session: async_session,
+        start: date,
+        end: date | None = None,
+        olympiad_id: int | None = None,
+) -> Sequence[OlympiadStage]:
+    # Range scan over ix_olympiad_stages_start_date
+    stmt = select(OlympiadStage).where(OlympiadStage.start_date >= start).order_by(OlympiadStage.start_date)
+
+    if end is not None:
+        stmt = stmt.where(OlympiadStage.start_date <= end)
+    if olympiad_id is not None:
+        stmt = stmt.where(OlympiadStage.olympiad_id == olympiad_id)
+
+    stages = await session.scalars(stmt)
+
+    return stages.all()
 
 
 async def get_all_olympiads(
         session: async_session,
-) -> Sequence[Olympiad]:
-    stmt = select(Olympiad).order_by(Olympiad.id)
-    olympiads = await session.scalars(stmt)
+) -> List[OlympiadSchema]:
+    return await select_olympiad_dtos(session)
 
-    fixed_olympiads = await olympiad_fixer(olympiads)
 
-    return fixed_olympiads
+async def stream_olympiads(
+        session: async_session,
+        batch_size: int = 1000
+) -> AsyncIterator[Dict]:
+    # Olympiads are read with a cursor batch_size rows at a time, stages of every batch
+    # with one id range query, so memory does not grow with catalog size.
+    # Yields dicts in upsert_olympiads format
+    olympiads_stmt = (
+        select(Olympiad.id, *(getattr(Olympiad, column) for column in OLYMPIAD_DATA_COLUMNS))
+        .order_by(Olympiad.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+    async for partition in (await session.stream(olympiads_stmt)).partitions():
+        stages_stmt = (
+            select(OlympiadStage.olympiad_id, OlympiadStage.name, OlympiadStage.start_date, OlympiadStage.end_date)
+            .where(OlympiadStage.olympiad_id.between(partition[0].id, partition[-1].id))
+            .order_by(OlympiadStage.olympiad_id, OlympiadStage.ordinal)
+        )
+        stages = defaultdict(list)
+        for olympiad_id, name, start_date, end_date in await session.execute(stages_stmt):
+            stages[olympiad_id].append({'name': name, 'start_date': start_date, 'end_date': end_date})
+
+        for row in partition:
+            olympiad = {column: getattr(row, column) for column in OLYMPIAD_DATA_COLUMNS}
+            olympiad['stages'] = stages.get(row.id, [])
+            yield olympiad
 
 
 async def search_for_olympiads(
         session: async_session,
         search_string: str
-) -> Sequence[Olympiad]:
+) -> List[OlympiadSchema]:
     # Search works fine
     search_pattern = f"%{search_string[1:-1].lower()}%"
-    stmt = (
-        select(Olympiad)
-        .where(
-            Olympiad.title.contains(search_pattern)
-        )
-    )
-    results = (await session.execute(stmt)).scalars().all()
+    results = await select_olympiad_dtos(session, Olympiad.title.contains(search_pattern))
 
-    fixed_results = await olympiad_fixer(results)
-    return fixed_results
+    return results
 
 
 async def filter_olympiads(
         subjects: List[str] | None,
         grades: List[int] | None,
         session: async_session
-) -> Sequence[Olympiad]:
-    # This FUCKING SQLAlchemy doesn't work. So doing python shit
+) -> List[OlympiadSchema]:
+    if session.get_bind().dialect.name == 'postgresql':
+        return await filter_olympiads_containment(subjects, grades, session)
+
+    # SQLite has no indexable JSON containment, so filtering is done in python
     all_olympiads = await get_all_olympiads(session=session)
 
     if subjects is not None:
-        if 'Языковедение' in subjects:
-            subjects.remove('Языковедение')
-            subjects += ['Русский язык', 'Английский язык', 'Китайский язык', 'Испанский язык']
+        subjects = expand_subjects(subjects)
 
         all_olympiads = list(
             filter(lambda olympiad: any(subject in olympiad.subjects for subject in subjects), all_olympiads))
@@ -130,6 +231,57 @@ async def filter_olympiads(
     return all_olympiads
 
 
+async def filter_olympiads_containment(
+        subjects: List[str] | None,
+        grades: List[int] | None,
+        session: async_session
+) -> List[OlympiadSchema]:
+    # JSONB @> containment, served by ix_olympiads_subjects and ix_olympiads_classes GIN indexes
+    criteria = []
+
+    # columns are typed with dialect-neutral JSON, coercing gives JSONB comparator (@> instead of LIKE)
+    olympiad_subjects, olympiad_classes = type_coerce(Olympiad.subjects, JSONB), type_coerce(Olympiad.classes, JSONB)
+
+    if subjects is not None:
+        criteria.append(or_(*(olympiad_subjects.contains([subject]) for subject in expand_subjects(subjects))))
+    if grades is not None:
+        criteria.append(or_(*(olympiad_classes.contains([grade]) for grade in grades)))
+
+    return await select_olympiad_dtos(session, *criteria)
+
+
+async def select_olympiad_dtos(
+        session: async_session,
+        *criteria
+) -> List[OlympiadSchema]:
+    # List reads select plain column tuples (olympiads and their stages, two queries)
+    # and build DTOs with precompiled converters: no ORM entities, identity map or validation
+    olympiad_converter = get_converter(Olympiad, OlympiadSchema)
+    stage_converter = get_converter(OlympiadStage, OlympiadStageSchema)
+
+    olympiads_stmt = olympiad_converter.select().where(*criteria).order_by(Olympiad.id)
+    stages_stmt = (select(OlympiadStage.olympiad_id, *stage_converter.columns)
+                   .order_by(OlympiadStage.olympiad_id, OlympiadStage.ordinal))
+    if criteria:
+        stages_stmt = stages_stmt.where(OlympiadStage.olympiad_id.in_(select(Olympiad.id).where(*criteria)))
+
+    stages = defaultdict(list)
+    for olympiad_id, *stage in await session.execute(stages_stmt):
+        stages[olympiad_id].append(stage_converter.from_row(stage))
+
+    return [olympiad_converter.from_row(row, stages=stages.get(row.id, []))
+            for row in await session.execute(olympiads_stmt)]
+
+
+def expand_subjects(subjects: List[str]) -> List[str]:
+    # 'Языковедение' on frontend means any language olympiad
+    if 'Языковедение' in subjects:
+        subjects = [subject for subject in subjects if subject != 'Языковедение']
+        subjects += ['Русский язык', 'Английский язык', 'Китайский язык', 'Испанский язык']
+
+    return subjects
+
+
 # ------------------ Update ------------------
 async def update_olympiad(
         session: async_session,
@@ -147,7 +299,8 @@ async def update_olympiad(
                 pass
 
     session.add(olympiad)
-    await session.commit()
+    await session.flush()
+    await publish_cache_versions(session, 'olympiad', [olympiad.id])
 
     return olympiad
 
@@ -170,14 +323,7 @@ async def delete_olympiad_by_id(
     olympiad = await get_olympiad_by_id(session=session, olympiad_id=olympiad_id)
 
     await session.delete(olympiad)
+    await publish_cache_versions(session, 'olympiad', [olympiad_id])
 
     return olympiad
 
-
-async def olympiad_fixer(olympiads: Sequence[Olympiad]) -> Sequence[Olympiad]:
-    fixed_olympiads = []
-    for olympiad in olympiads:
-        olympiad.convert_json_fields()
-        fixed_olympiads.append(olympiad)
-
-    return fixed_olympiads
@@ -1,10 +1,12 @@
-from typing import List
+from datetime import datetime
+from typing import Dict, Iterable, Sequence
 
-from sqlalchemy import select
+from sqlalchemy import select, delete, literal, or_
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import async_session
-from sqlalchemy.orm.attributes import flag_modified
 
-from src.aggregator.database import User
+from src.aggregator.database import User, UserOlympiad, Olympiad
+from .cache_version import publish_cache_versions
 
 
 # ------------------ Add ------------------
@@ -13,38 +15,49 @@ async def add_user(
         username: str,
         mail: str,
         password: str,
-        favorites: List[int | None] = None,
-        participates: List[int | None] = None,
-        notifications: List[int | None] = None
 ) -> User | None:
-    if favorites is None:
-        favorites = []
-
-    if participates is None:
-        participates = []
-
-    if notifications is None:
-        notifications = []
-
-    if await get_user_by_email(session, mail) or await get_user_by_username(session, username):
+    stmt = select(User.id).where(or_(User.mail == mail, User.username == username)).limit(1)
+    if await session.scalar(stmt) is not None:
         return None
 
     user = User(
         username=username,
         mail=mail,
         hashed_password=password,
-        favorites=favorites,
         n=7,
-        participates=participates,
-        notifications=notifications,
+        olympiad_links=[],
     )
 
     session.add(user)
-    await session.commit()
+    await session.flush()
 
     return user
 
 
+async def add_user_olympiad(
+        session: async_session,
+        user_id: int,
+        olympiad_id: int,
+        kind: str
+) -> None:
+    # Single idempotent INSERT, repeated adds are ignored by primary key
+    # and unknown olympiads are ignored by selecting the row from olympiads
+    row = select(literal(user_id), Olympiad.id, literal(kind), literal(datetime.now())).where(Olympiad.id == olympiad_id)
+    stmt = _insert(session, UserOlympiad).from_select(
+        ['user_id', 'olympiad_id', 'kind', 'created_at'], row
+    ).on_conflict_do_nothing()
+
+    await session.execute(stmt)
+
+
+def _insert(session: async_session, model):
+    # ON CONFLICT DO NOTHING lives in dialect-specific insert constructs
+    if session.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert(model)
+
+    return sqlite.insert(model)
+
+
 # ------------------ Get ------------------
 async def get_user_by_id(
         session: async_session,
@@ -76,38 +89,74 @@ async def get_user_by_username(
     return user
 
 
+async def get_user_by_login(
+        session: async_session,
+        login: str
+) -> User | None:
+    # Email match wins over username match, as if email was looked up first
+    stmt = (select(User)
+            .where(or_(User.mail == login, User.username == login))
+            .order_by((User.mail == login).desc())
+            .limit(1))
+    user = await session.scalar(stmt)
+
+    return user
+
+
+async def get_user_mails_by_ids(
+        session: async_session,
+        user_ids: Iterable[int]
+) -> Dict[int, str]:
+    stmt = select(User.id, User.mail).where(User.id.in_(set(user_ids)))
+    mails = await session.execute(stmt)
+
+    return dict(mails.tuples().all())
+
+
+async def get_user_ids_by_olympiad(
+        session: async_session,
+        olympiad_id: int,
+        kind: str
+) -> Sequence[int]:
+    stmt = select(UserOlympiad.user_id).where(UserOlympiad.olympiad_id == olympiad_id,
+                                              UserOlympiad.kind == kind)
+    user_ids = await session.scalars(stmt)
+
+    return user_ids.all()
+
+
 # ------------------ Update ------------------
-async def update_user_favorites(
+async def update_user_olympiads(
         session: async_session,
         user_id: int,
-        olympiad_id: int
+        olympiad_id: int,
+        kind: str
 ) -> User | None:
     user = await get_user_by_id(session, user_id)
 
-    if user is not None and olympiad_id not in user.favorites:
-        user.favorites.append(olympiad_id)
-        flag_modified(user, 'favorites')
-        session.add(user)
-        await session.commit()
+    if user is not None:
+        await add_user_olympiad(session, user_id, olympiad_id, kind)
+        await publish_cache_versions(session, 'user', [user_id])
+        await session.flush()
+        await session.refresh(user, ['olympiad_links'])
 
-        return user
+    return user
 
 
-async def update_user_participate(
+async def update_user_favorites(
         session: async_session,
         user_id: int,
         olympiad_id: int
 ) -> User | None:
-    user = await get_user_by_id(session, user_id)
+    return await update_user_olympiads(session, user_id, olympiad_id, 'favorites')
 
-    if user is not None and olympiad_id not in user.participates:
-        user.participates.append(olympiad_id)
-
-        flag_modified(user, 'participates')
-        session.add(user)
-        await session.commit()
 
-        return user
+async def update_user_participate(
+        session: async_session,
+        user_id: int,
+        olympiad_id: int
+) -> User | None:
+    return await update_user_olympiads(session, user_id, olympiad_id, 'participates')
 
 
 async def update_user_notification(
@@ -115,16 +164,7 @@ async def update_user_notification(
         user_id: int,
         olympiad_id: int
 ) -> User | None:
-    user = await get_user_by_id(session, user_id)
-
-    if user is not None and olympiad_id not in user.notifications:
-        user.notifications.append(olympiad_id)
-
-        flag_modified(user, 'notifications')
-        session.add(user)
-        await session.commit()
-
-        return user
+    return await update_user_olympiads(session, user_id, olympiad_id, 'notifications')
 
 
 async def update_user_n(
@@ -138,7 +178,8 @@ async def update_user_n(
         user.n = n
 
         session.add(user)
-        await session.commit()
+        await session.flush()
+        await publish_cache_versions(session, 'user', [user_id])
 
         return user
 
@@ -151,25 +192,48 @@ async def delete_user_by_id(
     user = await get_user_by_id(session=session, user_id=user_id)
 
     await session.delete(user)
+    await publish_cache_versions(session, 'user', [user_id])
 
     return user
 
 
-async def delete_user_favorite(
+async def delete_user_olympiad(
         session: async_session,
         user_id: int,
-        olympiad_id: int
+        olympiad_id: int,
+        kind: str
+) -> None:
+    # Single idempotent DELETE
+    stmt = delete(UserOlympiad).where(UserOlympiad.user_id == user_id,
+                                      UserOlympiad.kind == kind,
+                                      UserOlympiad.olympiad_id == olympiad_id)
+
+    await session.execute(stmt)
+
+
+async def delete_user_olympiads(
+        session: async_session,
+        user_id: int,
+        olympiad_id: int,
+        kind: str
 ) -> User | None:
     user = await get_user_by_id(session, user_id)
 
-    if user is not None and olympiad_id in user.favorites:
-        user.favorites.remove(olympiad_id)
+    if user is not None:
+        await delete_user_olympiad(session, user_id, olympiad_id, kind)
+        await publish_cache_versions(session, 'user', [user_id])
+        await session.flush()
+        await session.refresh(user, ['olympiad_links'])
 
-        flag_modified(user, 'favorites')
-        session.add(user)
-        await session.commit()
+    return user
 
-        return user
+
+async def delete_user_favorite(
+        session: async_session,
+        user_id: int,
+        olympiad_id: int
+) -> User | None:
+    return await delete_user_olympiads(session, user_id, olympiad_id, 'favorites')
 
 
 async def delete_user_participate(
@@ -177,13 +241,12 @@ async def delete_user_participate(
         user_id: int,
         olympiad_id: int
 ) -> User | None:
-    user = await get_user_by_id(session, user_id)
+    return await delete_user_olympiads(session, user_id, olympiad_id, 'participates')
 
-    if user is not None and olympiad_id in user.participates:
-        user.favorites.remove(olympiad_id)
 
-        flag_modified(user, 'participates')
-        session.add(user)
-        await session.commit()
-
-        return user
+async def delete_user_notification(
+        session: async_session,
+        user_id: int,
+        olympiad_id: int
+) -> User | None:
+    return await delete_user_olympiads(session, user_id, olympiad_id, 'notifications')
@@ -0,0 +1,224 @@
+import time
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Tuple
+
+from sqlalchemy import Engine, event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.aggregator import metrics
+
+# Engine labels of instrumented engines, read by _collect_pool_stats. Disposed and dropped engines go away
+_engines: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+class QueryStats:
+    """
+    Statements executed while tracked by track_queries
+
+    Attributes:
+        count: number of statements
+        duration: seconds spent in statements
+        statements: number of executions by statement shape (SQL text with placeholders)
+
+    Methods:
+        repeated(self, threshold): shapes executed at least threshold times, likely N+1 loops
+        violations(self, max_queries, max_repeats): descriptions of exceeded limits
+    """
+    __slots__ = ('count', 'duration', 'statements')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Dict[str, int] = defaultdict(int)
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        """
+        Args:
+            threshold: minimal number of executions
+
+        Returns: executions by statement shape for shapes executed at least threshold times
+
+        """
+        return {statement: count for statement, count in self.statements.items() if count >= threshold}
+
+    def violations(self, max_queries: int | None = None, max_repeats: int | None = None) -> List[str]:
+        """
+        Checks statements against limits
+
+        Args:
+            max_queries: maximal number of statements, not checked if None
+            max_repeats: maximal number of executions of one statement shape, not checked if None
+
+        Returns: descriptions of exceeded limits, empty if there are none
+
+        """
+        problems = []
+
+        if max_queries is not None and self.count > max_queries:
+            problems.append(f'{self.count} queries, budget is {max_queries}')
+        if max_repeats is not None:
+            for statement, count in self.repeated(max_repeats + 1).items():
+                problems.append(f'{count} executions of: {" ".join(statement.split())[:300]}')
+
+        return problems
+
+
+class QueryBudgetError(AssertionError):
+    pass
+
+
+class DeadlineExceeded(BaseException):
+    """
+    Statement was about to start after deadline of the request.
+    BaseException like asyncio.CancelledError: the request is abandoned, so services must not catch it
+    """
+    pass
+
+
+# Monotonic time after which statements of the current request are refused, set by AdmissionMiddleware
+request_deadline: ContextVar[float | None] = ContextVar('request_deadline', default=None)
+
+
+# QueryStats of all enclosing track_queries blocks of the current request or task
+_tracked: ContextVar[Tuple[QueryStats, ...]] = ContextVar('tracked_queries', default=())
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """
+    Counts statements executed inside the block by the current request or task.
+    Blocks can be nested, every statement is counted by all enclosing blocks
+
+    Returns: QueryStats, updated in place while block runs
+
+    """
+    stats = QueryStats()
+    token = _tracked.set(_tracked.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _tracked.reset(token)
+
+
+@contextmanager
+def untracked() -> Iterator[None]:
+    """
+    Hides statements of the block from all enclosing track_queries blocks,
+    used for work shared by many requests (e.g. catalog rebuild) which must not count against one of them
+
+    Returns: None
+
+    """
+    token = _tracked.set(())
+    try:
+        yield
+    finally:
+        _tracked.reset(token)
+
+
+@contextmanager
+def assert_query_budget(max_queries: int | None = None, max_repeats: int | None = None) -> Iterator[QueryStats]:
+    """
+    Assertion for tests: statements of the block must fit the budget, e.g.
+        with assert_query_budget(max_queries=2):
+            await client.get('/user/1/favorites')
+
+    Args:
+        max_queries: maximal number of statements, not checked if None
+        max_repeats: maximal number of executions of one statement shape, not checked if None
+
+    Returns: QueryStats of the block
+
+    Raises:
+        QueryBudgetError: if budget is exceeded
+
+    """
+    with track_queries() as stats:
+        yield stats
+
+    problems = stats.violations(max_queries, max_repeats)
+    if problems:
+        raise QueryBudgetError('Query budget exceeded: ' + '; '.join(problems))
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Pool of server and SQLite file databases which measures how long checkouts wait for a free connection.
+    Engine label is passed as pool_logging_name, so it survives pool recreation on dispose
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.db_pool_wait.observe(self.logging_name or 'primary', value=time.perf_counter() - start)
+
+
+def instrument_engine(engine: Engine, label: str) -> None:
+    """
+    Hooks statement and pool events of the engine into metrics
+
+    Args:
+        engine: sync engine (AsyncEngine.sync_engine)
+        label: value of engine label: primary or replica
+
+    Returns: None
+
+    """
+    _engines[engine] = label
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        deadline = request_deadline.get()
+        if deadline is not None and time.monotonic() > deadline:
+            raise DeadlineExceeded(f'Request deadline passed {time.monotonic() - deadline:.3f} s ago')
+
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_start'].pop()
+
+        metrics.db_queries.inc(label)
+        metrics.db_query_duration.observe(label, value=duration)
+
+        for stats in _tracked.get():
+            stats.count += 1
+            stats.duration += duration
+            stats.statements[statement] += 1
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(exception_context):
+        # failed statement never reaches after_cursor_execute
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_start'):
+            connection.info['query_start'].pop()
+
+    @event.listens_for(engine.pool, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.db_pool_checkouts.inc(label)
+
+    @event.listens_for(engine.pool, 'connect')
+    def connect(dbapi_connection, connection_record):
+        metrics.db_pool_connects.inc(label)
+
+
+def _collect_pool_stats() -> None:
+    checked_out, size = {}, {}
+
+    for engine, label in list(_engines.items()):
+        pool = engine.pool
+        if hasattr(pool, 'checkedout'):
+            checked_out[label] = checked_out.get(label, 0) + pool.checkedout()
+            size[label] = size.get(label, 0) + pool.checkedin() + pool.checkedout()
+
+    for label in checked_out:
+        metrics.db_pool_checked_out.set(label, value=checked_out[label])
+        metrics.db_pool_size.set(label, value=size[label])
+
+
+metrics.add_collector(_collect_pool_stats)
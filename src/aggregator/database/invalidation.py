@@ -0,0 +1,169 @@
+"""
+Invalidation bus of in-process caches (catalog, users)
+
+Writers in crud publish (entity, id, version) events into cache_versions table in the same transaction
+as the change (crud.publish_cache_versions), and apply them to caches of their own process at once.
+Every API worker polls the table for versions after the last applied one every
+settings.invalidation.poll_seconds (one indexed query), so changes made by other workers and by the scheduler
+reach its caches within that delay. If polling fails, all caches are invalidated, stale data is never kept.
+
+On PostgreSQL versions come from a sequence, and a transaction may commit after another one with a higher
+version. Versions below the latest applied one which were not seen yet (gaps) are queried again by every
+poll for settings.invalidation.gap_seconds, so a late commit is picked up if its transaction was open for less
+than that. A gap also comes from a rolled back transaction or a version overwritten by a later change of the
+same entities, it simply expires. SQLite commits versions in order (see crud.publish_cache_versions), it has no gaps.
+
+Caches subscribe with a function receiving ids of changed entities, None means all of them
+"""
+import asyncio
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Set
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import async_session
+
+from src.aggregator import metrics
+from src.aggregator.database.models import CACHE_VERSION_HEAD
+
+# Receives ids of changed entities, None if any entity could have changed
+Subscriber = Callable[[Set[int] | None], None]
+
+_subscribers: Dict[str, List[Subscriber]] = defaultdict(list)
+_version: int | None = None
+# Versions below _version which were not seen yet, by monotonic time they were found missing (PostgreSQL only)
+_gaps: Dict[int, float] = {}
+
+
+def subscribe(entity: str, subscriber: Subscriber) -> None:
+    """
+    Args:
+        entity: kind of entity ('olympiad', 'user')
+        subscriber: function invalidating cached entities
+
+    Returns: None
+
+    """
+    _subscribers[entity].append(subscriber)
+
+
+def apply(entity: str, entity_ids: Iterable[int] | None) -> None:
+    """
+    Passes event to subscribers of the entity
+
+    Args:
+        entity: kind of entity
+        entity_ids: ids of changed entities, None for all
+
+    Returns: None
+
+    """
+    entity_ids = None if entity_ids is None else set(entity_ids)
+
+    metrics.cache_invalidations.inc(entity)
+    for subscriber in _subscribers[entity]:
+        subscriber(entity_ids)
+
+
+def apply_all() -> None:
+    for entity in list(_subscribers):
+        apply(entity, None)
+
+
+async def sync(session: async_session) -> None:
+    """
+    Starts consuming events from the current version. Called before caches are filled
+
+    Args:
+        session: session for database
+
+    Returns: None
+
+    """
+    from src.aggregator.database import crud
+
+    global _version
+
+    _version = await crud.get_cache_version(session)
+    # caches filled after this call reflect every committed version, not yet committed ones are gaps
+    now = time.monotonic()
+    _gaps.clear()
+    _gaps.update((version, now) for version in await crud.get_pending_cache_versions(session, _version))
+
+
+async def poll(session: async_session, gap_seconds: float = 0) -> int:
+    """
+    Applies events published after the last applied version and events of gaps committed late
+
+    Args:
+        session: session for database
+        gap_seconds: how long a gap is queried again (see settings.invalidation)
+
+    Returns: number of applied events
+
+    """
+    from src.aggregator.database import crud
+
+    global _version
+
+    if _version is None:
+        await sync(session)
+        apply_all()
+        return 0
+
+    now = time.monotonic()
+    for version in [version for version, since in _gaps.items() if now - since > gap_seconds]:
+        del _gaps[version]
+
+    changed = defaultdict(set)
+    seen = set()
+    for entity, entity_id, entity_version in await crud.get_cache_versions_after(session, _version, _gaps):
+        seen.add(entity_version)
+        if (entity, entity_id) != CACHE_VERSION_HEAD:
+            changed[entity].add(entity_id)
+
+    for entity, entity_ids in changed.items():
+        apply(entity, entity_ids)
+
+    for version in seen & _gaps.keys():
+        del _gaps[version]
+    version = max(seen, default=_version)
+    if session.get_bind().dialect.name == 'postgresql':
+        _gaps.update((gap, now) for gap in range(_version + 1, version) if gap not in seen)
+    _version = max(_version, version)
+
+    return sum(len(entity_ids) for entity_ids in changed.values())
+
+
+async def run_poller(poll_seconds: float, gap_seconds: float = 0) -> None:
+    """
+    Polls events every poll_seconds until cancelled
+
+    Args:
+        poll_seconds: poll period
+        gap_seconds: how long a gap is queried again
+
+    Returns: None
+
+    """
+    from src.setup import get_session_maker
+
+    async def poll_once() -> None:
+        try:
+            async with session_maker() as session:
+                await poll(session, gap_seconds)
+        except Exception as e:
+            logger.warning(f'Cache invalidation poll failed, all caches are invalidated: {e}')
+            apply_all()
+
+    session_maker = await get_session_maker()
+    while True:
+        await asyncio.sleep(poll_seconds)
+
+        # cancellation (worker shutdown) waits for the running poll, the engine is disposed right after it
+        polling = asyncio.create_task(poll_once())
+        try:
+            await asyncio.shield(polling)
+        except asyncio.CancelledError:
+            await polling
+            raise
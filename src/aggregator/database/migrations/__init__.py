@@ -0,0 +1,133 @@
+"""
+Versioned schema migrations.
+Every migration is a module with version, description and upgrade(conn) function,
+applied in order inside its own transaction. Current version is stored in schema_version table
+"""
+from typing import List
+
+from loguru import logger
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from . import v0001_initial, v0002_user_olympiad, v0003_olympiad_stages, v0004_indexes, v0005_json_lists, \
+    v0006_cache_versions, v0007_cache_version_sequence
+
+MIGRATIONS = [
+    v0001_initial,
+    v0002_user_olympiad,
+    v0003_olympiad_stages,
+    v0004_indexes,
+    v0005_json_lists,
+    v0006_cache_versions,
+    v0007_cache_version_sequence,
+]
+
+HEAD = MIGRATIONS[-1].version
+
+
+class SchemaVersionError(RuntimeError):
+    """
+    Raised when database schema version differs from HEAD
+    """
+
+
+def get_version(conn) -> int:
+    """
+    Reads schema version of the database.
+    Databases created with create_all before migrations existed have no schema_version table,
+    they are treated as version 1 (later migrations detect already applied changes themselves)
+
+    Args:
+        conn: sync connection (run it with conn.run_sync)
+
+    Returns: schema version, 0 for empty database
+
+    """
+    inspector = inspect(conn)
+
+    if inspector.has_table('schema_version'):
+        return conn.execute(text('SELECT version FROM schema_version')).scalar_one()
+
+    return 1 if inspector.has_table('users') else 0
+
+
+def set_version(conn, version: int) -> None:
+    """
+    Writes schema version of the database
+
+    Args:
+        conn: sync connection (run it with conn.run_sync)
+        version: new schema version
+
+    Returns: None
+
+    """
+    conn.execute(text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)'))
+    conn.execute(text('DELETE FROM schema_version'))
+    conn.execute(text('INSERT INTO schema_version (version) VALUES (:version)'), {'version': version})
+
+
+async def upgrade_database(engine: AsyncEngine, target: int = HEAD) -> List[int]:
+    """
+    Applies all migrations after current database version up to target version
+
+    Args:
+        engine: engine of the database to upgrade
+        target: version to upgrade to, HEAD by default
+
+    Returns: list of applied versions
+
+    """
+    async with engine.connect() as conn:
+        current = await conn.run_sync(get_version)
+
+    applied = []
+    for migration in MIGRATIONS:
+        if current < migration.version <= target:
+            async with engine.begin() as conn:
+                await conn.run_sync(migration.upgrade)
+                await conn.run_sync(set_version, migration.version)
+
+            logger.info(f'Applied migration {migration.version}: {migration.description}')
+            applied.append(migration.version)
+
+    return applied
+
+
+async def check_database(engine: AsyncEngine) -> None:
+    """
+    Checks that database schema is at HEAD
+
+    Args:
+        engine: engine of the database to check
+
+    Returns: None
+
+    Raises:
+        SchemaVersionError: if database is behind or ahead of HEAD
+
+    """
+    async with engine.connect() as conn:
+        current = await conn.run_sync(get_version)
+
+    if current != HEAD:
+        raise SchemaVersionError(f'Database schema is at version {current}, application expects {HEAD}. '
+                                 f'Run "python -m src.aggregator.database.migrations upgrade"')
+
+
+async def migrate(connection_string: str) -> List[int]:
+    """
+    Upgrades database by connection string to HEAD
+
+    Args:
+        connection_string: SQLAlchemy connection string
+
+    Returns: list of applied versions
+
+    """
+    engine = create_async_engine(connection_string)
+
+    try:
+        return await upgrade_database(engine)
+    finally:
+        await engine.dispose()
@@ -0,0 +1,40 @@
+"""
+Migrations command line:
+    python -m src.aggregator.database.migrations upgrade  - upgrades database from config.toml to HEAD
+    python -m src.aggregator.database.migrations current  - prints current and HEAD versions
+"""
+import argparse
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.config import Settings
+from . import HEAD, get_version, migrate
+
+
+async def current(connection_string: str) -> int:
+    engine = create_async_engine(connection_string)
+
+    try:
+        async with engine.connect() as conn:
+            return await conn.run_sync(get_version)
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m src.aggregator.database.migrations')
+    parser.add_argument('command', choices=['upgrade', 'current'])
+    args = parser.parse_args()
+
+    connection_string = Settings().database.connection_string
+
+    if args.command == 'upgrade':
+        applied = asyncio.run(migrate(connection_string))
+        print(f'Applied migrations: {applied}' if applied else 'Database is already at HEAD')
+    else:
+        print(f'Current: {asyncio.run(current(connection_string))}, HEAD: {HEAD}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Initial schema: tables as they were created by Base.metadata.create_all before migrations existed
+"""
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, DateTime, ForeignKey, JSON
+
+version = 1
+description = 'initial schema'
+
+metadata = MetaData()
+
+Table(
+    'users', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('username', String, nullable=False),
+    Column('mail', String, nullable=False),
+    Column('n', Integer, nullable=False),
+    Column('favorites', JSON, nullable=False),
+    Column('participates', JSON, nullable=False),
+    Column('notifications', JSON, nullable=False),
+    Column('hashed_password', String, nullable=False),
+)
+
+Table(
+    'olympiads', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('title', String, nullable=False),
+    Column('level', Integer),
+    Column('dates', Text),
+    Column('description', String),
+    Column('subjects', Text, nullable=False),
+    Column('classes', JSON, nullable=False),
+    Column('site_data', String),
+)
+
+Table(
+    'notifications', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('olympiad_id', Integer, ForeignKey('olympiads.id'), nullable=False),
+    Column('text', String, nullable=False),
+    Column('date', DateTime, nullable=False),
+)
+
+Table(
+    'logs', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('log_type', Integer, nullable=False),
+    Column('date', DateTime, nullable=False),
+    Column('text', String, nullable=False),
+)
+
+
+def upgrade(conn) -> None:
+    metadata.create_all(conn)
@@ -0,0 +1,62 @@
+"""
+Moves favorites, participates and notifications JSON list columns of users table
+into user_olympiad link table and drops these columns
+"""
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import (MetaData, Table, Column, Integer, String, DateTime, ForeignKey, Index,
+                        PrimaryKeyConstraint, inspect, text, insert)
+
+version = 2
+description = 'user_olympiad link table'
+
+KINDS = ('favorites', 'participates', 'notifications')
+
+metadata = MetaData()
+
+Table('users', metadata, Column('id', Integer, primary_key=True))
+Table('olympiads', metadata, Column('id', Integer, primary_key=True))
+
+user_olympiad = Table(
+    'user_olympiad', metadata,
+    Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('olympiad_id', Integer, ForeignKey('olympiads.id'), nullable=False),
+    Column('kind', String, nullable=False),
+    Column('created_at', DateTime, nullable=False),
+    PrimaryKeyConstraint('user_id', 'kind', 'olympiad_id'),
+    Index('ix_user_olympiad_olympiad_id_kind', 'olympiad_id', 'kind'),
+)
+
+
+def upgrade(conn) -> None:
+    # databases created with create_all may already have the table and no list columns
+    user_olympiad.create(conn, checkfirst=True)
+
+    columns = {column['name'] for column in inspect(conn).get_columns('users')}
+    kinds = [kind for kind in KINDS if kind in columns]
+
+    if not kinds:
+        return
+
+    now = datetime.now()
+    links = {}
+    for user_id, *lists in conn.execute(text(f'SELECT id, {", ".join(kinds)} FROM users')):
+        for kind, olympiad_ids in zip(kinds, lists):
+            if isinstance(olympiad_ids, str):
+                olympiad_ids = json.loads(olympiad_ids)
+            # created_at keeps the original list order, duplicates keep the first position
+            for position, olympiad_id in enumerate(olympiad_ids or []):
+                links.setdefault((user_id, kind, olympiad_id), {'user_id': user_id,
+                                                                'olympiad_id': olympiad_id,
+                                                                'kind': kind,
+                                                                'created_at': now + timedelta(microseconds=position)})
+
+    existing = set(conn.execute(text('SELECT user_id, kind, olympiad_id FROM user_olympiad')).tuples())
+    links = [link for key, link in links.items() if key not in existing]
+
+    if links:
+        conn.execute(insert(user_olympiad), links)
+
+    for kind in kinds:
+        conn.execute(text(f'ALTER TABLE users DROP COLUMN {kind}'))
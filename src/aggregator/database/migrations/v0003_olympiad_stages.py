@@ -0,0 +1,87 @@
+"""
+Moves stringified stage dicts of olympiads.dates column into olympiad_stages table and drops the column
+"""
+import ast
+from datetime import date, datetime
+
+from loguru import logger
+from sqlalchemy import (MetaData, Table, Column, Integer, String, Date, ForeignKey, Index,
+                        PrimaryKeyConstraint, inspect, text, insert)
+
+version = 3
+description = 'olympiad_stages table'
+
+metadata = MetaData()
+
+Table('olympiads', metadata, Column('id', Integer, primary_key=True))
+
+olympiad_stages = Table(
+    'olympiad_stages', metadata,
+    Column('olympiad_id', Integer, ForeignKey('olympiads.id'), nullable=False),
+    Column('ordinal', Integer, nullable=False),
+    Column('name', String, nullable=False),
+    Column('start_date', Date, nullable=False),
+    Column('end_date', Date),
+    PrimaryKeyConstraint('olympiad_id', 'ordinal'),
+    Index('ix_olympiad_stages_start_date', 'start_date'),
+)
+
+
+def parse_stage_date(value: str) -> date:
+    """
+    Parses stage date stored in old olympiads.dates column.
+    Dates were stored either as ISO strings or as "%b %d" strings without a year (current year is assumed)
+
+    Args:
+        value: stored date string
+
+    Returns: date
+
+    """
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(f'{value} {date.today().year}', '%b %d %Y').date()
+
+
+def upgrade(conn) -> None:
+    # databases created with create_all may already have the table and no dates column
+    olympiad_stages.create(conn, checkfirst=True)
+
+    columns = {column['name'] for column in inspect(conn).get_columns('olympiads')}
+
+    if 'dates' not in columns:
+        return
+
+    existing = set(conn.execute(text('SELECT DISTINCT olympiad_id FROM olympiad_stages')).scalars())
+
+    stages = []
+    for olympiad_id, dates in conn.execute(text('SELECT id, dates FROM olympiads')):
+        if olympiad_id in existing:
+            continue
+
+        try:
+            dates = ast.literal_eval(dates) if dates else {}
+            if not isinstance(dates, dict):
+                raise ValueError(dates)
+        except (ValueError, SyntaxError):
+            logger.warning(f'Skipped dates of olympiad {olympiad_id}: {dates!r}')
+            continue
+
+        for ordinal, (name, stage_dates) in enumerate(dates.items()):
+            try:
+                stage_dates = [parse_stage_date(value) for value in stage_dates]
+            except ValueError:
+                logger.warning(f'Skipped stage {name!r} of olympiad {olympiad_id}: {stage_dates!r}')
+                continue
+
+            stages.append({'olympiad_id': olympiad_id,
+                           'ordinal': ordinal,
+                           'name': name,
+                           'start_date': stage_dates[0],
+                           'end_date': stage_dates[1] if len(stage_dates) > 1 else None})
+
+    if stages:
+        conn.execute(insert(olympiad_stages), stages)
+
+    conn.execute(text('ALTER TABLE olympiads DROP COLUMN dates'))
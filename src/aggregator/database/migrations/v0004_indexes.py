@@ -0,0 +1,33 @@
+"""
+Adds lookup indexes: unique username, mail and olympiad site_data
+(login, auth checks and parser upserts) and notification indexes (scheduling and sending)
+"""
+from sqlalchemy import text
+
+version = 4
+description = 'lookup indexes and uniqueness constraints'
+
+UNIQUE_INDEXES = (
+    ('ix_users_username', 'users', 'username'),
+    ('ix_users_mail', 'users', 'mail'),
+    ('ix_olympiads_site_data', 'olympiads', 'site_data'),
+)
+
+INDEXES = (
+    ('ix_notifications_user_id_olympiad_id', 'notifications', 'user_id, olympiad_id'),
+    ('ix_notifications_date', 'notifications', 'date'),
+)
+
+
+def upgrade(conn) -> None:
+    for name, table, column in UNIQUE_INDEXES:
+        duplicates = conn.execute(text(f'SELECT {column} FROM {table} '
+                                       f'WHERE {column} IS NOT NULL '
+                                       f'GROUP BY {column} HAVING COUNT(*) > 1 LIMIT 10')).scalars().all()
+        if duplicates:
+            raise RuntimeError(f'Can not create unique index {name}: duplicated {table}.{column} values {duplicates}')
+
+        conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table} ({column})'))
+
+    for name, table, columns in INDEXES:
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
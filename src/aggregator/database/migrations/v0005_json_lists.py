@@ -0,0 +1,60 @@
+"""
+Stores olympiads.subjects as JSON instead of python list repr.
+On PostgreSQL also turns list columns into JSONB with GIN indexes for containment filters
+and drops logs.user_id foreign key (system logs are written with user_id 0)
+"""
+import ast
+import json
+
+from loguru import logger
+from sqlalchemy import text, inspect
+
+version = 5
+description = 'JSON olympiad subjects, JSONB and GIN indexes on PostgreSQL'
+
+
+def parse_subjects(value) -> list:
+    """
+    Parses subjects stored either as JSON or as python list repr
+
+    Args:
+        value: stored value
+
+    Returns: list of subjects
+
+    """
+    if isinstance(value, list):
+        return value
+
+    try:
+        return json.loads(value)
+    except ValueError:
+        return ast.literal_eval(value)
+
+
+def upgrade(conn) -> None:
+    updates = []
+    for olympiad_id, subjects in conn.execute(text('SELECT id, subjects FROM olympiads')):
+        try:
+            parsed = parse_subjects(subjects)
+        except (ValueError, SyntaxError):
+            logger.warning(f'Reset unparsable subjects of olympiad {olympiad_id}: {subjects!r}')
+            parsed = []
+
+        updates.append({'id': olympiad_id, 'subjects': json.dumps(parsed, ensure_ascii=False)})
+
+    if updates:
+        conn.execute(text('UPDATE olympiads SET subjects = :subjects WHERE id = :id'), updates)
+
+    if conn.dialect.name != 'postgresql':
+        return
+
+    conn.execute(text('ALTER TABLE olympiads '
+                      'ALTER COLUMN subjects TYPE JSONB USING subjects::jsonb, '
+                      'ALTER COLUMN classes TYPE JSONB USING classes::jsonb'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_olympiads_subjects ON olympiads USING gin (subjects)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_olympiads_classes ON olympiads USING gin (classes)'))
+
+    for foreign_key in inspect(conn).get_foreign_keys('logs'):
+        if foreign_key['constrained_columns'] == ['user_id']:
+            conn.execute(text(f'ALTER TABLE logs DROP CONSTRAINT {foreign_key["name"]}'))
@@ -0,0 +1,24 @@
+"""
+Adds cache_versions table: versions of changed olympiads and users polled by every process
+to invalidate its in-process caches, and its head row with the latest version
+"""
+from sqlalchemy import MetaData, Table, Column, Integer, String, Index, PrimaryKeyConstraint, insert
+
+version = 6
+description = 'cache_versions table'
+
+metadata = MetaData()
+
+cache_versions = Table(
+    'cache_versions', metadata,
+    Column('entity', String, nullable=False),
+    Column('entity_id', Integer, nullable=False),
+    Column('version', Integer, nullable=False),
+    PrimaryKeyConstraint('entity', 'entity_id'),
+    Index('ix_cache_versions_version', 'version'),
+)
+
+
+def upgrade(conn) -> None:
+    cache_versions.create(conn, checkfirst=True)
+    conn.execute(insert(cache_versions).values(entity='*', entity_id=0, version=0))
@@ -0,0 +1,18 @@
+"""
+Cache versions on PostgreSQL are taken from cache_version_seq sequence instead of the head row of
+cache_versions: every writer updated that row, so writing transactions of all processes waited for its lock.
+The sequence continues from the head row, which is removed. SQLite keeps the head row
+"""
+from sqlalchemy import text
+
+version = 7
+description = 'cache_version_seq sequence on PostgreSQL'
+
+
+def upgrade(conn) -> None:
+    if conn.dialect.name != 'postgresql':
+        return
+
+    head = conn.execute(text("SELECT version FROM cache_versions WHERE entity = '*' AND entity_id = 0")).scalar()
+    conn.execute(text(f'CREATE SEQUENCE IF NOT EXISTS cache_version_seq START WITH {(head or 0) + 1}'))
+    conn.execute(text("DELETE FROM cache_versions WHERE entity = '*' AND entity_id = 0"))
@@ -1,62 +1,19 @@
-import json
-from datetime import datetime
-from typing import List, Dict
+from datetime import datetime, date
+from typing import List
 
-from sqlalchemy import ForeignKey, DateTime, TypeDecorator, TEXT
-from sqlalchemy.dialects.sqlite import JSON
+from sqlalchemy import ForeignKey, DateTime, Date, JSON, Index, PrimaryKeyConstraint, Sequence
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import AsyncAttrs
-from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase
+from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, relationship
 
-from src.aggregator.DTOs import UserSchema, NotificationSchema, OlympiadSchema
+from src.aggregator.DTOs import UserSchema, NotificationSchema, OlympiadSchema, OlympiadStageSchema
+from src.aggregator.database.converters import get_converter
 
+# Kinds of user-olympiad links. Values are the same as names of corresponding UserSchema list fields
+USER_OLYMPIAD_KINDS = ('favorites', 'participates', 'notifications')
 
-class UnicodeText(TypeDecorator):
-    """
-    This class implement type to save encoding in jsons with russian strings.
-    It stringifies of them and this helps us not to lose encoding.
-    Separated class needed for detection which fields convert back to json.
-
-    Attributes:
-        impl:
-        cache_ok:
-
-    Methods:
-        process_bind_param(self, value, dialect):
-        process_result_value(self, value, dialect):
-
-    """
-    impl = TEXT
-    cache_ok = True
-
-    def process_bind_param(self, value, dialect):
-        """
-        Overrides TypeDecorator method
-
-        Args:
-            value: value to convert
-            dialect:
-
-        Returns: stringified value
-
-        """
-        if value is None:
-            return value
-        return str(value)
-
-    def process_result_value(self, value, dialect):
-        """
-        Overrides TypeDecorator method
-
-        Args:
-            value: value to convert
-            dialect:
-
-        Returns: stringified value
-
-        """
-        if value is None:
-            return value
-        return str(value)
+# Lists are stored as JSON: JSON text on SQLite, JSONB (indexable with GIN) on PostgreSQL
+JSONList = JSON().with_variant(JSONB(), 'postgresql')
 
 
 class Base(DeclarativeBase, AsyncAttrs):
@@ -68,11 +25,10 @@ class Base(DeclarativeBase, AsyncAttrs):
 
     Methods:
         to_dto_model(self, model): converts SQLAlchemy class to corresponding DTO class
-
-        convert_json_fields(self): converts string object from db to json
+            with precompiled converter (see converters.py), without validation
     """
-    type_annotation_map: dict = {List[int]: JSON(),
-                                 List[str]: UnicodeText}
+    type_annotation_map: dict = {List[int]: JSONList,
+                                 List[str]: JSONList}
 
     def to_dto_model(self, model):
         """
@@ -86,20 +42,7 @@ class Base(DeclarativeBase, AsyncAttrs):
         """
         if model is None:
             return None
-        return model(**self.__dict__)
-
-    def convert_json_fields(self):
-        """
-        Checks if data type of attribute is UnicodeText and if yes converts UnicodeText to json object (python dict)
-
-        Returns: None
-
-        """
-        for col_name, col_type in self.__mapper__.c.items():
-            if isinstance(col_type.type, UnicodeText):
-                json_value = getattr(self, col_name)
-                if json_value is not None:
-                    setattr(self, col_name, json.loads(json_value.replace("'", '"')))
+        return get_converter(type(self), model).from_instance(self)
 
 
 class User(Base):
@@ -109,13 +52,14 @@ class User(Base):
     Attributes:
         __tablename__: sets table name
         id: user unique id
-        username: username
-        mail: users email
+        username: username (unique)
+        mail: users email (unique)
         n: the number of days for which to send notifications
+        hashed_password: hashed user password
+        olympiad_links: user_olympiad rows of the user, loaded together with user
         favorites: list of user favorite olympiad ids
         participates: list of user olympiad ids which user participates
         notifications: list of user olympiad ids that the user wants to receive notifications from
-        hashed_password: hashed user password
 
     Methods:
         to_dto_model(self, model=UserSchema) -> UserSchema: converts SQLAlchemy class into DTO
@@ -123,14 +67,30 @@ class User(Base):
     __tablename__ = "users"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True, nullable=False)
-    username: Mapped[str]
-    mail: Mapped[str]
+    username: Mapped[str] = mapped_column(unique=True, index=True)
+    mail: Mapped[str] = mapped_column(unique=True, index=True)
     n: Mapped[int]
-    favorites: Mapped[List[int]]
-    participates: Mapped[List[int]]
-    notifications: Mapped[List[int]]
     hashed_password: Mapped[str]
 
+    olympiad_links: Mapped[List["UserOlympiad"]] = relationship(lazy="selectin",
+                                                                order_by="UserOlympiad.created_at",
+                                                                cascade="all, delete-orphan")
+
+    def _olympiad_ids(self, kind: str) -> List[int]:
+        return [link.olympiad_id for link in self.olympiad_links if link.kind == kind]
+
+    @property
+    def favorites(self) -> List[int]:
+        return self._olympiad_ids('favorites')
+
+    @property
+    def participates(self) -> List[int]:
+        return self._olympiad_ids('participates')
+
+    @property
+    def notifications(self) -> List[int]:
+        return self._olympiad_ids('notifications')
+
     def to_dto_model(self, model=UserSchema) -> UserSchema:
         """
         Converts SQLAlchemy class into DTO
@@ -144,37 +104,111 @@ class User(Base):
         return super().to_dto_model(model)
 
 
+class UserOlympiad(Base):
+    """
+    Class for user_olympiad link table: one row for every olympiad in user's favorites,
+    participates or notifications list
+
+    Attributes:
+        __tablename__: sets table name
+        __table_args__: composite primary key and reverse index for "who follows olympiad X" queries
+        user_id: id of the user (foreign key to users table)
+        olympiad_id: id of the olympiad (foreign key to olympiads table)
+        kind: one of USER_OLYMPIAD_KINDS
+        created_at: date and time when olympiad was added to the list, defines list order
+    """
+    __tablename__ = "user_olympiad"
+    __table_args__ = (
+        PrimaryKeyConstraint("user_id", "kind", "olympiad_id"),
+        Index("ix_user_olympiad_olympiad_id_kind", "olympiad_id", "kind"),
+    )
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    olympiad_id: Mapped[int] = mapped_column(ForeignKey("olympiads.id"))
+    kind: Mapped[str]
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+
 class Olympiad(Base):
     """
     Class for olympiad table
 
     Attributes:
         __tablename__: sets table name
+        __table_args__: GIN indexes for subject and grade containment queries (PostgreSQL only)
         id: olympiad unique id
         title: title of the olympiad
         level: difficulty level of the olympiad (optional)
-        dates: dictionary containing start and end dates of the olympiad
         description: description of the olympiad (optional)
         subjects: list of subjects associated with the olympiad
         classes: list of class levels associated with the olympiad
-        site_data: additional data related to the olympiad (optional)
+        site_data: additional data related to the olympiad (optional, unique)
+        stages: olympiad stages ordered by ordinal, loaded together with olympiad
 
     Methods:
         to_dto_model(self, model=OlympiadSchema) -> OlympiadSchema: converts SQLAlchemy class into DTO
     """
 
     __tablename__ = "olympiads"
+    __table_args__ = (
+        Index("ix_olympiads_subjects", "subjects", postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index("ix_olympiads_classes", "classes", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True, nullable=False)
     title: Mapped[str]
     level: Mapped[int | None]
-    dates: Mapped[Dict[str, List[str]]] = mapped_column(UnicodeText)
     description: Mapped[str | None]
     subjects: Mapped[List[str]]
     classes: Mapped[List[int]]
-    site_data: Mapped[str | None]
+    site_data: Mapped[str | None] = mapped_column(unique=True, index=True)
+
+    stages: Mapped[List["OlympiadStage"]] = relationship(lazy="selectin",
+                                                         order_by="OlympiadStage.ordinal",
+                                                         cascade="all, delete-orphan")
 
     def to_dto_model(self, model=OlympiadSchema) -> OlympiadSchema:
+        """
+        Converts SQLAlchemy class into DTO, stages are converted too
+
+        Args:
+            model: corresponding DTO model. Passed by default
+
+        Returns: Pydantic DTO model
+        """
+        return get_converter(Olympiad, model).from_instance(self,
+                                                            stages=[stage.to_dto_model() for stage in self.stages])
+
+
+class OlympiadStage(Base):
+    """
+    Class for olympiad_stages table
+
+    Attributes:
+        __tablename__: sets table name
+        __table_args__: composite primary key and index for date range queries
+        olympiad_id: id of the olympiad (foreign key to olympiads table)
+        ordinal: position of the stage on the olympiad page
+        name: name of the stage
+        start_date: date when stage starts
+        end_date: date when stage ends (optional)
+
+    Methods:
+        to_dto_model(self, model=OlympiadStageSchema) -> OlympiadStageSchema: converts SQLAlchemy class into DTO
+    """
+    __tablename__ = "olympiad_stages"
+    __table_args__ = (
+        PrimaryKeyConstraint("olympiad_id", "ordinal"),
+        Index("ix_olympiad_stages_start_date", "start_date"),
+    )
+
+    olympiad_id: Mapped[int] = mapped_column(ForeignKey("olympiads.id"))
+    ordinal: Mapped[int]
+    name: Mapped[str]
+    start_date: Mapped[date] = mapped_column(Date)
+    end_date: Mapped[date | None] = mapped_column(Date)
+
+    def to_dto_model(self, model=OlympiadStageSchema) -> OlympiadStageSchema:
         """
         Converts SQLAlchemy class into DTO
 
@@ -192,6 +226,7 @@ class Notification(Base):
 
     Attributes:
         __tablename__: sets table name
+        __table_args__: index for user's notifications of olympiad lookups
         id: notification unique id
         user_id: id of the user receiving the notification (foreign key to users table)
         olympiad_id: id of the olympiad for which the notification is sent (foreign key to olympiads table)
@@ -202,12 +237,15 @@ class Notification(Base):
         to_dto_model(self, model=NotificationSchema) -> NotificationSchema: converts SQLAlchemy class into DTO
     """
     __tablename__ = "notifications"
+    __table_args__ = (
+        Index("ix_notifications_user_id_olympiad_id", "user_id", "olympiad_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True, nullable=False)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     olympiad_id: Mapped[int] = mapped_column(ForeignKey("olympiads.id"))
     text: Mapped[str]
-    date: Mapped[datetime] = mapped_column(DateTime)
+    date: Mapped[datetime] = mapped_column(DateTime, index=True)
 
     def to_dto_model(self, model=NotificationSchema) -> NotificationSchema:
         """
@@ -228,7 +266,7 @@ class Logs(Base):
     Attributes:
         __tablename__: sets table name
         id: log unique id
-        user_id: id of the user associated with the log (foreign key to users table)
+        user_id: id of the user associated with the log, 0 for system logs
         log_type: type of log entry
         date: date and time when the log entry was created
         text: log entry text
@@ -239,7 +277,38 @@ class Logs(Base):
     __tablename__ = "logs"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True, nullable=False)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    # Not a foreign key: system logs are written with user_id 0
+    user_id: Mapped[int] = mapped_column(nullable=False)
     log_type: Mapped[int]
     date: Mapped[datetime] = mapped_column(DateTime)
     text: Mapped[str]
+
+
+class CacheVersion(Base):
+    """
+    Class for cache_versions table: invalidation events of in-process caches (see database/invalidation.py).
+    Every changed entity has one row with the version of its last change. Versions are taken from
+    CACHE_VERSION_SEQUENCE on PostgreSQL, so writers do not wait for each other, but may commit out of version
+    order (pollers re-read a window of recent versions). On SQLite, where a write transaction locks the whole
+    database anyway, row with entity '*' (CACHE_VERSION_HEAD) holds the latest version given out
+
+    Attributes:
+        __tablename__: sets table name
+        __table_args__: composite primary key and version index for polling
+        entity: kind of cached entity ('olympiad', 'user')
+        entity_id: id of the entity
+        version: version of the last change
+    """
+    __tablename__ = "cache_versions"
+    __table_args__ = (
+        PrimaryKeyConstraint("entity", "entity_id"),
+        Index("ix_cache_versions_version", "version"),
+    )
+
+    entity: Mapped[str]
+    entity_id: Mapped[int]
+    version: Mapped[int]
+
+
+CACHE_VERSION_HEAD = ('*', 0)
+CACHE_VERSION_SEQUENCE = Sequence('cache_version_seq')
@@ -0,0 +1,88 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Iterator, Sequence
+
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+
+# Set by read_only decorator for the duration of a service call
+_read_only: ContextVar[bool] = ContextVar('read_only', default=False)
+
+
+def read_only(func):
+    """
+    Decorator for SELECT-only service functions
+    Statements of the session made inside the function are sent to read replicas (if any are configured)
+
+    Args:
+        func: service function to route
+
+    Returns: wrapper
+
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _read_only.set(True)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _read_only.reset(token)
+
+    return wrapper
+
+
+@contextmanager
+def on_primary() -> Iterator[None]:
+    """
+    Sends statements of the block to the primary even inside read_only functions,
+    used for reads which must not lag behind invalidation events (catalog rebuild)
+
+    Returns: None
+
+    """
+    token = _read_only.set(False)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+class RoutingSession(Session):
+    """
+    Session which sends reads made inside read_only functions to a random replica
+    and everything else to the primary.
+    Session is pinned to the primary after its first write (flush or DML statement),
+    so a request always reads its own writes
+
+    Attributes:
+        replicas: engines of read replicas
+
+    Methods:
+        get_bind(self, mapper, clause, **kw): chooses engine for the statement
+    """
+
+    def __init__(self, replicas: Sequence[Engine] = (), **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.replicas = list(replicas)
+        self._pinned = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        """
+        Overrides Session method
+
+        Args:
+            mapper: mapper of the statement entity
+            clause: statement to execute
+
+        Returns: Engine or Connection to execute statement with
+
+        """
+        if self._flushing or (clause is not None and not getattr(clause, 'is_select', False)):
+            self._pinned = True
+
+        if self.replicas and _read_only.get() and not self._pinned:
+            return random.choice(self.replicas)
+
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
@@ -0,0 +1,326 @@
+"""
+Prometheus metrics of all processes (API workers, scheduler with crawler and notifications)
+
+Metrics are plain in-memory values updated from the event loop thread, so the hot path is
+a dict lookup and an addition, without locks or syscalls. Every process periodically writes
+a snapshot of its values into <metrics.directory>/<pid>.json, and /metrics (served by any worker)
+sums snapshots of all processes:
+    counters and histograms - over every snapshot, so values of restarted workers are kept
+    gauges                  - over processes whose snapshot is fresh (updated within 3 flush periods)
+Values are collected on the event loop thread, snapshot files are written and read in a thread,
+so flushes and scrapes do not block the loop on file I/O
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Prometheus default buckets, seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+class Metric:
+    """
+    Base class of metrics: name, help text and label names, values by tuple of label values
+
+    Attributes:
+        name: metric name
+        documentation: HELP text
+        labelnames: names of labels, label values are passed positionally in the same order
+        type: Prometheus metric type
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = defaultdict(float)
+
+        REGISTRY.append(self)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {json.dumps(labels, ensure_ascii=False): value for labels, value in self._values.items()}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] += amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] += amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] -= amount
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    """
+    Histogram with fixed buckets. Stores per-bucket (not cumulative) counts and the sum,
+    cumulative counts are computed only when metrics are rendered
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, *labels: str, value: float) -> None:
+        values = self._values.get(labels)
+        if values is None:
+            # counts of every bucket, +Inf bucket and sum
+            values = self._values[labels] = [0] * (len(self.buckets) + 2)
+
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def snapshot(self) -> Dict[str, object]:
+        # lists are copied, snapshot is serialized in another thread while observations go on
+        return {json.dumps(labels, ensure_ascii=False): list(value) for labels, value in self._values.items()}
+
+
+REGISTRY: List[Metric] = []
+
+# Called before every snapshot, fill gauges which are read from other objects (e.g. connection pools)
+_collectors: List[Callable[[], None]] = []
+
+
+def add_collector(collector: Callable[[], None]) -> None:
+    """
+    Registers function called before every snapshot
+
+    Args:
+        collector: function updating gauges
+
+    Returns: None
+
+    """
+    _collectors.append(collector)
+
+
+# ------------------ HTTP ------------------
+http_requests = Counter('http_requests_total', 'Finished HTTP requests',
+                        ('method', 'route', 'status'))
+http_request_duration = Histogram('http_request_duration_seconds', 'HTTP request latency',
+                                  ('method', 'route'))
+http_requests_in_progress = Gauge('http_requests_in_progress', 'HTTP requests being processed',
+                                  ('method', 'route'))
+http_request_db_queries = Histogram('http_request_db_queries', 'Database queries made by one HTTP request',
+                                    ('method', 'route'), buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100))
+http_request_db_duration = Histogram('http_request_db_duration_seconds',
+                                     'Time one HTTP request spent in database queries', ('method', 'route'))
+http_requests_shed = Counter('http_requests_shed_total',
+                             'Requests rejected or cancelled by admission control by reason '
+                             '(saturated, queue_timeout, deadline or disconnected)', ('class', 'reason'))
+http_requests_waiting = Gauge('http_requests_waiting', 'Requests waiting for admission', ('class',))
+login_attempts_limited = Counter('login_attempts_limited_total',
+                                 'Login attempts rejected by rate limiter by key (ip or login)', ('key',))
+
+# ------------------ Database ------------------
+db_queries = Counter('db_queries_total', 'Executed database statements', ('engine',))
+db_query_duration = Histogram('db_query_duration_seconds', 'Database statement latency', ('engine',),
+                              buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+db_pool_checkouts = Counter('db_pool_checkouts_total', 'Connections checked out from pool', ('engine',))
+db_pool_connects = Counter('db_pool_connects_total', 'New database connections opened', ('engine',))
+db_pool_wait = Histogram('db_pool_wait_seconds', 'Time spent waiting for a pooled connection', ('engine',),
+                         buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0))
+db_pool_checked_out = Gauge('db_pool_checked_out', 'Connections currently checked out', ('engine',))
+db_pool_size = Gauge('db_pool_size', 'Connections currently kept by pool', ('engine',))
+
+# ------------------ Application ------------------
+cache_invalidations = Counter('cache_invalidations_total', 'Cache invalidation events applied by entity',
+                              ('entity',))
+user_cache_lookups = Counter('user_cache_lookups_total', 'User cache lookups by result (hit or miss)', ('result',))
+catalog_lookups = Counter('catalog_lookups_total', 'Catalog read model lookups by result (hit or rebuild)',
+                          ('result',))
+crawler_pages = Counter('crawler_pages_total', 'Olympiad pages fetched by crawler by result (ok or failed)',
+                        ('result',))
+notifications_sent = Counter('notifications_sent_total', 'Notification emails by result (sent or failed)',
+                             ('result',))
+
+
+# ------------------ Snapshots ------------------
+def _snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f'{pid}.json')
+
+
+def collect() -> Dict[str, Dict[str, object]]:
+    """
+    Runs collectors and copies values of this process, called from the event loop thread
+
+    Returns: snapshot of metrics by name
+
+    """
+    for collector in _collectors:
+        collector()
+
+    return {metric.name: metric.snapshot() for metric in REGISTRY if metric._values}
+
+
+# flusher and /metrics may write the snapshot of this process from two threads at once
+_write_lock = threading.Lock()
+
+
+def write_snapshot(directory: str, snapshot: Dict[str, Dict[str, object]]) -> None:
+    """
+    Writes snapshot of this process into directory, blocking file I/O
+
+    Args:
+        directory: metrics directory shared by all processes
+        snapshot: values returned by collect
+
+    Returns: None
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory, os.getpid())
+    # written to temporary file first, so readers never see half-written snapshot
+    with _write_lock:
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(snapshot, file, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+
+async def run_flusher(directory: str, flush_seconds: float) -> None:
+    """
+    Flushes metrics every flush_seconds until cancelled, and once more on cancellation
+
+    Args:
+        directory: metrics directory shared by all processes
+        flush_seconds: flush period
+
+    Returns: None
+
+    """
+    try:
+        while True:
+            await asyncio.to_thread(write_snapshot, directory, collect())
+            await asyncio.sleep(flush_seconds)
+    finally:
+        await asyncio.to_thread(write_snapshot, directory, collect())
+
+
+def reset(directory: str) -> None:
+    """
+    Removes snapshots of previous runs, called once before workers are started
+
+    Args:
+        directory: metrics directory
+
+    Returns: None
+
+    """
+    if not os.path.isdir(directory):
+        return
+
+    for name in os.listdir(directory):
+        if name.endswith('.json') or name.endswith('.json.tmp'):
+            os.remove(os.path.join(directory, name))
+
+
+def _read_snapshots(directory: str, flush_seconds: float) -> List[Tuple[dict, bool]]:
+    snapshots, now = [], time.time()
+
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+
+        path = os.path.join(directory, name)
+        try:
+            with open(path, encoding='utf-8') as file:
+                snapshot = json.load(file)
+            fresh = now - os.path.getmtime(path) < 3 * flush_seconds
+        except (OSError, ValueError):
+            # process is replacing or removing its snapshot right now
+            continue
+
+        snapshots.append((snapshot, fresh))
+
+    return snapshots
+
+
+def _format_labels(labelnames: Sequence[str], labels: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: object) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _flush_and_read(directory: str, snapshot: Dict[str, Dict[str, object]],
+                     flush_seconds: float) -> List[Tuple[dict, bool]]:
+    write_snapshot(directory, snapshot)
+    return _read_snapshots(directory, flush_seconds)
+
+
+async def render(directory: str, flush_seconds: float) -> str:
+    """
+    Flushes metrics of this process and renders metrics of all processes
+    in Prometheus text exposition format (version 0.0.4). Files are written and read in a thread
+
+    Args:
+        directory: metrics directory shared by all processes
+        flush_seconds: flush period, used to tell alive processes from dead ones
+
+    Returns: exposition text
+
+    """
+    snapshots = await asyncio.to_thread(_flush_and_read, directory, collect(), flush_seconds)
+    lines = []
+
+    for metric in REGISTRY:
+        totals: Dict[str, object] = {}
+        for snapshot, fresh in snapshots:
+            if metric.type == 'gauge' and not fresh:
+                continue
+
+            for labels, value in snapshot.get(metric.name, {}).items():
+                if isinstance(value, list):
+                    total = totals.setdefault(labels, [0] * len(value))
+                    for i, bucket_value in enumerate(value):
+                        total[i] += bucket_value
+                else:
+                    totals[labels] = totals.get(labels, 0) + value
+
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+
+        for labels, value in sorted(totals.items()):
+            labels = json.loads(labels)
+
+            if metric.type != 'histogram':
+                lines.append(f'{metric.name}{_format_labels(metric.labelnames, labels)} {_format_value(value)}')
+                continue
+
+            cumulative = 0
+            for bound, count in zip((*metric.buckets, '+Inf'), value[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == '+Inf' else f'le="{_format_value(bound)}"'
+                lines.append(f'{metric.name}_bucket{_format_labels(metric.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{metric.name}_sum{_format_labels(metric.labelnames, labels)} {_format_value(value[-1])}')
+            lines.append(f'{metric.name}_count{_format_labels(metric.labelnames, labels)} {cumulative}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,169 @@
+"""
+Opt-in request profiling (settings.profiling)
+
+A profiled request runs under cProfile. When it finishes, its profile and a breakdown of wall time
+(db, render, serialize, other) are put into a ring buffer, read by /admin/profiles endpoints.
+Only one request is profiled at a time, and cProfile sees the whole thread, so requests which
+run concurrently with the profiled one show up in its profile too.
+ProfilingMiddleware is not installed at all when profiling is disabled
+"""
+import cProfile
+import hmac
+import io
+import itertools
+import marshal
+import pstats
+import random
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Tuple
+
+from src.aggregator.DTOs import RequestProfileFullSchema
+from src.setup import settings
+
+# Functions whose cumulative time makes a span, as (end of file path, function name).
+# Time of span functions called by other functions of the same span is counted once
+SPANS: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    'render': tuple(('service_layer/utils.py', name) for name in ('convert_olympiads_to_view_format',
+                                                                 'jsonify_dates',
+                                                                 'get_nearest_date',
+                                                                 'get_nearest_date_str',
+                                                                 'nearest_stage',
+                                                                 'humanize_stage',
+                                                                 'humanize_classes',
+                                                                 'optimize_subjects')),
+    'serialize': (('fastapi/routing.py', 'serialize_response'),
+                  ('starlette/responses.py', 'render')),
+}
+
+_profiles: Deque[Tuple[RequestProfileFullSchema, bytes]] = deque(maxlen=settings.profiling.buffer_size)
+_ids = itertools.count(1)
+_active = False
+
+
+def get_trigger(headers: List[Tuple[bytes, bytes]]) -> str | None:
+    """
+    Decides whether request is profiled
+
+    Args:
+        headers: raw ASGI request headers
+
+    Returns: 'header' if request has valid X-Profile header, 'sample' if it is sampled, None otherwise
+
+    """
+    if _active:
+        return None
+
+    token = settings.profiling.admin_token
+    if token:
+        for name, value in headers:
+            if name == b'x-profile' and hmac.compare_digest(value, token.encode()):
+                return 'header'
+
+    if settings.profiling.sample_rate and random.random() < settings.profiling.sample_rate:
+        return 'sample'
+
+    return None
+
+
+def start() -> cProfile.Profile:
+    """
+    Starts profiling of the current request
+
+    Returns: enabled profiler
+
+    """
+    global _active
+
+    _active = True
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    return profiler
+
+
+def finish(profiler: cProfile.Profile, trigger: str, method: str, path: str, status: int,
+           started_at: datetime, duration: float, db_queries: int, db_duration: float) -> None:
+    """
+    Stops profiler and keeps profile if it was asked for with header or request was slow
+
+    Args:
+        profiler: profiler returned by start
+        trigger: result of get_trigger
+        method: HTTP method
+        path: request path
+        status: response status code
+        started_at: date and time when request started
+        duration: request wall time, seconds
+        db_queries: number of database queries made by the request
+        db_duration: time spent in database queries, seconds
+
+    Returns: None
+
+    """
+    global _active
+
+    profiler.disable()
+    _active = False
+
+    if trigger == 'sample' and duration * 1000 < settings.profiling.slow_ms:
+        return
+
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    spans = {'db': db_duration, **{name: _span_time(stats, functions) for name, functions in SPANS.items()}}
+    spans['other'] = max(duration - sum(spans.values()), 0.0)
+
+    raw = marshal.dumps(stats.stats)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(settings.profiling.top_functions)
+
+    profile = RequestProfileFullSchema(id=next(_ids),
+                                       started_at=started_at,
+                                       method=method,
+                                       path=path,
+                                       status=status,
+                                       trigger=trigger,
+                                       duration_ms=round(duration * 1000, 3),
+                                       db_queries=db_queries,
+                                       spans={name: round(value * 1000, 3) for name, value in spans.items()},
+                                       profile=report.getvalue())
+    _profiles.append((profile, raw))
+
+
+def _span_time(stats: pstats.Stats, functions: Tuple[Tuple[str, str], ...]) -> float:
+    span_keys = {key for key in stats.stats
+                 if any(key[0].replace('\\', '/').endswith(path) and key[2] == name for path, name in functions)}
+
+    total = 0.0
+    for key in span_keys:
+        _, _, _, cumulative, callers = stats.stats[key]
+        total += cumulative
+        # calls from other span functions are already inside their cumulative time
+        total -= sum(caller_stats[3] for caller, caller_stats in callers.items() if caller in span_keys)
+
+    return total
+
+
+def get_profiles() -> List[RequestProfileFullSchema]:
+    """
+    Returns: kept profiles, newest first
+
+    """
+    return [profile for profile, _ in reversed(_profiles)]
+
+
+def get_profile(profile_id: int) -> Tuple[RequestProfileFullSchema, bytes] | None:
+    """
+    Finds kept profile
+
+    Args:
+        profile_id: profile id
+
+    Returns: profile and its raw pstats data (loadable with pstats, snakeviz or flameprof), None if not kept
+
+    """
+    for profile, raw in _profiles:
+        if profile.id == profile_id:
+            return profile, raw
+
+    return None
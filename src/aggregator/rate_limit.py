@@ -0,0 +1,166 @@
+"""
+Login rate limiting (settings.rate_limit)
+
+Every POST /auth attempt is counted twice: by client IP and by login (username or mail), each key
+has its own sliding window. An attempt over any limit is rejected with 429 before the form reaches
+the database or bcrypt, rejected attempts are not counted under any key.
+
+Windows are sliding window counters: a key keeps only counts of the current and the previous fixed
+window, and the previous count is weighted by the part of it still inside the sliding window.
+Counters live in a RateLimitStore. MemoryRateLimitStore keeps them in the worker process, so with
+several workers every worker has its own limits; a store shared by workers is plugged in with
+settings.rate_limit.store
+"""
+import importlib
+import math
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from src.aggregator import metrics
+from src.setup import settings
+
+# (key, limit, window): counted key, allowed attempts per window, window length in seconds
+RateLimit = Tuple[str, int, float]
+
+
+class RateLimitStore(ABC):
+    """
+    Storage of sliding window counters
+
+    Methods:
+        hit(self, keys): counts attempt under every key if none of them is over its limit
+    """
+
+    @abstractmethod
+    async def hit(self, keys: Sequence[RateLimit]) -> List[float]:
+        """
+        Checks all keys first and counts the attempt under every key only if all of them allow it,
+        so an attempt rejected by one key does not use up limits of the others
+
+        Args:
+            keys: (key, limit, window) of every counted key, e.g. ('ip:127.0.0.1', 30, 60.0):
+                limit is allowed attempts per window, window is its length in seconds
+
+        Returns: for every key 0 if it allows the attempt, otherwise seconds after which it will allow it.
+            Attempt is counted only if all values are 0
+
+        """
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """
+    Store of the worker process. Every key takes three integers: index of its current window,
+    counts of the previous and the current window. Keys whose windows are over are evicted every
+    evict_interval seconds, so a flood of random logins does not grow the store forever
+
+    Methods:
+        hit(self, keys): counts attempt under every key if none of them is over its limit
+        evict(self, now): drops keys which do not affect any window any more
+    """
+
+    def __init__(self, evict_interval: float = 60.0, clock: Callable[[], float] = time.monotonic) -> None:
+        self.evict_interval = evict_interval
+        self._clock = clock
+        # window length: key: [window index, previous count, current count]
+        self._counters: Dict[float, Dict[str, List[int]]] = {}
+        self._evicted_at = clock()
+
+    def __len__(self) -> int:
+        return sum(len(counters) for counters in self._counters.values())
+
+    async def hit(self, keys: Sequence[RateLimit]) -> List[float]:
+        now = self._clock()
+        if now - self._evicted_at >= self.evict_interval:
+            self.evict(now)
+
+        states, retry_afters = [], []
+        for key, limit, window in keys:
+            counters = self._counters.setdefault(window, {})
+            index, offset = divmod(now, window)
+            index = int(index)
+
+            counter = counters.get(key)
+            if counter is None or counter[0] < index - 1:
+                previous, current = 0, 0
+            elif counter[0] == index - 1:
+                previous, current = counter[2], 0
+            else:
+                previous, current = counter[1], counter[2]
+
+            retry_after = 0
+            if previous * (1 - offset / window) + current >= limit:
+                # never 0, 0 means allowed
+                retry_after = max(self.retry_after(limit, window, offset, previous, current), 0.001)
+
+            states.append((counters, key, index, previous, current))
+            retry_afters.append(retry_after)
+
+        allowed = not any(retry_afters)
+        for counters, key, index, previous, current in states:
+            counters[key] = [index, previous, current + allowed]
+
+        return retry_afters
+
+    def evict(self, now: float) -> None:
+        """
+        Args:
+            now: current clock time
+
+        Returns: None
+
+        """
+        for window, counters in self._counters.items():
+            oldest = int(now // window) - 1
+            for key in [key for key, counter in counters.items() if counter[0] < oldest]:
+                del counters[key]
+
+        self._evicted_at = now
+
+    @staticmethod
+    def retry_after(limit: int, window: float, offset: float, previous: int, current: int) -> float:
+        if current >= limit:
+            # current window is full: wait for the next one and for this count to fade out enough
+            return window - offset + window * (1 - limit / current)
+
+        return window * (1 - (limit - current) / previous) - offset
+
+
+@lru_cache
+def get_store() -> RateLimitStore:
+    """
+    Returns: store of settings.rate_limit.store, created on first call
+
+    """
+    module, _, name = settings.rate_limit.store.rpartition('.')
+    store_class = getattr(importlib.import_module(module), name)
+
+    if store_class is MemoryRateLimitStore:
+        return MemoryRateLimitStore(evict_interval=settings.rate_limit.evict_interval)
+    return store_class()
+
+
+async def check_login_attempt(ip: str | None, login: str) -> int:
+    """
+    Counts login attempt by IP and by login
+
+    Args:
+        ip: client address, None if unknown (not counted by IP then)
+        login: username or mail from the login form
+
+    Returns: 0 if attempt is allowed, otherwise seconds after which client may retry
+
+    """
+    limits = settings.rate_limit
+
+    keys = {'login': (f'login:{login.strip().lower()}', limits.login_limit, limits.login_window)}
+    if ip is not None:
+        keys['ip'] = (f'ip:{ip}', limits.ip_limit, limits.ip_window)
+
+    retry_afters = await get_store().hit(list(keys.values()))
+    for name, retry_after in zip(keys, retry_afters):
+        if retry_after:
+            metrics.login_attempts_limited.inc(name)
+
+    return math.ceil(max(retry_afters))
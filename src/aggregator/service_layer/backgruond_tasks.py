@@ -1,19 +1,20 @@
 import asyncio
+import smtplib
 from datetime import datetime, timedelta
 
 from loguru import logger
 
+from src.aggregator import metrics
 from src.aggregator.database import crud
 from src.aggregator.service_layer.parsers.parsers import ParserOlymp
 from src.aggregator.service_layer.utils import send_email, logging_wrapper
-from src.setup import get_session_maker, setup_email_server
+from src.setup import unit_of_work, setup_email_server, settings
 
 
 @logging_wrapper
 async def send_notifications():
     start = 0
     end = 100
-    session_maker = await get_session_maker()
     now = datetime.now()
     date_now = datetime(now.year, now.month, now.day)
 
@@ -21,7 +22,7 @@ async def send_notifications():
 
     logger.info('Sending notifications started')
 
-    async with session_maker() as db_session:
+    async with unit_of_work() as db_session:
         while True:
             notifications = await crud.get_limited_notifications(session=db_session,
                                                                  start=start,
@@ -30,19 +31,28 @@ async def send_notifications():
             if not notifications:
                 break
 
-            for notification in notifications:
-                if notification.date == date_now or notification.date == date_now - timedelta(days=1):
-                    user = await crud.get_user_by_id(session=db_session,
-                                                     user_id=notification.user_id)
+            due = [notification for notification in notifications
+                   if notification.date == date_now or notification.date == date_now - timedelta(days=1)]
+            # receivers of the whole batch are loaded at once, not one query per notification
+            mails = await crud.get_user_mails_by_ids(session=db_session,
+                                                     user_ids=(notification.user_id for notification in due))
 
+            for notification in due:
+                try:
                     await send_email(email_server=smtp_server,
-                                     receiver_email=user.mail,
+                                     receiver_email=mails[notification.user_id],
                                      body=notification.text)
+                except smtplib.SMTPException:
+                    metrics.notifications_sent.inc('failed')
+                    raise
+                metrics.notifications_sent.inc('sent')
 
-                    await crud.delete_notification_by_id(session=db_session,
-                                                         notification_id=notification.id)
+                await crud.delete_notification_by_id(session=db_session,
+                                                     notification_id=notification.id)
+                # email is already sent: commit right away, so a later failure does not send it again
+                await db_session.commit()
 
-                    await asyncio.sleep(0)
+                await asyncio.sleep(0)
 
             start = end
             end += 100
@@ -61,3 +71,8 @@ async def update_olympiads_info():
     logger.info('Started parsing olympiads')
     await olympiad_parser.run_process()
     logger.info('Finished parsing olympiads')
+
+    if settings.catalog.snapshot_path is not None:
+        from src.aggregator.service_layer import catalog_snapshot
+
+        await catalog_snapshot.export_snapshot(settings.catalog.snapshot_path)
@@ -0,0 +1,191 @@
+import asyncio
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date
+from typing import List, Dict, Tuple, FrozenSet, Set
+
+import numpy as np
+from loguru import logger
+from sqlalchemy.ext.asyncio import async_session
+
+from src.aggregator import metrics
+from src.aggregator.DTOs import OlympiadSchema, OlympiadStageSchema
+from src.aggregator.database import crud, invalidation
+from src.aggregator.database.instrumentation import untracked
+from src.aggregator.database.routing import on_primary
+from src.aggregator.service_layer.catalog_snapshot import MappedCatalog, read_snapshot_version
+from src.setup import settings
+
+
+class Catalog:
+    """
+    In-process read model of the whole olympiad catalog, built once per catalog version
+
+    Attributes:
+        version: catalog version the model was built for
+        olympiads: olympiads by id
+        grades: olympiad grades as frozensets by olympiad id
+        stage_ordinals: sorted start dates (as ordinals) of all stages
+        stage_entries: (olympiad_id, stage) pairs in the same order as stage_ordinals
+        stage_starts: datetime64[D] matrix of stage start dates, one row per olympiad
+            (in olympiads order), padded with NaT
+
+    Methods:
+        stages_between(self, start, end): stages starting in [start, end] in date order
+        nearest_stages(self, today): nearest upcoming stage of every olympiad
+    """
+
+    def __init__(self, version: int, olympiads: List[OlympiadSchema]) -> None:
+        self.version = version
+        self.olympiads: Dict[int, OlympiadSchema] = {olympiad.id: olympiad for olympiad in olympiads}
+        self.grades: Dict[int, FrozenSet[int]] = {olympiad.id: frozenset(olympiad.classes) for olympiad in olympiads}
+
+        width = max((len(olympiad.stages) for olympiad in olympiads), default=0)
+        self.stage_starts = np.full((len(olympiads), width), np.datetime64('NaT'), dtype='datetime64[D]')
+        for row, olympiad in enumerate(olympiads):
+            self.stage_starts[row, :len(olympiad.stages)] = [stage.start_date for stage in olympiad.stages]
+
+        self._nearest_day: date | None = None
+        self._nearest: Dict[int, OlympiadStageSchema] = {}
+
+        entries = sorted(
+            ((stage.start_date.toordinal(), olympiad.id, ordinal, stage)
+             for olympiad in olympiads
+             for ordinal, stage in enumerate(olympiad.stages)),
+            key=lambda entry: entry[:3],
+        )
+        self.stage_ordinals: List[int] = [entry[0] for entry in entries]
+        self.stage_entries: List[Tuple[int, OlympiadStageSchema]] = [(entry[1], entry[3]) for entry in entries]
+
+    def stages_between(self, start: date, end: date) -> List[Tuple[int, OlympiadStageSchema]]:
+        """
+        Finds stages starting between two dates with binary search: O(log n + k)
+
+        Args:
+            start: first day (inclusive)
+            end: last day (inclusive)
+
+        Returns: list of (olympiad_id, stage) ordered by start date
+
+        """
+        lo = bisect_left(self.stage_ordinals, start.toordinal())
+        hi = bisect_right(self.stage_ordinals, end.toordinal())
+
+        return self.stage_entries[lo:hi]
+
+    def nearest_stages(self, today: date) -> Dict[int, OlympiadStageSchema]:
+        """
+        Finds the nearest stage starting after today for every olympiad with one
+        masked argmin over the whole stage matrix. Result is computed once per day
+
+        Args:
+            today: current date
+
+        Returns: nearest upcoming stage by olympiad id, olympiads with only past stages are absent
+
+        """
+        if self._nearest_day != today:
+            self._nearest = {}
+
+            if self.stage_starts.size:
+                upcoming = self.stage_starts > np.datetime64(today, 'D')  # NaT compares as False
+                columns = np.where(upcoming, self.stage_starts, np.datetime64('9999-12-31', 'D')).argmin(axis=1)
+                rows = np.flatnonzero(upcoming.any(axis=1))
+
+                olympiads = list(self.olympiads.values())
+                self._nearest = {olympiads[row].id: olympiads[row].stages[columns[row]] for row in rows}
+
+            self._nearest_day = today
+
+        return self._nearest
+
+
+_catalog: Catalog | MappedCatalog | None = None
+_catalog_built_at: float = 0.0
+_catalog_version: int = 0
+_catalog_lock = asyncio.Lock()
+
+
+def invalidate_catalog(olympiad_ids: Set[int] | None = None) -> None:
+    """
+    Bumps catalog version, so catalog will be rebuilt on next get_catalog call.
+    Subscribed to olympiad invalidation events, so writes of other processes are picked up too
+
+    Args:
+        olympiad_ids: changed olympiads, any change rebuilds the whole catalog (or maps new snapshot)
+
+    Returns: None
+
+    """
+    global _catalog_version
+
+    _catalog_version += 1
+
+
+invalidation.subscribe('olympiad', invalidate_catalog)
+invalidation.subscribe('catalog_snapshot', invalidate_catalog)
+
+
+async def get_catalog(db_session: async_session) -> Catalog | MappedCatalog:
+    """
+    Returns catalog read model, rebuilding it if version changed or ttl expired.
+    Catalog is mapped from settings.catalog.snapshot_path if the snapshot is up to date,
+    otherwise it is read from database
+
+    Args:
+        db_session: session for database
+
+    Returns: Catalog or MappedCatalog
+
+    """
+    global _catalog, _catalog_built_at
+
+    if _is_fresh(_catalog):
+        metrics.catalog_lookups.inc('hit')
+        return _catalog
+
+    async with _catalog_lock:
+        if _is_fresh(_catalog):
+            metrics.catalog_lookups.inc('hit')
+            return _catalog
+
+        metrics.catalog_lookups.inc('rebuild')
+
+        version = _catalog_version
+        # rebuild is shared by all requests, it is not counted in query budget of the one which triggered it.
+        # It reads the primary: invalidation events come from the primary, a lagging replica would give
+        # the old catalog, and it would be kept until the next olympiad event or ttl
+        with untracked(), on_primary():
+            _catalog = await _map_snapshot(version, db_session)
+            if _catalog is None:
+                olympiads = await crud.get_all_olympiads(session=db_session)
+                _catalog = Catalog(version, olympiads)
+        _catalog_built_at = time.monotonic()
+
+        logger.info(f'Built catalog version {version}: {len(_catalog.olympiads)} olympiads')
+
+    return _catalog
+
+
+async def _map_snapshot(version: int, db_session: async_session) -> MappedCatalog | None:
+    path = settings.catalog.snapshot_path
+    if path is None:
+        return None
+
+    if read_snapshot_version(path) is None:
+        return None
+
+    catalog = MappedCatalog(version, path)
+    # late commits of versions which were pending when the snapshot was read are changes after it too
+    if await crud.has_cache_versions_after(db_session, 'olympiad', catalog.snapshot_version,
+                                           catalog.pending_versions()):
+        logger.info(f'Catalog snapshot version {catalog.snapshot_version} is outdated, reading catalog from database')
+        return None
+
+    return catalog
+
+
+def _is_fresh(catalog: Catalog | MappedCatalog | None) -> bool:
+    return (catalog is not None
+            and catalog.version == _catalog_version
+            and time.monotonic() - _catalog_built_at < settings.catalog.ttl_seconds)
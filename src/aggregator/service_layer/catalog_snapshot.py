@@ -0,0 +1,448 @@
+"""
+Catalog snapshot shared by all workers (settings.catalog.snapshot_path)
+
+The scheduler serializes the catalog read model into one file after every parser run (and
+catalog_transfer after import or with its snapshot command). Workers map the file read-only and read
+numpy arrays straight from the mapping, so pages of the catalog are shared by all workers through the page
+cache, and a worker maps it at start instead of loading and converting the whole olympiads table.
+
+File layout (little endian):
+    header      magic, format, cache version the snapshot was built at (database/invalidation.py),
+                size of the array table
+    array table JSON {name: [offset, dtype, shape]}
+    arrays      each aligned to ALIGNMENT bytes, strings are (offset, length) spans into 'strings' blob,
+                length -1 is None. Lists (stages, subjects, classes) are CSR: '<list>_start' array of n + 1
+                positions into the flat array. 'pending_versions' are versions below the cache version which
+                had no events yet when the snapshot was read (PostgreSQL, see invalidation.py)
+
+A new snapshot is written into a temporary file and renamed over the old one, so a worker maps either
+the old or the new file, never a partial one, and mappings of the old file stay valid until dropped.
+A worker uses the snapshot only if no olympiad changed after its cache version or in one of its pending
+versions, committed out of version order. Otherwise the worker reads the catalog from database as before
+(see catalog.get_catalog)
+"""
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+from datetime import date
+from typing import Dict, Iterator, List, Tuple, FrozenSet
+
+import numpy as np
+from loguru import logger
+
+from src.aggregator.DTOs import OlympiadSchema, OlympiadStageSchema
+from src.aggregator.database import crud
+
+MAGIC = b'OLYMPCAT'
+FORMAT = 3
+HEADER = struct.Struct('<8sIIQQ')  # magic, format, reserved, cache version, array table size
+ALIGNMENT = 64
+
+# dates are stored as int32 days since 1970-01-01, NO_DATE is None
+EPOCH = date(1970, 1, 1).toordinal()
+NO_DATE = np.iinfo(np.int32).min
+
+
+def to_days(value: date | None) -> int:
+    return NO_DATE if value is None else value.toordinal() - EPOCH
+
+
+def from_days(value: int) -> date | None:
+    return None if value == NO_DATE else date.fromordinal(EPOCH + int(value))
+
+
+class StringsBuilder:
+    """
+    Collects strings into one UTF-8 blob
+
+    Methods:
+        add(self, value): appends string, returns its (offset, length) span
+    """
+
+    def __init__(self) -> None:
+        self.blob = bytearray()
+
+    def add(self, value: str | None) -> Tuple[int, int]:
+        if value is None:
+            return 0, -1
+
+        encoded = value.encode('utf-8')
+        self.blob += encoded
+        return len(self.blob) - len(encoded), len(encoded)
+
+
+def build_arrays(olympiads: List[OlympiadSchema]) -> Dict[str, np.ndarray]:
+    """
+    Converts olympiads into snapshot arrays
+
+    Args:
+        olympiads: whole catalog
+
+    Returns: arrays by name
+
+    """
+    olympiads = sorted(olympiads, key=lambda olympiad: olympiad.id)
+    strings = StringsBuilder()
+    subject_numbers: Dict[str, int] = {}
+
+    titles, descriptions, levels = [], [], []
+    stage_starts, stage_ends, stage_names, stage_rows = [], [], [], []
+    subjects, classes = [], []
+    stage_start, subject_start, class_start = [0], [0], [0]
+
+    for row, olympiad in enumerate(olympiads):
+        titles.append(strings.add(olympiad.title))
+        descriptions.append(strings.add(olympiad.description))
+        levels.append(-1 if olympiad.level is None else olympiad.level)
+
+        for stage in olympiad.stages:
+            stage_starts.append(to_days(stage.start_date))
+            stage_ends.append(to_days(stage.end_date))
+            stage_names.append(strings.add(stage.name))
+            stage_rows.append(row)
+        subjects += [subject_numbers.setdefault(subject, len(subject_numbers)) for subject in olympiad.subjects]
+        classes += olympiad.classes
+
+        stage_start.append(len(stage_starts))
+        subject_start.append(len(subjects))
+        class_start.append(len(classes))
+
+    ids = np.array([olympiad.id for olympiad in olympiads], dtype=np.int64)
+    row_by_id = np.full(int(ids.max()) + 1 if len(ids) else 0, -1, dtype=np.int32)
+    row_by_id[ids] = np.arange(len(ids), dtype=np.int32)
+
+    stage_starts = np.array(stage_starts, dtype=np.int32)
+    stage_rows = np.array(stage_rows, dtype=np.int32)
+    ordinals = np.arange(len(stage_rows), dtype=np.int32) - np.array(stage_start[:-1], dtype=np.int32)[stage_rows]
+    # stages by start date, then olympiad id, then ordinal (rows are in id order)
+    stage_order = np.lexsort((ordinals, stage_rows, stage_starts)).astype(np.int32)
+
+    subject_names = [strings.add(subject) for subject in subject_numbers]
+
+    return {
+        'ids': ids,
+        'row_by_id': row_by_id,
+        'titles': np.array(titles, dtype=np.int64).reshape(-1, 2),
+        'descriptions': np.array(descriptions, dtype=np.int64).reshape(-1, 2),
+        'levels': np.array(levels, dtype=np.int16),
+        'stage_start': np.array(stage_start, dtype=np.int32),
+        'stage_starts': stage_starts,
+        'stage_ends': np.array(stage_ends, dtype=np.int32),
+        'stage_names': np.array(stage_names, dtype=np.int64).reshape(-1, 2),
+        'stage_rows': stage_rows,
+        'stage_order': stage_order,
+        'sorted_stage_starts': stage_starts[stage_order],
+        'subject_start': np.array(subject_start, dtype=np.int32),
+        'subjects': np.array(subjects, dtype=np.int16),
+        'subject_names': np.array(subject_names, dtype=np.int64).reshape(-1, 2),
+        'class_start': np.array(class_start, dtype=np.int32),
+        'classes': np.array(classes, dtype=np.int16),
+        'strings': np.frombuffer(bytes(strings.blob), dtype=np.uint8),
+    }
+
+
+def write_snapshot(path: str, version: int, olympiads: List[OlympiadSchema],
+                   pending_versions: List[int] | None = None) -> int:
+    """
+    Writes snapshot and atomically replaces the previous one
+
+    Args:
+        path: snapshot file
+        version: cache version olympiads were read at
+        olympiads: whole catalog
+        pending_versions: versions below version without events when olympiads were read
+
+    Returns: size of the file, bytes
+
+    """
+    arrays = build_arrays(olympiads)
+    arrays['pending_versions'] = np.array(pending_versions or [], dtype=np.int64)
+
+    table, offset = {}, 0
+    for name, array in arrays.items():
+        table[name] = [offset, array.dtype.str, list(array.shape)]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    table_bytes = json.dumps(table).encode()
+    data_start = -(-(HEADER.size + len(table_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, FORMAT, 0, version, len(table_bytes)) + table_bytes)
+        for name, array in arrays.items():
+            file.seek(data_start + table[name][0])
+            file.write(array.tobytes())
+        file.truncate(data_start + offset)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+    logger.info(f'Wrote catalog snapshot version {version}: {len(olympiads)} olympiads, {data_start + offset} bytes')
+    return data_start + offset
+
+
+async def export_snapshot(path: str) -> int:
+    """
+    Writes snapshot of the current catalog of database
+
+    Args:
+        path: snapshot file
+
+    Returns: number of olympiads in the snapshot
+
+    """
+    from src.setup import get_session_maker, unit_of_work
+
+    session_maker = await get_session_maker()
+    async with session_maker() as session:
+        # versions are read first: olympiads changed in between only make the snapshot look outdated
+        version = await crud.get_cache_version(session)
+        pending_versions = await crud.get_pending_cache_versions(session, version)
+        olympiads = await crud.get_all_olympiads(session=session)
+
+    write_snapshot(path, version, olympiads, pending_versions)
+
+    # workers which fell back to database while the snapshot was written map the new one
+    async with unit_of_work() as session:
+        await crud.publish_cache_versions(session, 'catalog_snapshot', [0])
+
+    return len(olympiads)
+
+
+def read_snapshot_version(path: str) -> int | None:
+    """
+    Reads cache version of snapshot from its header
+
+    Args:
+        path: snapshot file
+
+    Returns: cache version, None if there is no valid snapshot
+
+    """
+    try:
+        with open(path, 'rb') as file:
+            header = file.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+
+    if len(header) < HEADER.size:
+        return None
+    magic, file_format, _, version, _ = HEADER.unpack(header)
+    if magic != MAGIC or file_format != FORMAT:
+        logger.warning(f'{path} is not a catalog snapshot of format {FORMAT}')
+        return None
+
+    return version
+
+
+class MappedCatalog:
+    """
+    Catalog read model over a memory-mapped snapshot, same interface as catalog.Catalog.
+    Olympiads and stages are converted into DTOs only when they are accessed
+
+    Attributes:
+        version: catalog version the model was loaded for
+        snapshot_version: cache version of the snapshot
+        olympiads: olympiads by id (read-only mapping)
+        grades: olympiad grades as frozensets by olympiad id (read-only mapping)
+
+    Methods:
+        pending_versions(self): versions below snapshot_version without events when the snapshot was read
+        stages_between(self, start, end): stages starting in [start, end] in date order
+        nearest_stages(self, today): nearest upcoming stage of every olympiad
+    """
+
+    def __init__(self, version: int, path: str) -> None:
+        with open(path, 'rb') as file:
+            self._mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, file_format, _, self.snapshot_version, table_size = HEADER.unpack_from(self._mapping)
+        if magic != MAGIC or file_format != FORMAT:
+            raise ValueError(f'{path} is not a catalog snapshot of format {FORMAT}')
+
+        table = json.loads(self._mapping[HEADER.size:HEADER.size + table_size])
+        data_start = -(-(HEADER.size + table_size) // ALIGNMENT) * ALIGNMENT
+        # views of the mapping, nothing is copied
+        self._arrays: Dict[str, np.ndarray] = {
+            name: np.frombuffer(self._mapping, dtype=dtype, count=int(np.prod(shape)),
+                                offset=data_start + offset).reshape(shape)
+            for name, (offset, dtype, shape) in table.items()
+        }
+
+        self.version = version
+        self.olympiads = OlympiadsView(self)
+        self.grades = GradesView(self)
+        self._nearest_day: date | None = None
+        self._nearest: NearestStagesView | None = None
+
+    def pending_versions(self) -> List[int]:
+        """
+        Returns: versions which had no events when export_snapshot read the olympiads
+
+        """
+        return self._arrays['pending_versions'].tolist()
+
+    def row(self, olympiad_id: int) -> int:
+        """
+        Args:
+            olympiad_id: olympiad id
+
+        Returns: row of the olympiad in arrays, -1 if there is no such olympiad
+
+        """
+        row_by_id = self._arrays['row_by_id']
+        if not 0 <= olympiad_id < len(row_by_id):
+            return -1
+
+        return int(row_by_id[olympiad_id])
+
+    def string(self, span: np.ndarray) -> str | None:
+        offset, length = int(span[0]), int(span[1])
+        if length < 0:
+            return None
+
+        return self._arrays['strings'][offset:offset + length].tobytes().decode('utf-8')
+
+    def stage(self, index: int) -> OlympiadStageSchema:
+        arrays = self._arrays
+        return OlympiadStageSchema.model_construct(name=self.string(arrays['stage_names'][index]),
+                                                   start_date=from_days(arrays['stage_starts'][index]),
+                                                   end_date=from_days(arrays['stage_ends'][index]))
+
+    def olympiad(self, row: int) -> OlympiadSchema:
+        arrays = self._arrays
+        level = int(arrays['levels'][row])
+        subject_names = arrays['subject_names']
+        stage_start, subject_start, class_start = (arrays['stage_start'], arrays['subject_start'],
+                                                   arrays['class_start'])
+
+        return OlympiadSchema.model_construct(
+            id=int(arrays['ids'][row]),
+            title=self.string(arrays['titles'][row]),
+            level=None if level < 0 else level,
+            stages=[self.stage(index) for index in range(stage_start[row], stage_start[row + 1])],
+            description=self.string(arrays['descriptions'][row]),
+            subjects=[self.string(subject_names[subject])
+                      for subject in arrays['subjects'][subject_start[row]:subject_start[row + 1]]],
+            classes=arrays['classes'][class_start[row]:class_start[row + 1]].tolist(),
+        )
+
+    def stages_between(self, start: date, end: date) -> List[Tuple[int, OlympiadStageSchema]]:
+        """
+        Finds stages starting between two dates with binary search: O(log n + k)
+
+        Args:
+            start: first day (inclusive)
+            end: last day (inclusive)
+
+        Returns: list of (olympiad_id, stage) ordered by start date
+
+        """
+        arrays = self._arrays
+        lo = np.searchsorted(arrays['sorted_stage_starts'], to_days(start), side='left')
+        hi = np.searchsorted(arrays['sorted_stage_starts'], to_days(end), side='right')
+
+        return [(int(arrays['ids'][arrays['stage_rows'][index]]), self.stage(index))
+                for index in arrays['stage_order'][lo:hi]]
+
+    def nearest_stages(self, today: date) -> Mapping:
+        """
+        Finds the nearest stage starting after today for every olympiad with one sort of upcoming stages.
+        Result is computed once per day
+
+        Args:
+            today: current date
+
+        Returns: nearest upcoming stage by olympiad id, olympiads with only past stages are absent
+
+        """
+        if self._nearest_day != today:
+            arrays = self._arrays
+            upcoming = np.flatnonzero(arrays['stage_starts'] > to_days(today))
+            # by row, then start date; stable, so equal dates keep ordinal order
+            upcoming = upcoming[np.lexsort((arrays['stage_starts'][upcoming], arrays['stage_rows'][upcoming]))]
+            rows = arrays['stage_rows'][upcoming]
+            first = np.flatnonzero(np.diff(rows, prepend=-1))
+
+            nearest = np.full(len(arrays['ids']), -1, dtype=np.int32)
+            nearest[rows[first]] = upcoming[first]
+
+            self._nearest = NearestStagesView(self, nearest)
+            self._nearest_day = today
+
+        return self._nearest
+
+
+class OlympiadsView(Mapping):
+    """
+    Olympiads of a mapped snapshot by id, every lookup builds a new OlympiadSchema
+    """
+
+    def __init__(self, catalog: MappedCatalog) -> None:
+        self._catalog = catalog
+
+    def __getitem__(self, olympiad_id: int) -> OlympiadSchema:
+        row = self._catalog.row(olympiad_id)
+        if row < 0:
+            raise KeyError(olympiad_id)
+
+        return self._catalog.olympiad(row)
+
+    def __contains__(self, olympiad_id) -> bool:
+        return self._catalog.row(olympiad_id) >= 0
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._catalog._arrays['ids'].tolist())
+
+    def __len__(self) -> int:
+        return len(self._catalog._arrays['ids'])
+
+
+class GradesView(OlympiadsView):
+    """
+    Grades of olympiads of a mapped snapshot by id
+    """
+
+    def __getitem__(self, olympiad_id: int) -> FrozenSet[int]:
+        row = self._catalog.row(olympiad_id)
+        if row < 0:
+            raise KeyError(olympiad_id)
+
+        class_start = self._catalog._arrays['class_start']
+        return frozenset(self._catalog._arrays['classes'][class_start[row]:class_start[row + 1]].tolist())
+
+
+class NearestStagesView(OlympiadsView):
+    """
+    Nearest upcoming stage by olympiad id for one day, stages are built on first lookup
+    """
+
+    def __init__(self, catalog: MappedCatalog, nearest: np.ndarray) -> None:
+        super().__init__(catalog)
+        self._nearest = nearest
+        self._stages: Dict[int, OlympiadStageSchema] = {}
+
+    def _index(self, olympiad_id: int) -> int:
+        row = self._catalog.row(olympiad_id)
+        return -1 if row < 0 else int(self._nearest[row])
+
+    def __getitem__(self, olympiad_id: int) -> OlympiadStageSchema:
+        stage = self._stages.get(olympiad_id)
+        if stage is None:
+            index = self._index(olympiad_id)
+            if index < 0:
+                raise KeyError(olympiad_id)
+            stage = self._stages[olympiad_id] = self._catalog.stage(index)
+
+        return stage
+
+    def __contains__(self, olympiad_id) -> bool:
+        return olympiad_id in self._stages or self._index(olympiad_id) >= 0
+
+    def __iter__(self) -> Iterator[int]:
+        ids = self._catalog._arrays['ids']
+        return iter(ids[self._nearest >= 0].tolist())
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._nearest >= 0))
@@ -0,0 +1,164 @@
+"""
+Catalog import/export command line:
+    python -m src.aggregator.service_layer.catalog_transfer export catalog.ndjson.gz
+    python -m src.aggregator.service_layer.catalog_transfer import catalog.ndjson.gz [--batch-size 1000]
+    python -m src.aggregator.service_layer.catalog_transfer snapshot catalog.snapshot
+
+Catalog is stored as NDJSON: one olympiad per line, gzip compressed if file name ends with .gz.
+Both directions are streamed row by row, so memory does not depend on catalog size.
+Import upserts olympiads by site_data in batches (one transaction for the whole file),
+olympiad ids are not exported: user lists of the target database are kept as they are.
+Snapshot writes the catalog snapshot mapped by workers (see catalog_snapshot.py), import refreshes
+the snapshot of settings.catalog.snapshot_path itself
+"""
+import argparse
+import asyncio
+import gzip
+import json
+from datetime import date
+from typing import Dict, IO, List
+
+from loguru import logger
+
+from src.aggregator.database import crud
+from src.setup import get_session_maker, dispose_session_maker, unit_of_work, settings
+
+
+def open_catalog_file(path: str, mode: str) -> IO[str]:
+    """
+    Opens NDJSON catalog file, gzip compressed if path ends with .gz
+
+    Args:
+        path: file path
+        mode: 'r' or 'w'
+
+    Returns: text file object
+
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+
+    return open(path, mode, encoding='utf-8')
+
+
+def olympiad_to_line(olympiad: Dict) -> str:
+    """
+    Serializes olympiad dict (crud.stream_olympiads format) into NDJSON line
+
+    Args:
+        olympiad: olympiad dict
+
+    Returns: JSON line with trailing newline
+
+    """
+    return json.dumps(olympiad, ensure_ascii=False, default=date.isoformat) + '\n'
+
+
+def line_to_olympiad(line: str) -> Dict:
+    """
+    Parses NDJSON line into olympiad dict (crud.upsert_olympiads format)
+
+    Args:
+        line: JSON line
+
+    Returns: olympiad dict
+
+    """
+    olympiad = json.loads(line)
+    olympiad['stages'] = [
+        {'name': stage['name'],
+         'start_date': date.fromisoformat(stage['start_date']),
+         'end_date': date.fromisoformat(stage['end_date']) if stage.get('end_date') else None}
+        for stage in olympiad.get('stages', [])
+    ]
+
+    return olympiad
+
+
+async def export_catalog(path: str, batch_size: int = 1000) -> int:
+    """
+    Writes all olympiads with their stages into NDJSON file
+
+    Args:
+        path: target file, compressed if it ends with .gz
+        batch_size: number of rows fetched from database at once
+
+    Returns: number of exported olympiads
+
+    """
+    session_maker = await get_session_maker()
+    exported = 0
+
+    async with session_maker() as session:
+        with open_catalog_file(path, 'w') as file:
+            async for olympiad in crud.stream_olympiads(session, batch_size=batch_size):
+                file.write(olympiad_to_line(olympiad))
+                exported += 1
+
+    logger.info(f'Exported {exported} olympiads to {path}')
+    return exported
+
+
+async def import_catalog(path: str, batch_size: int = 1000) -> int:
+    """
+    Upserts olympiads from NDJSON file by site_data, batch_size olympiads per statement
+
+    Args:
+        path: source file, compressed if it ends with .gz
+        batch_size: number of olympiads upserted at once
+
+    Returns: number of imported olympiads
+
+    """
+    imported = 0
+    batch: List[Dict] = []
+
+    async with unit_of_work() as session:
+        with open_catalog_file(path, 'r') as file:
+            for line in file:
+                if line.strip():
+                    batch.append(line_to_olympiad(line))
+
+                if len(batch) >= batch_size:
+                    imported += await crud.upsert_olympiads(session, batch)
+                    batch.clear()
+
+        imported += await crud.upsert_olympiads(session, batch)
+
+    logger.info(f'Imported {imported} olympiads from {path}')
+    return imported
+
+
+async def run(command: str, path: str, batch_size: int) -> int:
+    from src.aggregator.service_layer import catalog_snapshot
+
+    try:
+        if command == 'export':
+            return await export_catalog(path, batch_size)
+        if command == 'snapshot':
+            return await catalog_snapshot.export_snapshot(path)
+
+        imported = await import_catalog(path, batch_size)
+        if settings.catalog.snapshot_path is not None:
+            await catalog_snapshot.export_snapshot(settings.catalog.snapshot_path)
+        return imported
+    finally:
+        await dispose_session_maker()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m src.aggregator.service_layer.catalog_transfer')
+    parser.add_argument('command', choices=['export', 'import', 'snapshot'])
+    parser.add_argument('path', help='NDJSON file, gzip compressed if name ends with .gz, or snapshot file')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    count = asyncio.run(run(args.command, args.path, args.batch_size))
+    if args.command == 'snapshot':
+        print(f'Wrote snapshot of {count} olympiads')
+    else:
+        print(f'{args.command.capitalize()}ed {count} olympiads')
+
+
+if __name__ == '__main__':
+    main()
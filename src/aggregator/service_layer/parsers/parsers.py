@@ -1,5 +1,4 @@
 import asyncio
-import json
 import re
 from datetime import datetime
 
@@ -7,14 +6,17 @@ import aiofile
 import aiohttp
 from bs4 import BeautifulSoup
 
+from src.aggregator import metrics
 from src.aggregator.database import crud
-from src.setup import get_session_maker
+from src.aggregator.service_layer.catalog_transfer import olympiad_to_line
+from src.setup import unit_of_work
 
 
 class ParserOlymp:
     # URL страницы олимпиады без id
     _main_url = 'https://olimpiada.ru/activity/'
-    _file_path = 'olympiads.json'
+    # NDJSON dump of parsed olympiads, can be loaded with catalog_transfer import
+    _file_path = 'olympiads.ndjson'
     _ids_path = 'src/aggregator/service_layer/parsers/ids.txt'
     _include = {'История', 'Физика', 'Литература', 'Языковедение', 'Обществознание', 'Биология', 'Информатика',
                 'Математика', 'Химия', 'Английский язык', 'Русский язык'}
@@ -52,6 +54,7 @@ class ParserOlymp:
     async def fetch_and_process(self, session, url, _id, semaphore, delay=0):
         async with semaphore:
             html = await self.fetch_with_retries(session, url)
+            metrics.crawler_pages.inc('ok' if html else 'failed')
             if html:
                 olymp_data = await self.get_info_from_html(html, _id)
                 return _id, olymp_data
@@ -131,13 +134,13 @@ class ParserOlymp:
                         start_date = datetime(day=day1, month=mouth1, year=year1)
                         end_date = datetime(day=day2, month=mouth2, year=year2)
 
-                        date_list = [d.strftime("%b %d") for d in (start_date, end_date)]
+                        date_list = [start_date.date(), end_date.date()]
 
                     else:
                         mouth1 = self._date_ru[dt[-1]]
                         year1 = 2024 if mouth1 <= datetime.now().month else 2023
 
-                        date_list = [datetime(day=day1, month=mouth1, year=year1).strftime("%b %d")]
+                        date_list = [datetime(day=day1, month=mouth1, year=year1).date()]
 
                     stages[stage] = date_list
 
@@ -184,7 +187,6 @@ class ParserOlymp:
         await self.clear_json()
 
         tasks = []
-        db_sessionmaker = await get_session_maker()
         semaphore = asyncio.Semaphore(100000)
 
         async with aiohttp.ClientSession() as session:
@@ -195,32 +197,43 @@ class ParserOlymp:
 
             results = await asyncio.gather(*tasks)
 
-            async with db_sessionmaker() as db_session:
-                for _id, olymp_data in results:
-                    if olymp_data and olymp_data['timetable'] != 'В этом году олимпиада не проводится':
-                        if olymp_data['timetable'] != 'Расписание олимпиады в этом году пока не известно':
-                            await crud.add_olympiad(session=db_session,
-                                                    title=olymp_data['title'],
-                                                    classes=olymp_data['grades'],
-                                                    description=olymp_data['description'],
-                                                    subjects=olymp_data['classes'],
-                                                    dates=olymp_data['timetable'],
-                                                    site_data=olymp_data['site_data'])
-                        # await self.write_json(olymp_data, _id)
+        olympiads = []
+        for _id, olymp_data in results:
+            if olymp_data and olymp_data['timetable'] != 'В этом году олимпиада не проводится':
+                olympiad = self.to_olympiad(olymp_data, _id)
+                await self.write_json(olympiad)
+                if olymp_data['timetable'] != 'Расписание олимпиады в этом году пока не известно':
+                    olympiads.append(olympiad)
 
-    async def write_json(self, olymp_data, _id) -> None:
-        with open(self._file_path, 'r', encoding='utf-8') as f:
-            olympiads = json.load(f)
-
-        olympiads[_id] = olymp_data
-
-        with open(self._file_path, 'w', encoding='utf-8') as f:
-            json.dump(olympiads, f, ensure_ascii=False, indent=4)
+        # all parsed olympiads are upserted by site_data and committed at once
+        async with unit_of_work() as db_session:
+            await crud.upsert_olympiads(db_session, olympiads)
 
     @staticmethod
-    async def clear_json() -> None:
-        with open('olympiads.json', 'w', encoding='utf-8') as f:
-            json.dump({}, f)
+    def to_olympiad(olymp_data, _id) -> dict:
+        # crud.upsert_olympiads / catalog_transfer format, timetable without dates has no stages
+        timetable = olymp_data['timetable'] if isinstance(olymp_data['timetable'], dict) else {}
+        return {
+            'title': olymp_data['title'],
+            'level': None,
+            'description': olymp_data['description'],
+            'subjects': olymp_data['classes'],
+            'classes': olymp_data['grades'],
+            'site_data': _id,
+            'stages': [{'name': name,
+                        'start_date': stage_dates[0],
+                        'end_date': stage_dates[1] if len(stage_dates) > 1 else None}
+                       for name, stage_dates in timetable.items()],
+        }
+
+    async def write_json(self, olympiad) -> None:
+        # One appended line per olympiad instead of rewriting the whole file
+        async with aiofile.async_open(self._file_path, 'a', encoding='utf-8') as f:
+            await f.write(olympiad_to_line(olympiad))
+
+    async def clear_json(self) -> None:
+        async with aiofile.async_open(self._file_path, 'w', encoding='utf-8') as f:
+            await f.write('')
 
 
 async def main():
@@ -1,19 +1,24 @@
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, date
 from typing import List, Optional, Tuple
 
+import numpy as np
 from fastapi import Request
 from loguru import logger
 from sqlalchemy.ext.asyncio import async_session
 
 from src.aggregator.DTOs import UserSchemaAdd, UserSchemaAuth, UserSchema, OlympiadSchemaCard, \
-    OlympiadSchemaView
+    OlympiadSchemaView, CalendarDaySchema, CalendarEventSchema
 from src.aggregator.database import crud
+from src.aggregator.database.routing import read_only
 from src.aggregator.service_layer import utils
+from src.aggregator.service_layer.catalog import get_catalog
+from src.aggregator.service_layer.user_cache import user_cache
 from src.aggregator.service_layer.utils import logging_wrapper
-from src.setup import pwd_context, settings
+from src.setup import get_password_context, settings
 
 
 @logging_wrapper
+@read_only
 async def get_olympiad(
         olympiad_id: int,
         auth: UserSchema | bool,
@@ -50,12 +55,9 @@ async def get_olympiad(
         return None
 
     if auth is not False:
-        if olympiad.id in auth.participates:
-            is_participant = True
-        if olympiad.id in auth.favorites:
-            is_favorite = True
-        if olympiad.id in auth.notifications:
-            is_notified = True
+        is_participant = olympiad.id in auth.participate_ids
+        is_favorite = olympiad.id in auth.favorite_ids
+        is_notified = olympiad.id in auth.notification_ids
 
     return OlympiadSchemaView(
         id=olympiad.id,
@@ -73,6 +75,7 @@ async def get_olympiad(
 
 
 @logging_wrapper
+@read_only
 async def get_olympiads(
         auth: UserSchema | bool,
         db_session: async_session,
@@ -90,7 +93,8 @@ async def get_olympiads(
     olympiads = await crud.get_all_olympiads(session=db_session)
 
     card_olympiads = await utils.convert_olympiads_to_view_format(olympiads=olympiads,
-                                                                  auth=auth)
+                                                                  auth=auth,
+                                                                  catalog=await get_catalog(db_session))
 
     logger.info('Got olympiad cards')
     return card_olympiads
@@ -135,7 +139,7 @@ async def add_new_user(
     Returns:
         UserSchema | None: The added user's information as a UserSchema object, or None if the user could not be added.
     """
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = get_password_context().hash(user.password)
     user = await crud.add_user(session=db_session,
                                username=user.username,
                                mail=user.mail,
@@ -164,7 +168,7 @@ async def auth_user(
 
     This function attempts to authenticate the user based on the provided login credentials.
     It first checks if the user exists in the database by looking for a matching email or username.
-    If a user is found, the function verifies the provided password using the `pwd_context.verify` method.
+    If a user is found, the function verifies the provided password using the `get_password_context().verify` method.
 
     If the password is correct, the function generates an access token with an expiration
     time based on the configured `access_token_expire_minutes` setting. The access token is created using the
@@ -177,15 +181,12 @@ async def auth_user(
     The function also logs messages indicating whether the authentication was successful or failed.
     """
     logger.info('Try user auth')
-    user = await crud.get_user_by_email(session=db_session,
-                                        mail=user_login.login)
-    if user is None:
-        user = await crud.get_user_by_username(session=db_session,
-                                               username=user_login.login)
+    user = await crud.get_user_by_login(session=db_session,
+                                        login=user_login.login)
     if user is None:
         return None, None
 
-    if pwd_context.verify(user_login.password, user.hashed_password):
+    if get_password_context().verify(user_login.password, user.hashed_password):
         access_token_expires = timedelta(minutes=settings.encryption.access_token_expire_minutes)
         access_token = await utils.create_access_token(
             data={"sub": user.username}, expires_delta=access_token_expires
@@ -223,13 +224,21 @@ async def is_authenticated(
     access_token = access_token.replace('Bearer ', '')
 
     username = await utils.decode_access_token(access_token)
+    cached = user_cache.get(username)
+    if cached is not None:
+        return cached
+
+    generation = user_cache.generation
     user = await crud.get_user_by_username(session=db_session, username=username)
 
     if user is None:
         logger.info('Auth check failed')
         return False
 
-    return user.to_dto_model()
+    user = user.to_dto_model()
+    user_cache.put(user, generation)
+
+    return user
 
 
 @logging_wrapper
@@ -333,9 +342,9 @@ async def delete_user_participate(
         UserSchema | None: The updated user object with the olympiad removed from the participated list,
         or None if the operation fails.
     """
-    user = await crud.delete_user_favorite(session=db_session,
-                                           user_id=user_id,
-                                           olympiad_id=olympiad_id)
+    user = await crud.delete_user_participate(session=db_session,
+                                              user_id=user_id,
+                                              olympiad_id=olympiad_id)
 
     logger.info('Deleted user participation')
     if user is None:
@@ -377,29 +386,29 @@ async def add_notifications(
     if user is None or olympiad is None:
         return False
 
-    now: datetime = datetime.now()
-    date_now = datetime(now.year, now.month, now.day)
+    date_now = datetime.combine(date.today(), datetime.min.time())
     delta = timedelta(days=user.n)
 
-    for stage, olympiad_str_list in olympiad.dates.values():
-        olympiad_str_date = olympiad_str_list[0]
-        olympiad_date = datetime.strptime(olympiad_str_date, '%Y-%m-%d')
+    stages = await crud.get_upcoming_stages(session=db_session,
+                                            start=date_now.date(),
+                                            olympiad_id=olympiad_id)
+
+    notifications = []
+    for stage in stages:
+        olympiad_date = datetime.combine(stage.start_date, datetime.min.time())
         text = (f'Напоминание об олимпиаде: {olympiad.title}\''
-                f'Этап {stage} начинается {olympiad_str_date}')
+                f'Этап {stage.name} начинается {stage.start_date.isoformat()}')
 
-        if date_now <= olympiad_date <= date_now + delta:
-            await crud.add_notification(session=db_session,
-                                        user_id=user_id,
-                                        olympiad_id=olympiad_id,
-                                        text=text,
-                                        date=date_now)
+        if olympiad_date <= date_now + delta:
+            notifications.append({'text': text, 'date': date_now})
 
-        elif date_now + delta <= olympiad_date:
-            await crud.add_notification(session=db_session,
-                                        user_id=user_id,
-                                        olympiad_id=olympiad_id,
-                                        text=text,
-                                        date=olympiad_date - delta)
+        else:
+            notifications.append({'text': text, 'date': olympiad_date - delta})
+
+    await crud.add_notifications(session=db_session,
+                                 user_id=user_id,
+                                 olympiad_id=olympiad_id,
+                                 notifications=notifications)
 
     logger.info('Schedule success')
     return user.to_dto_model()
@@ -413,7 +422,8 @@ async def delete_notifications(
         db_session: async_session,
 ) -> UserSchema | bool:
     """
-    Deletes all notifications related to a specific olympiad for a user.
+    Deletes all notifications related to a specific olympiad for a user
+    and removes the olympiad from user's notifications list.
 
     Args:
         user_id (int): The ID of the user.
@@ -424,6 +434,10 @@ async def delete_notifications(
         UserSchema | bool: True if the notifications were successfully deleted, False otherwise.
 
     """
+    await crud.delete_user_notification(session=db_session,
+                                        user_id=user_id,
+                                        olympiad_id=olympiad_id)
+
     result = await crud.delete_notifications_by_user_and_olympiad_id(session=db_session,
                                                                      user_id=user_id,
                                                                      olympiad_id=olympiad_id)
@@ -434,6 +448,7 @@ async def delete_notifications(
 
 
 @logging_wrapper
+@read_only
 async def search_olympiads(
         search_string: str,
         auth: UserSchema | bool,
@@ -460,7 +475,8 @@ async def search_olympiads(
                                               search_string=search_string)
 
     card_olympiads = await utils.convert_olympiads_to_view_format(olympiads=results,
-                                                                  auth=auth)
+                                                                  auth=auth,
+                                                                  catalog=await get_catalog(db_session))
 
     return card_olympiads
 
@@ -476,8 +492,10 @@ async def get_user_choices(
     Retrieve a list of Olympiads based on the user's choices.
 
     This function retrieves a list of Olympiads based on the user's choices specified by the provided key.
-    It fetches the user's information from the database, retrieves the Olympiad IDs associated with the given key,
+    It takes the user's information from auth (or from the database if another user is requested),
+    retrieves the Olympiad IDs associated with the given key with a single query
     and converts the corresponding Olympiads to the OlympiadSchemaCard.
+    Ids of deleted olympiads are skipped.
 
     Args:
         user_id (int): The ID of the user.
@@ -489,19 +507,26 @@ async def get_user_choices(
         List[OlympiadSchemaCard]: A list of OlympiadSchemaCard objects representing the user's chosen Olympiads.
     """
     logger.info(f'Getting choices: {key}')
-    user = await crud.get_user_by_id(session=db_session, user_id=user_id)
+    if auth is not False and auth.id == user_id:
+        user = auth
+    else:
+        user = await crud.get_user_by_id(session=db_session, user_id=user_id)
 
-    olympiads = []
-    for olympiad_id in getattr(user, key):
-        olympiad = await crud.get_olympiad_by_id(session=db_session, olympiad_id=olympiad_id)
-        olympiads.append(olympiad)
+    if user is None:
+        return []
 
-    card_olympiads = await utils.convert_olympiads_to_view_format(olympiads=olympiads, auth=auth)
+    olympiads = await crud.get_olympiads_by_ids(session=db_session,
+                                                olympiad_ids=getattr(user, key))
+
+    card_olympiads = await utils.convert_olympiads_to_view_format(olympiads=olympiads,
+                                                                  auth=auth,
+                                                                  catalog=await get_catalog(db_session))
 
     return card_olympiads
 
 
 @logging_wrapper
+@read_only
 async def filter_olympiads(
         auth: UserSchema | bool,
         subjects: List[str] | None,
@@ -529,11 +554,77 @@ async def filter_olympiads(
                                           session=db_session)
 
     card_olympiads = await utils.convert_olympiads_to_view_format(olympiads=results,
-                                                                  auth=auth)
+                                                                  auth=auth,
+                                                                  catalog=await get_catalog(db_session))
 
     return card_olympiads
 
 
+@logging_wrapper
+@read_only
+async def get_calendar(
+        start: date,
+        end: date,
+        grades: List[int] | None,
+        subjects: List[str] | None,
+        auth: UserSchema | bool,
+        db_session: async_session
+) -> List[CalendarDaySchema]:
+    """
+    Get olympiad stages starting between two dates grouped by day.
+    Stages are taken from the catalog's sorted stage index, so cost is O(log n + k)
+    where k is the number of stages in the range
+
+    Args:
+        start (date): First day of the range (inclusive).
+        end (date): Last day of the range (inclusive).
+        grades (List[int] | None): A list of grade integers to filter by, or None for no grade filtering.
+        subjects (List[str] | None): A list of subject strings to filter by, or None for no subject filtering.
+        auth (UserSchema | bool): The authenticated user or False if not authenticated.
+        db_session (async_session): The database session, used only if catalog has to be rebuilt.
+
+    Returns:
+        List[CalendarDaySchema]: Days in the range that have at least one stage, in date order.
+    """
+    logger.info(f'Getting calendar from {start} to {end}')
+
+    catalog = await get_catalog(db_session)
+
+    grades = frozenset(grades) if grades is not None else None
+    subjects = frozenset(crud.expand_subjects(subjects)) if subjects is not None else None
+
+    favorite_ids, notification_ids, participate_ids = frozenset(), frozenset(), frozenset()
+    if auth is not False:
+        favorite_ids, notification_ids, participate_ids = auth.favorite_ids, auth.notification_ids, auth.participate_ids
+
+    days = []
+    for olympiad_id, stage in catalog.stages_between(start, end):
+        olympiad = catalog.olympiads[olympiad_id]
+
+        if grades is not None and grades.isdisjoint(catalog.grades[olympiad_id]):
+            continue
+        if subjects is not None and subjects.isdisjoint(olympiad.subjects):
+            continue
+
+        if not days or days[-1].date != stage.start_date:
+            days.append(CalendarDaySchema(date=stage.start_date, events=[]))
+
+        days[-1].events.append(CalendarEventSchema(
+            olympiad_id=olympiad_id,
+            title=olympiad.title,
+            stage=stage.name,
+            start_date=stage.start_date,
+            end_date=stage.end_date,
+            classes=await utils.humanize_classes(olympiad),
+            subjects=await utils.optimize_subjects(olympiad),
+            is_favorite=olympiad_id in favorite_ids,
+            is_notified=olympiad_id in notification_ids,
+            is_participant=olympiad_id in participate_ids,
+        ))
+
+    return days
+
+
 @logging_wrapper
 async def sort_olympiads(
         sort_clause: str,
@@ -541,6 +632,8 @@ async def sort_olympiads(
 ) -> List[OlympiadSchemaCard]:
     """
     Sort the list of olympiads based on the specified sort clause.
+    Sorting by date is a stable argsort: upcoming olympiads go first by nearest stage date,
+    olympiads without upcoming stages go last, ties keep the original order.
 
     Args:
         sort_clause (str): The sort clause to use for sorting. Can be either 'name' or 'date'.
@@ -555,7 +648,8 @@ async def sort_olympiads(
         olympiads.sort(key=lambda x: x.title)
 
     elif sort_clause == 'date':
-        olympiads.sort(key=lambda x: x.date)
+        dates = np.array([olympiad.date for olympiad in olympiads], dtype='datetime64[D]')  # None becomes NaT
+        olympiads = [olympiads[i] for i in np.argsort(dates, kind='stable')]  # NaT is sorted last
 
     return olympiads
 
@@ -0,0 +1,86 @@
+"""
+In-process cache of users looked up by access token (services.is_authenticated), so authenticated
+requests do not query the user on every call. Users are evicted by user invalidation events
+(see database/invalidation.py): at once for changes of this worker, within invalidation.poll_seconds
+for changes of other processes
+"""
+from collections import OrderedDict
+from typing import Dict, Set
+
+from src.aggregator import metrics
+from src.aggregator.DTOs import UserSchema
+from src.aggregator.database import invalidation
+from src.setup import settings
+
+
+class UserCache:
+    """
+    LRU cache of users by username
+
+    Attributes:
+        size: maximal number of cached users, 0 disables the cache
+        generation: number of invalidations, a user read from database before an invalidation is not cached
+
+    Methods:
+        get(self, username): cached user or None
+        put(self, user, generation): caches user read at given generation
+        invalidate(self, user_ids): evicts users, all of them if user_ids is None
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.generation = 0
+        self._users: OrderedDict[str, UserSchema] = OrderedDict()
+        self._usernames: Dict[int, str] = {}
+
+    def get(self, username: str) -> UserSchema | None:
+        """
+        Args:
+            username: username from access token
+
+        Returns: cached user or None
+
+        """
+        user = self._users.get(username)
+        if user is None:
+            metrics.user_cache_lookups.inc('miss')
+            return None
+
+        metrics.user_cache_lookups.inc('hit')
+        self._users.move_to_end(username)
+        return user.model_copy()
+
+    def put(self, user: UserSchema, generation: int) -> None:
+        """
+        Args:
+            user: user read from database
+            generation: value of generation before user was read
+
+        Returns: None
+
+        """
+        if not self.size or generation != self.generation:
+            return
+
+        self._users[user.username] = user.model_copy()
+        self._usernames[user.id] = user.username
+        if len(self._users) > self.size:
+            _, evicted = self._users.popitem(last=False)
+            self._usernames.pop(evicted.id, None)
+
+    def invalidate(self, user_ids: Set[int] | None) -> None:
+        self.generation += 1
+
+        if user_ids is None:
+            self._users.clear()
+            self._usernames.clear()
+            return
+
+        for user_id in user_ids:
+            username = self._usernames.pop(user_id, None)
+            if username is not None:
+                self._users.pop(username, None)
+
+
+user_cache = UserCache(settings.user_cache.size)
+invalidation.subscribe('user', user_cache.invalidate)
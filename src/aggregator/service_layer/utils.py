@@ -1,5 +1,5 @@
 import smtplib
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta, timezone, date, time
 from enum import Enum
 from typing import Optional, Sequence, List, Dict
 
@@ -8,15 +8,17 @@ from jose import jwt
 from loguru import logger
 
 from src.aggregator.DTOs import UserSchema
-from src.aggregator.DTOs.olympiad import OlympiadSchema, OlympiadSchemaCard
-from src.aggregator.database import crud, Olympiad
-from src.setup import settings, get_session_maker
+from src.aggregator.DTOs.olympiad import OlympiadSchema, OlympiadSchemaCard, OlympiadStageSchema
+from src.aggregator.database import crud
+from src.aggregator.service_layer.catalog import Catalog
+from src.setup import settings, unit_of_work
 
 
 def logging_wrapper(func):
     """
     Decorator for loguru
-    Contextualizes loguru and allows loguru to catch errors
+    Contextualizes loguru and allows loguru to catch errors.
+    Caught error marks db session rollback-only, so request unit of work does not commit partial changes
 
     Args:
         func: function to be logged
@@ -26,9 +28,14 @@ def logging_wrapper(func):
     """
     async def wrapper(*args, **kwargs):
         filtered_kwargs = kwargs.copy()
-        filtered_kwargs.pop('db_session', None)
+        db_session = filtered_kwargs.pop('db_session', None)
         with logger.contextualize(**filtered_kwargs), logger.catch():
-            return await func(*args, **kwargs)
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if db_session is not None:
+                    db_session.info['rollback_only'] = True
+                raise
 
     return wrapper
 
@@ -124,7 +131,6 @@ async def database_sink(message) -> None:
     Returns:
         None
     """
-    session_maker = await get_session_maker()
     record = message.record
 
     user_id = record["extra"]["user_id"]
@@ -138,30 +144,29 @@ async def database_sink(message) -> None:
     else:
         log_type = LogTypes.user if user_id else LogTypes.system
 
-    await crud.add_log(
-        session=session_maker(),
-        user_id=user_id,
-        log_type=log_type.value,
-        date=datetime.now(),
-        text=text)
+    async with unit_of_work() as session:
+        await crud.add_log(
+            session=session,
+            user_id=user_id,
+            log_type=log_type.value,
+            date=datetime.now(),
+            text=text)
 
 
-async def get_nearest_date(olympiad: OlympiadSchema) -> datetime:
+async def get_nearest_date(olympiad: OlympiadSchema) -> datetime | None:
     """
     Helper function for getting nearest stage date for olympiad
 
     Args:
         olympiad: olympiad for what we need to get stage date
 
-    Returns: nearest stage date
+    Returns: nearest stage date or None if all stages have started
 
     """
-    now = datetime.now()
+    stage = nearest_stage(olympiad)
 
-    for dates in olympiad.dates.values():
-        temp = datetime.strptime(dates[0], '%Y-%m-%d')
-        if now < temp:
-            return temp
+    if stage is not None:
+        return datetime.combine(stage.start_date, time())
 
 
 async def get_nearest_date_str(olympiad: OlympiadSchema) -> str:
@@ -174,12 +179,39 @@ async def get_nearest_date_str(olympiad: OlympiadSchema) -> str:
     Returns: formatted string with nearest stage date for frontend
 
     """
-    now = datetime.now()
+    stage = nearest_stage(olympiad)
 
-    for stage, dates in olympiad.dates.items():
-        temp = datetime.strptime(dates[0], '%Y-%m-%d')
-        if now < temp:
-            return f'{stage} - {temp.strftime("%b %d")}'
+    if stage is not None:
+        return humanize_stage(stage)
+
+
+def nearest_stage(olympiad: OlympiadSchema) -> OlympiadStageSchema | None:
+    """
+    Finds the earliest stage starting after today, the same rule as Catalog.nearest_stages
+
+    Args:
+        olympiad: olympiad which stages to look at
+
+    Returns: nearest upcoming stage or None if all stages have started
+
+    """
+    today = date.today()
+    upcoming = [stage for stage in olympiad.stages if today < stage.start_date]
+
+    return min(upcoming, key=lambda stage: stage.start_date, default=None)
+
+
+def humanize_stage(stage: OlympiadStageSchema) -> str:
+    """
+    Makes stage name and start date into readable string
+
+    Args:
+        stage: olympiad stage
+
+    Returns: formatted stage string for frontend
+
+    """
+    return f'{stage.name} - {stage.start_date.strftime("%b %d")}'
 
 
 async def humanize_classes(olympiad: OlympiadSchema) -> str:
@@ -194,7 +226,7 @@ async def humanize_classes(olympiad: OlympiadSchema) -> str:
     """
     classes = ''
     if len(olympiad.classes) == 1:
-        classes = f'{olympiad.classes[1]} класс'
+        classes = f'{olympiad.classes[0]} класс'
     else:
         classes = f'{min(olympiad.classes)} - {max(olympiad.classes)} классы'
 
@@ -240,36 +272,50 @@ class LogTypes(Enum):
 
 
 async def convert_olympiads_to_view_format(
-        olympiads: Sequence[Olympiad],
-        auth: UserSchema | bool
+        olympiads: Sequence[OlympiadSchema],
+        auth: UserSchema | bool,
+        catalog: Catalog | None = None
 ) -> List[OlympiadSchemaCard]:
     """
-    Converts a sequence of Olympiad objects to a list of OlympiadSchemaCard objects.
-    If user is authorized gets from it additional data
+    Converts a sequence of OlympiadSchema objects to a list of OlympiadSchemaCard objects.
+    If user is authorized gets from it additional data.
+    Nearest stages are taken from catalog's precomputed ones, olympiads missing in catalog
+    (or all of them if no catalog passed) are computed one by one
 
     Args:
-        olympiads (Sequence[Olympiad]): A sequence of Olympiad objects to be converted.
+        olympiads (Sequence[OlympiadSchema]): A sequence of olympiads to be converted.
         auth (UserSchema | bool): A UserSchema object representing the authenticated user, or False if not authenticated.
+        catalog (Catalog | None): Catalog read model to take nearest stages from.
 
     Returns:
         List[OlympiadSchemaCard]: A list of OlympiadSchemaCard objects representing the converted olympiads.
     """
     card_olympiads = []
-    is_favorite, is_notified, is_participant = False, False, False
-    for olympiad in olympiads:
-        olympiad = olympiad.to_dto_model()
+    favorite_ids, notification_ids, participate_ids = frozenset(), frozenset(), frozenset()
+    if auth is not False:
+        favorite_ids, notification_ids, participate_ids = auth.favorite_ids, auth.notification_ids, auth.participate_ids
+
+    nearest_stages = catalog.nearest_stages(date.today()) if catalog is not None else {}
 
-        if auth is not False:
-            is_favorite = olympiad.id in auth.favorites
-            is_notified = olympiad.id in auth.notifications
-            is_participant = olympiad.id in auth.participates
+    for olympiad in olympiads:
+        is_favorite = olympiad.id in favorite_ids
+        is_notified = olympiad.id in notification_ids
+        is_participant = olympiad.id in participate_ids
+
+        if catalog is not None and olympiad.id in catalog.olympiads:
+            stage = nearest_stages.get(olympiad.id)
+            nearest_date = datetime.combine(stage.start_date, time()) if stage is not None else None
+            nearest_date_str = humanize_stage(stage) if stage is not None else None
+        else:
+            nearest_date = await get_nearest_date(olympiad)
+            nearest_date_str = await get_nearest_date_str(olympiad)
 
         card_olympiad = OlympiadSchemaCard(
             id=olympiad.id,
             title=olympiad.title,
             description=olympiad.description,
-            date=await get_nearest_date(olympiad),
-            datestr=await get_nearest_date_str(olympiad),
+            date=nearest_date,
+            datestr=nearest_date_str,
             classes=await humanize_classes(olympiad),
             subjects=await optimize_subjects(olympiad),
             is_favorite=is_favorite,
@@ -295,13 +341,11 @@ async def jsonify_dates(olympiad: OlympiadSchema) -> List[Dict[str, str]]:
     """
     result = []
 
-    for stage, dates in olympiad.dates.items():
-        date_start = datetime.strptime(dates[0], "%Y-%m-%d")
-        temp = {'name': stage, 'date_start': date_start.strftime("%b %d")}
+    for stage in olympiad.stages:
+        temp = {'name': stage.name, 'date_start': stage.start_date.strftime("%b %d")}
 
-        if len(dates) == 2:
-            date_end = datetime.strptime(dates[1], "%Y-%m-%d")
-            temp['date_end'] = f'- {date_end.strftime("%b %d")}'
+        if stage.end_date is not None:
+            temp['date_end'] = f'- {stage.end_date.strftime("%b %d")}'
         else:
             temp['date_end'] = ''
 
@@ -1,33 +1,130 @@
+"""
+Process setup: settings, database, FastAPI app, scheduler, email and logging.
+Imported by every process (API workers, scheduler, command line tools), so only what all of them
+need is imported at module level. FastAPI, Rocketry, passlib and smtplib are imported by the
+functions which use them: the scheduler and CLI tools never load the web stack, workers never load
+Rocketry unless they become scheduler leader, bcrypt context is built on first password check.
+Import time is checked by benchmarks.import_time
+"""
 import asyncio
-import smtplib
-import ssl
+import multiprocessing
+import os
 import sys
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import IO, List, AsyncIterator, TYPE_CHECKING
 
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import OAuth2PasswordBearer
 from loguru import logger
-from passlib.context import CryptContext
-from rocketry import Rocketry
-from rocketry.conds import weekly
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
-from starlette.middleware import Middleware
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
 
-from src.aggregator.database.connection import initialize_database
+from src.aggregator.database.connection import initialize_database, create_database_engine
+from src.aggregator.database.routing import RoutingSession
 from src.config import Settings
 
+if TYPE_CHECKING:
+    import smtplib
+
+    from fastapi import FastAPI
+    from passlib.context import CryptContext
+
+# Parsed once per process, every module reads this instance
 settings = Settings()
 
 
-def setup_fastapi() -> FastAPI:
+@asynccontextmanager
+async def lifespan(app: 'FastAPI'):
+    """
+    Startup and shutdown hooks of every worker
+    On startup configures logging, warms engine with its connection pool and catalog cache,
+    starts metrics flusher and cache invalidation poller and starts scheduler if this worker becomes
+    scheduler leader. On shutdown stops them and disposes engine
+
+    Args:
+        app: FastAPI app
+
+    Returns: None
+
+    """
+    from src.aggregator import metrics
+    from src.aggregator.database import invalidation
+    from src.aggregator.service_layer.catalog import get_catalog
+
+    setup_logging()
+    session_maker = await get_session_maker()
+    async with session_maker() as session:
+        # events are consumed from the version before the catalog is read, so no change is missed
+        await invalidation.sync(session)
+        await get_catalog(session)
+
+    lock_file = acquire_scheduler_lock(settings.fastapi.scheduler_lock)
+    rocketry_process = None
+    if lock_file is not None:
+        logger.info('Worker became scheduler leader')
+        # spawned, not forked: the child must not inherit this worker's engine, pool connections
+        # (they belong to this event loop) and metric values recorded during startup
+        rocketry_process = multiprocessing.get_context('spawn').Process(target=setup_rocketry)
+        rocketry_process.start()
+
+    metrics_flusher = asyncio.create_task(metrics.run_flusher(settings.metrics.directory,
+                                                              settings.metrics.flush_seconds))
+    invalidation_poller = asyncio.create_task(invalidation.run_poller(settings.invalidation.poll_seconds,
+                                                                      settings.invalidation.gap_seconds))
+
+    yield
+
+    invalidation_poller.cancel()
+    metrics_flusher.cancel()
+    await asyncio.gather(metrics_flusher, invalidation_poller, return_exceptions=True)  # waits for the final flush
+    if rocketry_process is not None:
+        rocketry_process.terminate()
+        rocketry_process.join()
+    if lock_file is not None:
+        lock_file.close()
+
+    await dispose_session_maker()
+
+
+def acquire_scheduler_lock(path: str) -> IO | None:
+    """
+    Tries to become scheduler leader by taking non-blocking exclusive lock on the file.
+    Only one process at a time can hold it, lock is released by OS when holder exits
+
+    Args:
+        path: path of the lock file
+
+    Returns: opened lock file if lock was acquired (keep it open while leading), None otherwise
+
+    """
+    lock_file = open(path, 'a+')
+
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+
+    return lock_file
+
+
+def setup_fastapi() -> 'FastAPI':
     """
     Setups FastAPI app providing docs, origins, middlewares and routers
 
     Returns: FastAPI app
 
     """
+    from fastapi import FastAPI
+    from fastapi.middleware.cors import CORSMiddleware
+    from starlette.middleware import Middleware
+
     from src.aggregator.api.router import all_routers
-    from src.aggregator.api.middlewares import AuthenticationMiddleware, DatabaseSessionMiddleware
+    from src.aggregator.api.middlewares import DatabaseSessionMiddleware, MetricsMiddleware, ProfilingMiddleware, \
+        QueryBudgetMiddleware, AdmissionMiddleware
 
     tags_metadata = [
         {
@@ -57,24 +154,39 @@ def setup_fastapi() -> FastAPI:
         {
             "name": "Notifications",
             "description": "Actions with notifications",
+        },
+        {
+            "name": "Calendar",
+            "description": "Upcoming olympiad stages grouped by day",
         }
     ]
 
     origins = settings.fastapi.origins
 
+    middleware = [Middleware(MetricsMiddleware)]
+    if settings.profiling.enabled:
+        # not installed at all when disabled, so requests pay nothing for it
+        middleware.append(Middleware(ProfilingMiddleware))
+    if settings.query_budget.mode != 'off':
+        middleware.append(Middleware(QueryBudgetMiddleware))
+    middleware += [
+        Middleware(CORSMiddleware,
+                   allow_origins=origins,
+                   allow_credentials=True,
+                   allow_methods=["*"],
+                   allow_headers=["*"]),
+    ]
+    if settings.admission.enabled:
+        # inside CORS, so 503 responses still carry CORS headers
+        middleware.append(Middleware(AdmissionMiddleware))
+    middleware.append(Middleware(DatabaseSessionMiddleware))
+
     # noinspection PyTypeChecker
     app_fastapi = FastAPI(
         title="Competition Aggregator API",
         openapi_tags=tags_metadata,
-        middleware=[
-            Middleware(DatabaseSessionMiddleware),
-            Middleware(AuthenticationMiddleware),
-            Middleware(CORSMiddleware,
-                       allow_origins=origins,
-                       allow_credentials=True,
-                       allow_methods=["*"],
-                       allow_headers=["*"])
-        ])
+        lifespan=lifespan,
+        middleware=middleware)
 
     for router in all_routers:
         app_fastapi.include_router(router)
@@ -84,11 +196,16 @@ def setup_fastapi() -> FastAPI:
 
 def setup_rocketry() -> None:
     """
-    Setups Rocketry (task scheduler) for background tasks: send notifications and parse olympiads
+    Setups Rocketry (task scheduler) for background tasks: send notifications and parse olympiads.
+    Runs in separate spawned process, which creates its own engine, metrics and logging
 
     Returns: None
 
     """
+    from rocketry import Rocketry
+    from rocketry.conds import weekly
+
+    from src.aggregator import metrics
     from src.aggregator.service_layer.backgruond_tasks import send_notifications, update_olympiads_info
 
     app_rocketry = Rocketry(execution="async")
@@ -105,30 +222,97 @@ def setup_rocketry() -> None:
 
         await update_olympiads_info()
 
-    asyncio.run(app_rocketry.serve())
+    async def serve():
+        setup_logging()  # database sink needs running event loop
+
+        # scheduler process flushes its own metrics (crawler, notifications) next to workers' ones
+        metrics_flusher = asyncio.create_task(metrics.run_flusher(settings.metrics.directory,
+                                                                  settings.metrics.flush_seconds))
+        try:
+            await app_rocketry.serve()
+        finally:
+            metrics_flusher.cancel()
+
+    asyncio.run(serve())
+
+
+_session_maker: async_sessionmaker | None = None
+_replicas: List[AsyncEngine] = []
 
 
 async def get_session_maker() -> async_sessionmaker:
     """
     Setups session maker getter for database
+    Engine (and its connection pool) is created and database schema is checked once per process,
+    subsequent calls return the same session maker.
+    Sessions send reads of read_only service functions to database.replicas (see database/routing.py)
 
     Returns: async_sessionmaker
 
     """
-    engine = create_async_engine(settings.database.connection_string)
-    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    global _session_maker, _replicas
+
+    if _session_maker is None:
+        engine = create_database_engine(settings.database)
+        await initialize_database(engine, auto_migrate=settings.database.auto_migrate)
+
+        _replicas = [create_database_engine(settings.database, replica) for replica in settings.database.replicas]
 
-    await initialize_database(engine)
+        _session_maker = async_sessionmaker(engine,
+                                            expire_on_commit=False,
+                                            sync_session_class=RoutingSession,
+                                            replicas=[replica.sync_engine for replica in _replicas])
 
-    return session_maker
+    return _session_maker
 
 
-async def setup_email_server() -> smtplib.SMTP_SSL:
+async def dispose_session_maker() -> None:
+    """
+    Closes all pooled connections of the engines created by get_session_maker
+
+    Returns: None
+
+    """
+    global _session_maker, _replicas
+
+    if _session_maker is not None:
+        await _session_maker.kw['bind'].dispose()
+        for replica in _replicas:
+            await replica.dispose()
+        _session_maker, _replicas = None, []
+
+
+@asynccontextmanager
+async def unit_of_work() -> AsyncIterator[AsyncSession]:
+    """
+    Session for work outside of requests (background tasks, parsers, log sink).
+    Changes are committed once when block exits and rolled back if it raises.
+    Requests get the same behaviour from DatabaseSessionMiddleware
+
+    Returns: AsyncSession
+
+    """
+    session_maker = await get_session_maker()
+
+    async with session_maker() as session:
+        try:
+            yield session
+        except BaseException:
+            await session.rollback()
+            raise
+
+        await session.commit()
+
+
+async def setup_email_server() -> 'smtplib.SMTP_SSL':
     """
     Setups email server for sending ntfs
 
     Returns: server
     """
+    import smtplib
+    import ssl
+
     email_server = smtplib.SMTP_SSL(settings.stmp.server, settings.stmp.port, context=ssl.create_default_context())
     email_server.login(settings.stmp.name, settings.stmp.password)
     return email_server
@@ -172,6 +356,14 @@ def setup_logging():
     logger.level("CRITICAL", color="<red>")
 
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@lru_cache(maxsize=None)
+def get_password_context() -> 'CryptContext':
+    """
+    Password hashing context, created on first use
+
+    Returns: bcrypt CryptContext
+    """
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
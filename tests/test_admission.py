@@ -0,0 +1,169 @@
+"""
+Admission control: AdmissionMiddleware in front of a small ASGI app sheds requests over the queue or
+waiting too long with 503 and Retry-After, cancels the app at the deadline or when the client disconnects,
+and statements started after the deadline are refused
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+from sqlalchemy import text
+
+from src.aggregator import metrics
+from src.aggregator.api.middlewares import AdmissionMiddleware
+from src.aggregator.database.instrumentation import DeadlineExceeded, request_deadline
+from src.setup import settings
+
+pytestmark = pytest.mark.anyio
+
+
+class App:
+    """
+    ASGI app answering 200 after release is set, records whether its request task was cancelled
+    """
+
+    def __init__(self) -> None:
+        self.entered = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, scope, receive, send) -> None:
+        self.entered += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'ok'})
+
+
+@pytest.fixture
+def admission(monkeypatch) -> None:
+    """
+    One running and one waiting read request at most
+    """
+    monkeypatch.setattr(settings.admission.limits, 'read', 1)
+    monkeypatch.setattr(settings.admission.queue, 'read', 1)
+    monkeypatch.setattr(settings.admission, 'queue_timeout', 5.0)
+    monkeypatch.setattr(settings.admission, 'request_timeout', 5.0)
+
+
+def client(app) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test')
+
+
+def shed(reason: str) -> float:
+    return metrics.http_requests_shed._values.get(('read', reason), 0)
+
+
+async def wait_until(condition) -> None:
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('condition was not met')
+
+
+async def test_full_queue_is_rejected(admission):
+    app = App()
+    middleware = AdmissionMiddleware(app)
+    saturated = shed('saturated')
+
+    async with client(middleware) as http:
+        running = asyncio.create_task(http.get('/'))
+        await wait_until(lambda: app.entered == 1)
+        waiting = asyncio.create_task(http.get('/'))
+        await wait_until(lambda: middleware._waiting['read'] == 1)
+
+        rejected = await http.get('/')
+        assert rejected.status_code == 503
+        assert rejected.headers['Retry-After'] == str(settings.admission.retry_after)
+        assert shed('saturated') == saturated + 1
+
+        app.release.set()
+        assert (await running).status_code == 200
+        assert (await waiting).status_code == 200
+
+    assert app.entered == 2
+
+
+async def test_long_wait_is_rejected(admission, monkeypatch):
+    monkeypatch.setattr(settings.admission, 'queue_timeout', 0.05)
+    app = App()
+    queue_timeout = shed('queue_timeout')
+
+    async with client(AdmissionMiddleware(app)) as http:
+        running = asyncio.create_task(http.get('/'))
+        await wait_until(lambda: app.entered == 1)
+
+        rejected = await http.get('/')
+        assert rejected.status_code == 503
+        assert 'Retry-After' in rejected.headers
+        assert shed('queue_timeout') == queue_timeout + 1
+
+        app.release.set()
+        assert (await running).status_code == 200
+
+
+async def test_app_is_cancelled_at_deadline(admission, monkeypatch):
+    monkeypatch.setattr(settings.admission, 'request_timeout', 0.05)
+    app = App()
+    deadline = shed('deadline')
+
+    async with client(AdmissionMiddleware(app)) as http:
+        response = await http.get('/')
+
+    assert response.status_code == 503
+    assert app.cancelled == 1
+    assert shed('deadline') == deadline + 1
+
+
+async def test_deadline_exceeded_by_app_is_shed(admission):
+    async def app(scope, receive, send):
+        raise DeadlineExceeded('statement after deadline')
+
+    async with client(AdmissionMiddleware(app)) as http:
+        response = await http.get('/')
+
+    assert response.status_code == 503
+
+
+async def test_disconnect_sheds_request(admission):
+    app = App()
+    disconnected = shed('disconnected')
+    messages = asyncio.Queue()
+    messages.put_nowait({'type': 'http.request', 'body': b'', 'more_body': False})
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/', 'headers': [], 'query_string': b''}
+    handling = asyncio.create_task(AdmissionMiddleware(app)(scope, messages.get, send))
+    await wait_until(lambda: app.entered == 1)
+
+    messages.put_nowait({'type': 'http.disconnect'})
+    await asyncio.wait_for(handling, 1)
+
+    assert app.cancelled == 1
+    assert sent == []
+    assert shed('disconnected') == disconnected + 1
+
+
+async def test_statement_after_deadline_is_refused(engine):
+    async with engine.connect() as conn:
+        token = request_deadline.set(time.monotonic() + 60)
+        try:
+            assert (await conn.execute(text('SELECT 1'))).scalar() == 1
+        finally:
+            request_deadline.reset(token)
+
+        token = request_deadline.set(time.monotonic() - 1)
+        try:
+            with pytest.raises(DeadlineExceeded):
+                await conn.execute(text('SELECT 1'))
+        finally:
+            request_deadline.reset(token)
@@ -0,0 +1,123 @@
+"""
+Catalog snapshot: a mapped snapshot answers like Catalog built from the same olympiads, and a worker falls back
+to database when an olympiad changed after the snapshot, also in a version which was pending when it was read
+"""
+import random
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from benchmarks.dataset import generate_olympiad
+from src.aggregator.DTOs import OlympiadSchema, OlympiadStageSchema
+from src.aggregator.database import crud
+from src.aggregator.service_layer import catalog
+from src.aggregator.service_layer.catalog import Catalog
+from src.aggregator.service_layer.catalog_snapshot import MappedCatalog, write_snapshot
+from src.setup import settings
+
+pytestmark = pytest.mark.anyio
+
+TODAY = date(2026, 3, 1)
+
+
+def make_olympiads(count: int) -> list:
+    """
+    Olympiads with sparse ids in random order, the last one has no stages
+    """
+    rng = random.Random(0)
+    ids = rng.sample(range(1, 20 * count), count)
+    olympiads = []
+
+    for number, olympiad_id in enumerate(ids, start=1):
+        olympiad = generate_olympiad(rng, number, TODAY)
+        olympiad['stages'] = [OlympiadStageSchema(**stage) for stage in olympiad['stages']]
+        olympiads.append(OlympiadSchema(id=olympiad_id, **olympiad))
+    olympiads[-1].stages = []
+
+    return olympiads
+
+
+@pytest.fixture
+def catalogs(tmp_path) -> tuple:
+    """
+    Catalog and MappedCatalog of the same 500 olympiads
+    """
+    olympiads = make_olympiads(500)
+    write_snapshot(str(tmp_path / 'catalog.snapshot'), 1, olympiads)
+
+    return Catalog(1, olympiads), MappedCatalog(1, str(tmp_path / 'catalog.snapshot'))
+
+
+def test_mapped_catalog_answers_like_catalog(catalogs):
+    built, mapped = catalogs
+
+    assert dict(mapped.olympiads) == built.olympiads
+    assert dict(mapped.grades) == built.grades
+    assert list(mapped.olympiads) == sorted(built.olympiads)
+    gap = min(set(range(1, max(built.olympiads))) - built.olympiads.keys())
+    for missing in (0, -1, gap, max(built.olympiads) + 1):
+        assert missing not in mapped.olympiads
+        with pytest.raises(KeyError):
+            mapped.grades[missing]
+
+    # stages of many olympiads start on the same day, their order is a part of the answer
+    for offset, days in ((-200, 0), (-130, 30), (-1, 1), (0, 0), (10, 90), (-200, 600), (400, 500)):
+        start = TODAY + timedelta(days=offset)
+        assert mapped.stages_between(start, start + timedelta(days=days)) == \
+            built.stages_between(start, start + timedelta(days=days))
+
+    for offset in (-200, -30, 0, 1, 45, 300, 600):
+        today = TODAY + timedelta(days=offset)
+        assert dict(mapped.nearest_stages(today)) == built.nearest_stages(today)
+
+
+async def test_snapshot_is_mapped_until_olympiad_changes(session, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.catalog, 'snapshot_path', str(tmp_path / 'catalog.snapshot'))
+    rng = random.Random(0)
+
+    await crud.upsert_olympiads(session, [generate_olympiad(rng, number, TODAY) for number in range(1, 4)])
+    await session.commit()
+    version = await crud.get_cache_version(session)
+    write_snapshot(settings.catalog.snapshot_path, version, await crud.get_all_olympiads(session),
+                   await crud.get_pending_cache_versions(session, version))
+
+    mapped = await catalog._map_snapshot(1, session)
+    assert isinstance(mapped, MappedCatalog)
+    assert dict(mapped.olympiads) == {olympiad.id: olympiad for olympiad in await crud.get_all_olympiads(session)}
+
+    # events of other entities do not outdate the snapshot
+    await crud.publish_cache_versions(session, 'user', [1])
+    await session.commit()
+    assert isinstance(await catalog._map_snapshot(2, session), MappedCatalog)
+
+    await crud.upsert_olympiads(session, [generate_olympiad(rng, 4, TODAY)])
+    await session.commit()
+    assert await catalog._map_snapshot(3, session) is None
+
+
+async def test_snapshot_is_outdated_by_late_commit(engine, session, tmp_path, monkeypatch):
+    if engine.dialect.name != 'postgresql':
+        pytest.skip('SQLite commits versions in order')
+
+    monkeypatch.setattr(settings.catalog, 'snapshot_path', str(tmp_path / 'catalog.snapshot'))
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    rng = random.Random(0)
+
+    async with session_maker() as early, session_maker() as late:
+        # the olympiad change takes its version first and commits after a later version
+        await crud.upsert_olympiads(early, [generate_olympiad(rng, 1, TODAY)])
+        await crud.publish_cache_versions(late, 'user', [1])
+        await late.commit()
+
+        version = await crud.get_cache_version(session)
+        pending_versions = await crud.get_pending_cache_versions(session, version)
+        write_snapshot(settings.catalog.snapshot_path, version, await crud.get_all_olympiads(session),
+                       pending_versions)
+        await session.commit()
+        assert pending_versions
+        assert isinstance(await catalog._map_snapshot(1, session), MappedCatalog)
+
+        await early.commit()
+
+    assert await catalog._map_snapshot(2, session) is None
@@ -0,0 +1,82 @@
+"""
+Database layer on every supported backend: migrations, dialect-specific upsert and filters
+"""
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+
+from src.aggregator.database import crud, Olympiad, OlympiadStage
+from src.aggregator.database.migrations import HEAD, MIGRATIONS, upgrade_database, check_database
+
+pytestmark = pytest.mark.anyio
+
+
+def olympiad(site_data: str | None, title: str, subjects: list, classes: list, stages: list = ()) -> dict:
+    return {'title': title, 'level': 1, 'description': None, 'subjects': subjects, 'classes': classes,
+            'site_data': site_data,
+            'stages': [{'name': name, 'start_date': start, 'end_date': None} for name, start in stages]}
+
+
+async def test_migrations_reach_head(engine):
+    assert await upgrade_database(engine) == [migration.version for migration in MIGRATIONS]
+    await check_database(engine)
+
+    # already at HEAD: nothing to apply
+    assert await upgrade_database(engine) == []
+    assert MIGRATIONS[-1].version == HEAD
+
+
+async def test_upsert_olympiads_updates_by_site_data(session):
+    count = await crud.upsert_olympiads(session, [
+        olympiad('1', 'Первая', ['Математика'], [9], [('Отбор', date(2099, 1, 10))]),
+        olympiad('2', 'Вторая', ['Физика'], [10]),
+        olympiad(None, 'Без ключа', ['Химия'], [11]),
+    ])
+    await session.commit()
+    assert count == 3
+
+    ids = dict((await session.execute(select(Olympiad.site_data, Olympiad.id))).all())
+
+    count = await crud.upsert_olympiads(session, [
+        olympiad('1', 'Первая (новая)', ['Математика', 'Информатика'], [9, 10],
+                 [('Отбор', date(2099, 1, 11)), ('Финал', date(2099, 3, 1))]),
+        olympiad('3', 'Третья', ['Биология'], [8]),
+    ])
+    await session.commit()
+    assert count == 2
+
+    rows = (await session.execute(select(Olympiad.site_data, Olympiad.id, Olympiad.title, Olympiad.subjects)
+                                  .order_by(Olympiad.id))).all()
+    assert [row.site_data for row in rows] == ['1', '2', None, '3']
+    # conflicting row is updated in place, its id is kept
+    assert rows[0].id == ids['1']
+    assert rows[0].title == 'Первая (новая)'
+    assert rows[0].subjects == ['Математика', 'Информатика']
+
+    stages = (await session.execute(select(OlympiadStage.name, OlympiadStage.start_date)
+                                    .where(OlympiadStage.olympiad_id == ids['1'])
+                                    .order_by(OlympiadStage.ordinal))).all()
+    assert stages == [('Отбор', date(2099, 1, 11)), ('Финал', date(2099, 3, 1))]
+
+
+async def test_filter_olympiads(session):
+    await crud.upsert_olympiads(session, [
+        olympiad('1', 'Математика 9-10', ['Математика'], [9, 10]),
+        olympiad('2', 'Физика 11', ['Физика'], [11]),
+        olympiad('3', 'Английский 9', ['Английский язык'], [9]),
+        olympiad('4', 'Математика и физика 11', ['Математика', 'Физика'], [11]),
+    ])
+    await session.commit()
+
+    async def titles(subjects, grades):
+        return [found.title for found in await crud.filter_olympiads(subjects, grades, session)]
+
+    assert await titles(['Математика'], None) == ['Математика 9-10', 'Математика и физика 11']
+    assert await titles(None, [9]) == ['Математика 9-10', 'Английский 9']
+    assert await titles(['Физика'], [11]) == ['Физика 11', 'Математика и физика 11']
+    assert await titles(['Математика', 'Физика'], [10]) == ['Математика 9-10']
+    # any language olympiad
+    assert await titles(['Языковедение'], None) == ['Английский 9']
+    assert await titles(['Химия'], None) == []
+    assert len(await titles(None, None)) == 4
@@ -0,0 +1,119 @@
+"""
+Cache invalidation bus: events are applied once, late commits on PostgreSQL are picked up by gaps,
+and a failing poll invalidates all caches
+"""
+import asyncio
+import contextlib
+from collections import defaultdict
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.aggregator.database import crud, invalidation
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def applied(monkeypatch) -> list:
+    """
+    Events received by a subscriber of 'user', the bus starts without subscribers and version
+    """
+    monkeypatch.setattr(invalidation, '_subscribers', defaultdict(list))
+    monkeypatch.setattr(invalidation, '_version', None)
+    monkeypatch.setattr(invalidation, '_gaps', {})
+
+    events = []
+    invalidation.subscribe('user', events.append)
+    return events
+
+
+@pytest.fixture
+def fetched(monkeypatch) -> list:
+    """
+    Number of rows read by every poll
+    """
+    counts = []
+    get_cache_versions_after = crud.get_cache_versions_after
+
+    async def counting(*args, **kwargs):
+        rows = await get_cache_versions_after(*args, **kwargs)
+        counts.append(len(rows))
+        return rows
+
+    monkeypatch.setattr(crud, 'get_cache_versions_after', counting)
+    return counts
+
+
+async def publish(session_maker: async_sessionmaker, entity_ids: list) -> None:
+    async with session_maker() as session:
+        await crud.publish_cache_versions(session, 'user', entity_ids)
+        await session.commit()
+
+
+async def test_poll_applies_event_once(engine, session, applied, fetched):
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    await invalidation.sync(session)
+
+    # a batch of many entities is published under one version
+    await publish(session_maker, list(range(1, 501)))
+    applied.clear()  # publishing process applies its events at once
+
+    assert await invalidation.poll(session, gap_seconds=60) == 500
+    assert applied == [set(range(1, 501))]
+
+    applied.clear()
+    for _ in range(3):
+        assert await invalidation.poll(session, gap_seconds=60) == 0
+    assert applied == []
+    # applied rows are not read again (on SQLite the first poll also reads the head row)
+    assert fetched[0] in (500, 501)
+    assert fetched[1:] == [0, 0, 0]
+
+
+async def test_poll_applies_late_commit(engine, session, applied):
+    if engine.dialect.name != 'postgresql':
+        pytest.skip('SQLite commits versions in order')
+
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    await invalidation.sync(session)
+
+    async with session_maker() as early, session_maker() as late:
+        await crud.publish_cache_versions(early, 'user', [1])
+        await crud.publish_cache_versions(late, 'user', [2])
+        await late.commit()
+
+        applied.clear()
+        assert await invalidation.poll(session, gap_seconds=60) == 1
+        assert applied == [{2}]
+
+        # version of the early transaction is below the applied one, it is queried as a gap
+        await early.commit()
+        assert await invalidation.poll(session, gap_seconds=60) == 1
+        assert applied == [{2}, {1}]
+
+    assert await invalidation.poll(session, gap_seconds=60) == 0
+    assert invalidation._gaps == {}
+
+
+async def test_failed_poll_invalidates_all_caches(monkeypatch, applied):
+    async def failing_poll(session, gap_seconds):
+        raise ConnectionError('database is down')
+
+    async def get_session_maker():
+        return contextlib.nullcontext
+
+    monkeypatch.setattr(invalidation, 'poll', failing_poll)
+    monkeypatch.setattr('src.setup.get_session_maker', get_session_maker)
+
+    poller = asyncio.create_task(invalidation.run_poller(0.01))
+    try:
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if applied:
+                break
+    finally:
+        poller.cancel()
+        await asyncio.gather(poller, return_exceptions=True)
+
+    assert applied and applied[0] is None
@@ -0,0 +1,105 @@
+"""
+Every endpoint of api/query_budgets.py fits its budget: requests are driven through the app
+with settings.query_budget.mode = 'raise', so a request over its budget or with an N+1 loop
+raises QueryBudgetError out of the client call
+"""
+from datetime import date, timedelta
+from typing import AsyncIterator, List, Tuple
+
+import httpx
+import pytest
+
+from src.aggregator.api.query_budgets import QUERY_BUDGETS
+from src.aggregator.database import crud, invalidation
+from src.aggregator.service_layer.user_cache import user_cache
+from src.setup import settings, setup_fastapi, unit_of_work, dispose_session_maker
+
+pytestmark = pytest.mark.anyio
+
+PASSWORD = 'password'
+
+
+@pytest.fixture
+async def client(database_url: str, monkeypatch) -> AsyncIterator[httpx.AsyncClient]:
+    """
+    Client of the app over a scratch database with two olympiads, budgets are enforced
+    """
+    monkeypatch.setattr(settings.database, 'connection_string', database_url)
+    monkeypatch.setattr(settings.database, 'replicas', [])
+    monkeypatch.setattr(settings.database, 'auto_migrate', True)
+    monkeypatch.setattr(settings.query_budget, 'mode', 'raise')
+    # budgets are counted for a user missing the user cache
+    monkeypatch.setattr(user_cache, 'size', 0)
+
+    await dispose_session_maker()
+    # caches may hold entities of the previous test database
+    invalidation.apply_all()
+
+    stage_date = date.today() + timedelta(days=10)
+    async with unit_of_work() as session:
+        for site_data, subject in (('1', 'Математика'), ('2', 'Физика')):
+            await crud.add_olympiad(session=session,
+                                    title=f'{subject} {site_data}',
+                                    dates={'Отбор': [stage_date], 'Финал': [stage_date + timedelta(days=30)]},
+                                    subjects=[subject],
+                                    classes=[9, 10, 11],
+                                    site_data=site_data)
+
+    transport = httpx.ASGITransport(app=setup_fastapi())
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            yield client
+    finally:
+        await dispose_session_maker()
+
+
+def budgeted_requests(user_id: int) -> List[Tuple[str, str, dict]]:
+    """
+    Requests of every budgeted endpoint after registration and login, in order which keeps them successful
+
+    Args:
+        user_id: id of the logged in user
+
+    Returns: list of (endpoint as in QUERY_BUDGETS, url, httpx request arguments)
+
+    """
+    user = f'/user/{user_id}'
+
+    return [
+        ('GET /', '/', {}),
+        ('GET /', '/', {'params': {'sortBy': 'date'}}),
+        ('GET /', '/', {'params': {'search': '"Мат"'}}),
+        ('GET /', '/', {'params': {'grades': [9], 'subjects': ['Математика', 'Физика']}}),
+        ('GET /calendar', '/calendar', {}),
+        ('GET /olympiad/{olympiad_id}', '/olympiad/1', {}),
+        ('GET /user/{user_id}', user, {}),
+        ('POST /user/{user_id}/favorites', f'{user}/favorites', {'json': 1}),
+        ('POST /user/{user_id}/participates', f'{user}/participates', {'json': 1}),
+        ('POST /user/{user_id}/notifications', f'{user}/notifications', {'json': 1}),
+        ('POST /user/{user_id}/favorites', f'{user}/favorites', {'json': 2}),
+        ('GET /user/{user_id}/favorites', f'{user}/favorites', {}),
+        ('GET /user/{user_id}/participates', f'{user}/participates', {}),
+        ('GET /user/{user_id}/notifications', f'{user}/notifications', {}),
+        ('DELETE /user/{user_id}/favorites/{olympiad_id}', f'{user}/favorites/1', {}),
+        ('DELETE /user/{user_id}/participates/{olympiad_id}', f'{user}/participates/1', {}),
+        ('DELETE /user/{user_id}/notifications/{olympiad_id}', f'{user}/notifications/1', {}),
+    ]
+
+
+async def test_endpoints_fit_query_budgets(client: httpx.AsyncClient):
+    response = await client.post('/auth/register',
+                                 json={'username': 'user', 'mail': 'user@example.com', 'password': PASSWORD})
+    assert response.status_code == 200, response.text
+
+    response = await client.post('/auth', data={'username': 'user', 'password': PASSWORD})
+    assert response.status_code == 200, response.text
+    user_id = response.json()['id']
+
+    requests = budgeted_requests(user_id)
+    # a new budget needs a request here, otherwise it is never checked
+    assert {'POST /auth/register', 'POST /auth'} | {endpoint for endpoint, _, _ in requests} == set(QUERY_BUDGETS)
+
+    for endpoint, url, arguments in requests:
+        method = endpoint.split()[0]
+        response = await client.request(method, url, **arguments)
+        assert response.status_code == 200, f'{endpoint}: {response.text}'
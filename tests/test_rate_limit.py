@@ -0,0 +1,125 @@
+"""
+Login rate limiting: sliding window counters of MemoryRateLimitStore on a fake clock,
+all-or-nothing counting of IP and login keys, eviction, and 429 of POST /auth before any statement
+"""
+import httpx
+import pytest
+
+from src.aggregator import metrics, rate_limit
+from src.aggregator.database.instrumentation import assert_query_budget
+from src.aggregator.rate_limit import MemoryRateLimitStore, RateLimitStore
+from src.setup import settings, setup_fastapi
+
+pytestmark = pytest.mark.anyio
+
+WINDOW = 60.0
+
+
+class FakeClock:
+    def __init__(self, now: float) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    # start of a window
+    return FakeClock(10 * WINDOW)
+
+
+@pytest.fixture
+def store(clock: FakeClock) -> MemoryRateLimitStore:
+    return MemoryRateLimitStore(evict_interval=WINDOW, clock=clock)
+
+
+def test_store_is_abstract():
+    with pytest.raises(TypeError):
+        RateLimitStore()
+
+
+async def test_limit_within_window(store):
+    key = ('ip:1', 3, WINDOW)
+
+    for _ in range(3):
+        assert await store.hit([key]) == [0]
+
+    # full current window: the next one starts in WINDOW seconds and the count fades out from there
+    assert await store.hit([key]) == [pytest.approx(WINDOW)]
+
+
+async def test_previous_window_is_weighted(store, clock):
+    key = ('ip:1', 3, WINDOW)
+    for _ in range(3):
+        await store.hit([key])
+
+    # half of the previous window is inside the sliding window: 3 * 0.5 + current count
+    clock.now += WINDOW + 30
+    assert await store.hit([key]) == [0]  # 1.5 + 0
+    assert await store.hit([key]) == [0]  # 1.5 + 1
+    retry_after = (await store.hit([key]))[0]  # 1.5 + 2 is over the limit
+
+    # 3 * (1 - offset / WINDOW) + 2 < 3 after offset 40, i.e. 10 seconds later
+    assert retry_after == pytest.approx(10)
+    clock.now += retry_after - 0.01
+    assert (await store.hit([key]))[0] > 0
+    clock.now += 0.02
+    assert await store.hit([key]) == [0]
+
+
+async def test_rejected_attempt_is_not_counted_under_any_key(store):
+    login, ip = ('login:user', 2, WINDOW), ('ip:1', 1, WINDOW)
+
+    assert await store.hit([login, ip]) == [0, 0]
+    # rejected by IP: the login key must not be charged
+    retry_afters = await store.hit([login, ip])
+    assert retry_afters[0] == 0 and retry_afters[1] > 0
+
+    assert await store.hit([login]) == [0]
+    assert (await store.hit([login]))[0] > 0
+
+
+async def test_evict_drops_finished_windows(store, clock):
+    await store.hit([('ip:1', 3, WINDOW)])
+    await store.hit([('ip:2', 3, WINDOW)])
+    assert len(store) == 2
+
+    # counts of two windows ago do not affect the sliding window any more
+    clock.now += 2 * WINDOW
+    await store.hit([('ip:3', 3, WINDOW)])
+    assert len(store) == 1
+
+
+async def test_check_login_attempt_counts_ip_and_login(monkeypatch, store):
+    monkeypatch.setattr(settings.rate_limit, 'ip_limit', 1)
+    monkeypatch.setattr(settings.rate_limit, 'ip_window', WINDOW)
+    monkeypatch.setattr(settings.rate_limit, 'login_limit', 10)
+    monkeypatch.setattr(rate_limit, 'get_store', lambda: store)
+    limited = dict(metrics.login_attempts_limited._values)
+
+    assert await rate_limit.check_login_attempt('127.0.0.1', 'User') == 0
+    # retry after is rounded up to whole seconds
+    assert await rate_limit.check_login_attempt('127.0.0.1', ' user ') == WINDOW
+    # another address is limited only by the login, which counted one attempt
+    assert await rate_limit.check_login_attempt('127.0.0.2', 'user') == 0
+
+    assert metrics.login_attempts_limited._values[('ip',)] == limited.get(('ip',), 0) + 1
+    assert metrics.login_attempts_limited._values.get(('login',), 0) == limited.get(('login',), 0)
+
+
+async def test_limited_login_is_rejected_before_database(monkeypatch, store):
+    monkeypatch.setattr(settings.rate_limit, 'enabled', True)
+    monkeypatch.setattr(settings.rate_limit, 'ip_limit', 1)
+    monkeypatch.setattr(settings.rate_limit, 'ip_window', WINDOW)
+    monkeypatch.setattr(rate_limit, 'get_store', lambda: store)
+    # the only allowed attempt of this address is used up
+    await store.hit([('ip:127.0.0.1', 1, WINDOW)])
+
+    transport = httpx.ASGITransport(app=setup_fastapi(), client=('127.0.0.1', 12345))
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        with assert_query_budget(max_queries=0):
+            response = await client.post('/auth', data={'username': 'user', 'password': 'password'})
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == str(int(WINDOW))